@@ -8,10 +8,11 @@ django.setup()
 
 from listings.models import Listing
 
-listings = Listing.objects.all()
+listings = Listing.objects.select_related('owner').order_by('pk')
 print(f"Number of listings: {listings.count()}")
 
-for listing in listings:
+# Stream rows in chunks instead of caching the whole table
+for listing in listings.iterator(chunk_size=2000):
     print(f"ID: {listing.id}")
     print(f"Title: {listing.title}")
     print(f"Price: {listing.price}")
@@ -19,4 +20,4 @@ for listing in listings:
     print(f"Condition: {listing.condition}")
     print(f"Owner: {listing.owner.username}")
     print(f"Image: {listing.image}")
-    print("-" * 50) 
\ No newline at end of file
+    print("-" * 50) 
@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class ListingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'listings'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from marketplace.metrics import registry
+        from .cache import listing_cache
+
+        def cache_metrics():
+            stats = listing_cache.stats()
+            return [
+                ('listing_cache_hits_total', 'Listing response cache hits.', 'counter', stats['hits']),
+                ('listing_cache_misses_total', 'Listing response cache misses.', 'counter', stats['misses']),
+            ]
+
+        registry.register_collector(cache_metrics)
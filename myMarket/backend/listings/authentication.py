@@ -0,0 +1,135 @@
+"""
+JWT authentication that doesn't load the User row on every request.
+
+CachedJWTAuthentication keeps the user fields views read (id, names, email,
+flags and dates) in the AUTH_USER_CACHE_ALIAS cache for AUTH_USER_CACHE_TIMEOUT
+seconds and builds a User from them. On a miss, GET, HEAD and OPTIONS requests
+are served from the username and email claims that access tokens carry (see
+TokenObtainPairWithClaimsSerializer), so read-only endpoints never touch the
+users table for authentication; other methods load the user and cache it.
+
+User signals (signals.py) drop the cached entry on every save. Deactivating or
+deleting a user also leaves a revocation marker for the access token lifetime,
+so neither the cache nor the claims can authenticate their tokens afterwards.
+Changing the username or email leaves a marker with the time of the change,
+and claims of tokens issued before it are ignored.
+Markers live in the cache too, so claims are only trusted when it is shared
+by every process (Redis, not locmem): a marker set by one process must be
+seen by the others. Otherwise every cache miss loads the user, and a stale
+entry lasts AUTH_USER_CACHE_TIMEOUT at most. Flushing the cache still lets a
+deactivated user's unexpired tokens read again until they expire.
+
+Users built here are not complete: saving one raises TypeError. Load the row
+with User.objects.get(pk=request.user.pk) before changing it.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .cache import is_shared
+
+CACHED_FIELDS = [
+    'id', 'username', 'email', 'first_name', 'last_name',
+    'is_active', 'is_staff', 'is_superuser', 'last_login', 'date_joined',
+]
+CLAIMS = ['username', 'email']
+
+
+def _cache():
+    return caches[settings.AUTH_USER_CACHE_ALIAS]
+
+
+def user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def revoked_key(user_id):
+    return f'auth:revoked:{user_id}'
+
+
+def claims_key(user_id):
+    return f'auth:claims:{user_id}'
+
+
+def forget_user(user, deleted=False, claims_changed=False):
+    """
+    Drop ``user`` from the cache, and revoke their tokens if they can no longer
+    log in. ``claims_changed`` stops trusting the claims of their current tokens.
+    """
+    cache = _cache()
+    cache.delete(user_key(user.pk))
+    if claims_changed:
+        cache.set(claims_key(user.pk), int(time.time()), api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+    if deleted or not user.is_active:
+        cache.set(revoked_key(user.pk), True, api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+    else:
+        cache.delete(revoked_key(user.pk))
+
+
+def _refuse_save(*args, **kwargs):
+    raise TypeError('Users from CachedJWTAuthentication are partial; load the row before saving')
+
+
+def build_user(fields):
+    user = User(**fields)
+    user._state.adding = False
+    user._state.db = DEFAULT_DB_ALIAS
+    user.save = _refuse_save
+    return user
+
+
+def authenticate(request):
+    """The user a plain Django view's ``request`` carries a valid token for, or None."""
+    try:
+        result = CachedJWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken):
+        return None
+    return result[0] if result else None
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_user(validated_token, trust_claims=request.method in SAFE_METHODS), validated_token
+
+    def get_user(self, validated_token, trust_claims=False):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Needs the current password hash
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        cache = _cache()
+        cached = cache.get_many([user_key(user_id), revoked_key(user_id), claims_key(user_id)])
+        if revoked_key(user_id) in cached:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        fields = cached.get(user_key(user_id))
+        trust_claims = trust_claims and is_shared(settings.AUTH_USER_CACHE_ALIAS)
+        # Tokens issued up to the second of a username or email change may carry the old values
+        trust_claims = trust_claims and validated_token.get('iat', 0) > cached.get(claims_key(user_id), 0)
+        if fields is None and trust_claims and all(claim in validated_token for claim in CLAIMS):
+            fields = {claim: validated_token[claim] for claim in CLAIMS}
+            fields.update(id=User._meta.pk.to_python(user_id), is_active=True)
+        if fields is None:
+            user = super().get_user(validated_token)
+            fields = {name: getattr(user, name) for name in CACHED_FIELDS}
+            cache.set(user_key(user_id), fields, settings.AUTH_USER_CACHE_TIMEOUT)
+            return user
+        if not fields['is_active']:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return build_user(fields)
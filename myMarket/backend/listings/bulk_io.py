@@ -0,0 +1,246 @@
+"""
+Streaming import and export of listings and orders (see the import_listings
+and export_data commands).
+
+Records are read, written and committed one batch at a time, so memory stays
+flat however large the file is. Exports walk the table in primary key order
+through QuerySet.iterator(), which uses a server-side cursor on Postgres and
+fetches rows in chunks elsewhere, and never build model instances.
+
+Imports go through bulk_create, which bypasses Listing's post_save signals;
+ListingImporter does their work once per batch instead: it indexes the new
+rows for search, queues image variants, adjusts the facet counts, logs the
+starting prices and invalidates the listing cache. Each batch commits together with its
+ImportCheckpoint, so an interrupted import resumes after the last committed
+batch without duplicating rows.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import reset_queries, transaction
+from django.utils import timezone
+
+from . import facets, geo, prices
+from .cache import LISTINGS_TAG, listing_cache
+from .models import ImageJob, ImportCheckpoint, Listing, OrderItem
+from .search import get_search_backend
+
+FORMATS = ('csv', 'jsonl')
+
+LISTING_COLUMNS = [
+    ('id', 'id'),
+    ('title', 'title'),
+    ('description', 'description'),
+    ('price', 'price'),
+    ('category', 'category'),
+    ('condition', 'condition'),
+    ('owner', 'owner__username'),
+    ('is_active', 'is_active'),
+    ('image', 'image'),
+    ('view_count', 'view_count'),
+    ('latitude', 'latitude'),
+    ('longitude', 'longitude'),
+    ('created_at', 'created_at'),
+]
+
+# One row per order item, with its order's columns repeated
+ORDER_COLUMNS = [
+    ('order_id', 'order_id'),
+    ('user', 'order__user__username'),
+    ('status', 'order__status'),
+    ('order_total', 'order__total_price'),
+    ('stripe_session_id', 'order__stripe_session_id'),
+    ('ordered_at', 'order__created_at'),
+    ('item_id', 'id'),
+    ('listing_id', 'listing_id'),
+    ('listing_title', 'listing__title'),
+    ('quantity', 'quantity'),
+    ('price_at_time', 'price_at_time'),
+]
+
+EXPORTS = {
+    'listings': (Listing.objects.all(), LISTING_COLUMNS),
+    'orders': (OrderItem.objects.all(), ORDER_COLUMNS),
+}
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n'}
+MAX_PRICE = Decimal('100000000')
+
+
+def guess_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_records(stream, format):
+    if format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class RowError(ValueError):
+    pass
+
+
+class ListingImporter:
+    def __init__(self, job, batch_size=2000, create_owners=False):
+        self.job = job
+        self.batch_size = batch_size
+        self.create_owners = create_owners
+        self.search_backend = get_search_backend()
+        self.categories = {value for value, _ in Listing.CATEGORY_CHOICES}
+        self.conditions = {value for value, _ in Listing.CONDITION_CHOICES}
+
+    def run(self, records, on_batch=None, on_error=None):
+        """
+        Import ``records`` (dicts), skipping the ones a previous run of the same
+        job committed. Calls ``on_batch(position, imported)`` after each commit
+        and ``on_error(position, message)`` for each rejected record.
+        """
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(name=self.job)
+        position = checkpoint.position
+        for batch in batches(islice(records, position, None), self.batch_size):
+            with transaction.atomic():
+                listings, errors = self.build(batch, position)
+                Listing.objects.bulk_create(listings)
+                facets.adjust_listings([
+                    (listing.category, listing.condition, listing.price) for listing in listings if listing.is_active
+                ], 1)
+                if self.search_backend is not None:
+                    self.search_backend.index_many(listings)
+                prices.record_created(listings)
+                ImageJob.objects.bulk_create([
+                    ImageJob(model=Listing._meta.label_lower, object_id=listing.pk, field='image',
+                             source=listing.image.name)
+                    for listing in listings if listing.image
+                ])
+                position += len(batch)
+                ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(position=position, updated_at=timezone.now())
+                transaction.on_commit(lambda: listing_cache.invalidate(LISTINGS_TAG))
+            # With DEBUG on, each batch's multi-megabyte INSERT would stay in connection.queries
+            reset_queries()
+            if on_error is not None:
+                for record_position, message in errors:
+                    on_error(record_position, message)
+            if on_batch is not None:
+                on_batch(position, len(listings))
+        return position
+
+    def build(self, batch, position):
+        owners = self.resolve_owners({str(record.get('owner') or '').strip() for record in batch} - {''})
+        listings, errors = [], []
+        for offset, record in enumerate(batch):
+            try:
+                listings.append(self.build_listing(record, owners))
+            except RowError as e:
+                errors.append((position + offset + 1, str(e)))
+        return listings, errors
+
+    def resolve_owners(self, usernames):
+        owners = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        missing = usernames - owners.keys()
+        if missing and self.create_owners:
+            User.objects.bulk_create([User(username=name, password='!') for name in missing], ignore_conflicts=True)
+            owners.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        return owners
+
+    def build_listing(self, record, owners):
+        title = str(record.get('title') or '').strip()
+        if not title:
+            raise RowError('title is required')
+        owner = str(record.get('owner') or '').strip()
+        if owner not in owners:
+            raise RowError(f'unknown owner {owner!r}')
+        category = record.get('category') or 'Other'
+        if category not in self.categories:
+            raise RowError(f'unknown category {category!r}')
+        condition = record.get('condition')
+        if condition not in self.conditions:
+            raise RowError(f'unknown condition {condition!r}')
+        try:
+            price = Decimal(str(record.get('price'))).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise RowError(f'invalid price {record.get("price")!r}')
+        if not 0 <= price < MAX_PRICE:
+            raise RowError(f'price out of range {price}')
+        is_active = record.get('is_active')
+        if is_active in (None, ''):
+            is_active = True
+        elif not isinstance(is_active, bool):
+            value = str(is_active).strip().lower()
+            if value not in TRUE_VALUES | FALSE_VALUES:
+                raise RowError(f'invalid is_active {is_active!r}')
+            is_active = value in TRUE_VALUES
+        latitude, longitude = self.coordinate(record, 'latitude', 90), self.coordinate(record, 'longitude', 180)
+        if (latitude is None) != (longitude is None):
+            raise RowError('latitude and longitude must be given together')
+        return Listing(
+            title=title[:200],
+            description=record.get('description') or '',
+            price=price,
+            category=category,
+            condition=condition,
+            owner_id=owners[owner],
+            is_active=is_active,
+            image=record.get('image') or None,
+            latitude=latitude,
+            longitude=longitude,
+            # bulk_create skips Listing.save()
+            geohash=geo.encode(latitude, longitude),
+        )
+
+    @staticmethod
+    def coordinate(record, name, limit):
+        value = record.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise RowError(f'invalid {name} {value!r}')
+        if not -limit <= value <= limit:
+            raise RowError(f'{name} out of range {value}')
+        return value
+
+
+def export_rows(queryset, columns, after_id=0, chunk_size=2000):
+    """Yield ``columns`` value tuples for rows with a primary key above ``after_id``, in key order."""
+    return queryset.filter(pk__gt=after_id).order_by('pk').values_list(
+        *[lookup for _, lookup in columns]
+    ).iterator(chunk_size=chunk_size)
+
+
+class CSVWriter:
+    def __init__(self, stream, columns):
+        self.writer = csv.writer(stream)
+        self.writer.writerow([name for name, _ in columns])
+
+    def write(self, row):
+        self.writer.writerow(['' if value is None else value for value in row])
+
+
+class JSONLWriter:
+    def __init__(self, stream, columns):
+        self.stream = stream
+        self.names = [name for name, _ in columns]
+        self.encoder = DjangoJSONEncoder()
+
+    def write(self, row):
+        self.stream.write(self.encoder.encode(dict(zip(self.names, row))))
+        self.stream.write('\n')
+
+
+WRITERS = {'csv': CSVWriter, 'jsonl': JSONLWriter}
@@ -0,0 +1,113 @@
+"""
+Response cache for the public listing browse endpoints.
+
+Cached responses are keyed by the endpoint, the host and the normalized query
+parameters the endpoint actually reads, plus the current version of each tag
+the response depends on. Invalidating a tag just gives it a new version, so
+every key built from the old one stops matching and ages out of the backend.
+Tags are bumped from Listing and User signals (see signals.py).
+
+The backend is whichever Django cache LISTING_CACHE_ALIAS names: Redis when
+REDIS_URL is set. Invalidation only reaches the process that made it unless
+the cache is shared, so with a per-process backend (locmem, the default
+without REDIS_URL, or dummy) responses are not cached at all.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .search import tokenize
+
+LISTINGS_TAG = 'listings'
+
+
+def listing_tag(listing_id):
+    return f'listing:{listing_id}'
+
+
+def is_shared(alias):
+    """Whether the ``alias`` cache is the same one in every process (not locmem or dummy)."""
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
+class ResponseCache:
+    def __init__(self, alias, timeout, prefix):
+        self.alias = alias
+        self.timeout = timeout
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def tag_key(self, tag):
+        return f'{self.prefix}:tag:{tag}'
+
+    def tag_versions(self, tags):
+        keys = [self.tag_key(tag) for tag in tags]
+        versions = self.cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                # A fresh version for evicted tags, so stale entries can't match again
+                self.cache.add(key, time.time_ns(), None)
+                versions[key] = self.cache.get(key)
+        return [versions[key] for key in keys]
+
+    def invalidate(self, *tags):
+        version = time.time_ns()
+        self.cache.set_many({self.tag_key(tag): version for tag in tags}, None)
+
+    def key(self, request, endpoint, params, tags):
+        normalized = sorted(
+            (name, ' '.join(tokenize(value)) if name == 'search' else value.strip())
+            for name, value in request.query_params.items()
+            if name in params and value.strip()
+        )
+        raw = json.dumps([request.get_host(), request.scheme, endpoint, normalized, self.tag_versions(tags)])
+        return f'{self.prefix}:{endpoint}:{hashlib.sha1(raw.encode()).hexdigest()}'
+
+    def respond(self, request, endpoint, params, tags, build):
+        """Return the cached response for ``request``, or call ``build`` and cache a 200 result."""
+        if not is_shared(self.alias):
+            response = build()
+            response['X-Cache'] = 'BYPASS'
+            return response
+
+        key = self.key(request, endpoint, params, tags)
+        data = self.cache.get(key)
+        if data is not None:
+            with self._lock:
+                self.hits += 1
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        with self._lock:
+            self.misses += 1
+        response = build()
+        if response.status_code == 200:
+            self.cache.set(key, json.loads(JSONRenderer().render(response.data)), self.timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+listing_cache = ResponseCache(
+    alias=settings.LISTING_CACHE_ALIAS,
+    timeout=settings.LISTING_CACHE_TIMEOUT,
+    prefix='listing-cache',
+)
@@ -0,0 +1,95 @@
+import logging
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import facets, seller_stats
+from .cache import LISTINGS_TAG, listing_cache, listing_tag
+from .models import Cart, CartItem, CheckoutSession, Listing, Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutMismatch(ValueError):
+    """The amount paid differs from the total of the snapshotted cart lines."""
+
+
+def record_session(session_id, cart_id, user_id, lines):
+    """Snapshot the ``(listing_id, quantity, price)`` lines a payment session was created for."""
+    lines = [(listing_id, quantity, Decimal(price)) for listing_id, quantity, price in lines]
+    return CheckoutSession.objects.create(
+        session_id=session_id,
+        cart_id=cart_id,
+        user_id=user_id,
+        items=[[listing_id, quantity, str(price)] for listing_id, quantity, price in lines],
+        total_price=sum(price * quantity for _, quantity, price in lines),
+    )
+
+
+def complete_checkout(stripe_session_id, amount_total=None):
+    """
+    Turn a paid checkout session into an Order in one transaction and return
+    the order.
+
+    The order is built from the lines recorded by record_session() when the
+    session was created, so cart changes made while the payment was pending
+    don't leak into it; ``amount_total`` (in cents), when given, must match
+    their total. Only those lines are then removed from the cart.
+
+    The cart row is locked while the order is written, so concurrent deliveries
+    of the same webhook serialize; the second one finds the order already
+    recorded under ``stripe_session_id`` and returns it without doing any work.
+    Raises CheckoutSession.DoesNotExist when the session has no snapshot (yet).
+    """
+    try:
+        with transaction.atomic():
+            session = CheckoutSession.objects.get(session_id=stripe_session_id)
+            Cart.objects.select_for_update().filter(id=session.cart_id).first()
+
+            existing = Order.objects.filter(stripe_session_id=stripe_session_id).first()
+            if existing:
+                return existing
+
+            if amount_total is not None and int(amount_total) != int(session.total_price * 100):
+                raise CheckoutMismatch(
+                    f'Session {stripe_session_id} paid {amount_total} cents for a {session.total_price} cart'
+                )
+
+            lines = {listing_id: (quantity, Decimal(price)) for listing_id, quantity, price in session.items}
+            categories = dict(Listing.objects.filter(id__in=lines).values_list('id', 'category'))
+            listing_ids = list(categories)
+            if len(listing_ids) < len(lines):
+                logger.warning(
+                    "Checkout %s: %d listings were deleted after payment",
+                    stripe_session_id, len(lines) - len(listing_ids)
+                )
+            if not listing_ids:
+                return None
+
+            order = Order.objects.create(
+                user_id=session.user_id,
+                total_price=session.total_price,
+                stripe_session_id=stripe_session_id,
+                status='pending'
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, listing_id=listing_id, quantity=lines[listing_id][0],
+                          price_at_time=lines[listing_id][1], category=categories[listing_id])
+                for listing_id in listing_ids
+            ])
+            seller_stats.record_order(order)
+
+            sold = Listing.objects.filter(id__in=listing_ids, is_active=True)
+            # update() skips Listing signals, so facet counts and cached responses are handled here
+            facets.adjust_listings(sold.values_list('category', 'condition', 'price'), -1)
+            sold.update(is_active=False, updated_at=timezone.now())
+            CartItem.objects.filter(cart_id=session.cart_id, listing_id__in=listing_ids).delete()
+
+            transaction.on_commit(lambda: listing_cache.invalidate(
+                LISTINGS_TAG, *[listing_tag(listing_id) for listing_id in listing_ids]
+            ))
+            return order
+    except IntegrityError:
+        # Lost a race on the unique stripe_session_id to another delivery
+        return Order.objects.filter(stripe_session_id=stripe_session_id).first()
@@ -0,0 +1,122 @@
+"""
+Listing counts by category, condition and price bucket, for browse filters.
+
+Filtered and searched listings are counted with one grouped query over
+(category, condition, price bucket), which is then summed per facet. The
+unfiltered browse page reads ListingFacetCount instead, a table of the same
+groups for all active listings that is adjusted whenever a listing is
+created, edited, deactivated or deleted: from Listing signals (signals.py),
+and explicitly by the bulk paths that skip them (checkout and
+import_listings). rebuild_listing_facets recomputes it from scratch.
+"""
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+
+from .models import Listing, ListingFacetCount
+
+CENT = Decimal('0.01')
+
+
+def price_bucket(price):
+    # Unrefreshed listings may still hold the price as a str or float; bucket it as stored
+    price = Decimal(str(price)).quantize(CENT)
+    edges = settings.LISTING_PRICE_BUCKETS
+    for index in range(len(edges) - 1, 0, -1):
+        if price >= edges[index]:
+            return index
+    return 0
+
+
+def price_bucket_expression():
+    edges = settings.LISTING_PRICE_BUCKETS
+    return Case(
+        *[When(price__gte=edges[index], then=Value(index)) for index in range(len(edges) - 1, 0, -1)],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def facet_key(category, condition, price, is_active=True):
+    return (category, condition, price_bucket(price)) if is_active else None
+
+
+def listing_key(listing):
+    return facet_key(listing.category, listing.condition, listing.price, listing.is_active)
+
+
+def adjust(deltas):
+    """Apply ``{(category, condition, price_bucket): change}`` to the stored counts."""
+    deltas = {key: change for key, change in deltas.items() if key is not None and change}
+    if not deltas:
+        return
+    with transaction.atomic():
+        ListingFacetCount.objects.bulk_create([
+            ListingFacetCount(category=category, condition=condition, price_bucket=bucket)
+            for category, condition, bucket in deltas
+        ], ignore_conflicts=True)
+        keys = Q()
+        for category, condition, bucket in deltas:
+            keys |= Q(category=category, condition=condition, price_bucket=bucket)
+        ListingFacetCount.objects.filter(keys).update(count=F('count') + Case(
+            *[When(Q(category=category, condition=condition, price_bucket=bucket), then=Value(change))
+              for (category, condition, bucket), change in deltas.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        ))
+
+
+def adjust_listings(rows, sign):
+    """Add (``sign`` 1) or remove (-1) listings given as ``(category, condition, price)`` rows."""
+    adjust(Counter({key: sign * count for key, count in Counter(facet_key(*row) for row in rows).items()}))
+
+
+def stored_counts():
+    return ListingFacetCount.objects.filter(count__gt=0).values_list('category', 'condition', 'price_bucket', 'count')
+
+
+def grouped_counts(queryset):
+    return (
+        queryset.order_by()
+        .annotate(price_bucket=price_bucket_expression())
+        .values_list('category', 'condition', 'price_bucket')
+        .annotate(count=Count('pk'))
+    )
+
+
+def summarize(rows):
+    categories, conditions, buckets = Counter(), Counter(), Counter()
+    total = 0
+    for category, condition, bucket, count in rows:
+        categories[category] += count
+        conditions[condition] += count
+        buckets[bucket] += count
+        total += count
+    edges = settings.LISTING_PRICE_BUCKETS
+    return {
+        'total': total,
+        'category': [
+            {'value': value, 'label': label, 'count': categories[value]}
+            for value, label in Listing.CATEGORY_CHOICES
+        ],
+        'condition': [
+            {'value': value, 'label': label, 'count': conditions[value]}
+            for value, label in Listing.CONDITION_CHOICES
+        ],
+        'price': [
+            {'min': edge, 'max': edges[index + 1] if index + 1 < len(edges) else None, 'count': buckets[index]}
+            for index, edge in enumerate(edges)
+        ],
+    }
+
+
+def rebuild():
+    with transaction.atomic():
+        ListingFacetCount.objects.all().delete()
+        return len(ListingFacetCount.objects.bulk_create([
+            ListingFacetCount(category=category, condition=condition, price_bucket=bucket, count=count)
+            for category, condition, bucket, count in grouped_counts(Listing.objects.filter(is_active=True))
+        ]))
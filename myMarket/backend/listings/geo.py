@@ -0,0 +1,166 @@
+"""
+Proximity search over listing pickup locations without a spatial extension.
+
+Listing.save() stores the geohash of (latitude, longitude) at PRECISION
+characters in Listing.geohash, behind a B-tree index. A geohash cell of n
+characters is every code starting with those n characters, so it is one
+contiguous range of the index. Code that writes latitude/longitude without
+save() (bulk_create, QuerySet.update) must set geohash with encode() too.
+
+ListingNearFilter serves ``?near=lat,lng&radius=km``: covering_ranges() picks
+the finest cell size at which the circle's bounding box spans no more than
+GEO_MAX_CELLS cells, merges neighbouring cells into index ranges, and only
+rows inside those ranges get the exact haversine distance. Matches carry a
+``distance_km`` annotation and come nearest first unless another ordering
+was asked for. Works the same on SQLite and Postgres.
+"""
+import math
+
+from django.conf import settings
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# ~38m x 19m cells; the finest size a search can use
+PRECISION = 8
+EARTH_RADIUS_KM = 6371.0088
+
+
+def grid(precision):
+    """Rows (latitude) and columns (longitude) of the cell grid at ``precision``."""
+    bits = 5 * precision
+    return 2 ** (bits // 2), 2 ** ((bits + 1) // 2)
+
+
+def cell_of(lat, lng, precision):
+    rows, cols = grid(precision)
+    row = min(int((lat + 90) / 180 * rows), rows - 1)
+    col = int((lng + 180) / 360 * cols) % cols
+    return row, col
+
+
+def cell_value(row, col, precision):
+    """The cell's geohash as an integer: column and row bits interleaved, longitude first."""
+    lat_bits, lng_bits = (5 * precision) // 2, (5 * precision + 1) // 2
+    value = 0
+    for position in range(5 * precision):
+        if position % 2 == 0:
+            lng_bits -= 1
+            value = value << 1 | (col >> lng_bits) & 1
+        else:
+            lat_bits -= 1
+            value = value << 1 | (row >> lat_bits) & 1
+    return value
+
+
+def to_base32(value, precision):
+    return ''.join(BASE32[(value >> 5 * shift) & 31] for shift in range(precision - 1, -1, -1))
+
+
+def encode(lat, lng, precision=PRECISION):
+    """Geohash of a point, or '' when it has no coordinates."""
+    if lat is None or lng is None:
+        return ''
+    return to_base32(cell_value(*cell_of(lat, lng, precision), precision), precision)
+
+
+def bounding_box(lat, lng, radius_km):
+    """``(south, north, west, east)`` of the circle; west/east are None when it spans every longitude."""
+    angle = radius_km / EARTH_RADIUS_KM
+    south, north = lat - math.degrees(angle), lat + math.degrees(angle)
+    if south <= -90 or north >= 90 or math.sin(angle) >= math.cos(math.radians(lat)):
+        return max(south, -90), min(north, 90), None, None
+    spread = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(lat))))
+    return south, north, lng - spread, lng + spread
+
+
+def covering_ranges(lat, lng, radius_km, max_cells=None):
+    """
+    ``[(low, high), ...]`` geohash ranges (high None for open-ended) that
+    contain every point within ``radius_km`` of ``(lat, lng)``.
+    """
+    max_cells = max_cells or settings.GEO_MAX_CELLS
+    south, north, west, east = bounding_box(lat, lng, radius_km)
+    for precision in range(PRECISION, 0, -1):
+        rows, cols = grid(precision)
+        first_row, last_row = cell_of(south, 0, precision)[0], cell_of(north, 0, precision)[0]
+        if west is None:
+            columns = range(cols)
+        else:
+            first_col = math.floor((west + 180) / 360 * cols)
+            last_col = math.floor((east + 180) / 360 * cols)
+            columns = range(cols) if last_col - first_col + 1 >= cols else [
+                col % cols for col in range(first_col, last_col + 1)
+            ]
+        if (last_row - first_row + 1) * len(columns) <= max_cells or precision == 1:
+            break
+
+    values = sorted(
+        cell_value(row, col, precision) for row in range(first_row, last_row + 1) for col in columns
+    )
+    ranges = []
+    for value in values:
+        if ranges and ranges[-1][1] == value:
+            ranges[-1][1] = value + 1
+        else:
+            ranges.append([value, value + 1])
+    return [
+        (to_base32(low, precision), to_base32(high, precision) if high < 32 ** precision else None)
+        for low, high in ranges
+    ]
+
+
+def cells_filter(lat, lng, radius_km, max_cells=None):
+    condition = Q()
+    for low, high in covering_ranges(lat, lng, radius_km, max_cells):
+        condition |= Q(geohash__gte=low, geohash__lt=high) if high else Q(geohash__gte=low)
+    return condition
+
+
+def distance_km(lat, lng):
+    """Haversine distance in km from ``(lat, lng)`` to the row's latitude/longitude."""
+    lat_r, lng_r = math.radians(lat), math.radians(lng)
+    half_chord = Power(Sin((Radians(F('latitude')) - Value(lat_r)) / 2), 2) + (
+        Value(math.cos(lat_r)) * Cos(Radians(F('latitude')))
+        * Power(Sin((Radians(F('longitude')) - Value(lng_r)) / 2), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(half_chord), output_field=FloatField())
+
+
+def parse_near(near, radius):
+    """``(lat, lng, radius_km)`` from the query parameters, or ValidationError."""
+    try:
+        lat, lng = (float(part) for part in near.split(','))
+    except ValueError:
+        raise ValidationError({'near': 'Expected near=latitude,longitude'})
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValidationError({'near': 'Latitude must be within ±90 and longitude within ±180'})
+    try:
+        radius_km = float(radius) if radius else settings.GEO_DEFAULT_RADIUS_KM
+    except ValueError:
+        raise ValidationError({'radius': 'Expected a distance in km'})
+    if not 0 < radius_km <= settings.GEO_MAX_RADIUS_KM:
+        raise ValidationError({'radius': f'Radius must be above 0 and at most {settings.GEO_MAX_RADIUS_KM:g} km'})
+    return lat, lng, radius_km
+
+
+class ListingNearFilter(BaseFilterBackend):
+    near_param = 'near'
+    radius_param = 'radius'
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        if not params.get(self.near_param):
+            return queryset
+        lat, lng, radius_km = parse_near(params[self.near_param], params.get(self.radius_param))
+        queryset = queryset.filter(cells_filter(lat, lng, radius_km)).annotate(
+            distance_km=distance_km(lat, lng)
+        ).filter(distance_km__lte=radius_km)
+        ordered = params.get('ordering') or params.get('search') or (
+            params.get('filter') in getattr(view, 'filter_orderings', {})
+        )
+        if not ordered:
+            queryset = queryset.order_by('distance_km')
+        return queryset
@@ -0,0 +1,104 @@
+"""
+Resized copies of uploaded listing and profile images.
+
+Saving a Listing or UserProfile with a new image queues an ImageJob (see
+signals.py); the process_images worker renders the image at each width in
+IMAGE_VARIANT_WIDTHS and in each of IMAGE_VARIANT_FORMATS, without EXIF or
+other metadata, next to the original under ``<upload dir>/variants/``. It then
+stores the original's dimensions and the variant names on the row, in
+``<field>_width``, ``<field>_height`` and ``<field>_variants``:
+
+    {"source": "listings/bike.jpg",
+     "webp": {"320": "listings/variants/bike_jpg_320.webp", ...},
+     "jpeg": {"320": "listings/variants/bike_jpg_320.jpg", ...}}
+
+``source`` is the image the variants were made from; serializers ignore the
+variants once the image has been replaced and not yet reprocessed.
+"""
+import math
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Models and image fields that get variants
+IMAGE_FIELDS = {
+    'listings.listing': 'image',
+    'listings.userprofile': 'profile_picture',
+}
+
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'optimize': True, 'progressive': True}),
+}
+
+EXIF_ORIENTATION = 0x0112
+
+
+def variant_name(source, width, extension):
+    # The source extension keeps bike.jpg and bike.png from sharing variants
+    directory, filename = posixpath.split(source)
+    stem, source_extension = posixpath.splitext(filename)
+    stem = f"{stem}_{source_extension.lstrip('.')}" if source_extension else stem
+    return posixpath.join(directory, 'variants', f'{stem}_{width}.{extension}')
+
+
+def needs_variants(instance, field):
+    name = getattr(instance, field).name
+    return bool(name) and getattr(instance, f'{field}_variants', {}).get('source') != name
+
+
+def render_variants(source, widths=None, formats=None, quality=None, storage=None):
+    """
+    Render ``source`` (a storage name) at each width and format and save the
+    results to ``storage``. Returns ``(width, height, variants)``.
+    """
+    widths = widths or settings.IMAGE_VARIANT_WIDTHS
+    formats = formats or settings.IMAGE_VARIANT_FORMATS
+    quality = quality or settings.IMAGE_VARIANT_QUALITY
+    storage = storage or default_storage
+
+    with storage.open(source, 'rb') as f:
+        image = Image.open(f)
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+        # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding
+        # when even the largest variant is that much smaller than the original
+        scale = min(max(widths), width) / width
+        image.draft('RGB', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+        image = ImageOps.exif_transpose(image)
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    variants = {'source': source}
+    # Largest first, each step resized from the one before it
+    current = image
+    for target in sorted({min(w, width) for w in widths}, reverse=True):
+        if current.width != target:
+            current = current.resize(
+                (target, max(1, round(height * target / width))), Image.Resampling.LANCZOS, reducing_gap=3.0
+            )
+        for format_name in formats:
+            pillow_format, extension, options = FORMATS[format_name]
+            frame = current.convert('RGB') if pillow_format == 'JPEG' and current.mode != 'RGB' else current
+            buffer = BytesIO()
+            frame.save(buffer, pillow_format, quality=quality, **options)
+            name = variant_name(source, target, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            variants.setdefault(format_name, {})[str(target)] = storage.save(name, ContentFile(buffer.getvalue()))
+    return width, height, variants
+
+
+def delete_variants(variants, storage=None):
+    storage = storage or default_storage
+    for format_name, names in variants.items():
+        if format_name == 'source':
+            continue
+        for name in names.values():
+            storage.delete(name)
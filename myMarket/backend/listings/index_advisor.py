@@ -0,0 +1,183 @@
+"""
+Index advice and plan checks for the hot list endpoints.
+
+access_paths() turns a viewset's filterset_fields, ordering_fields and
+``filter`` shortcuts into the list requests clients actually send, and
+build_queryset() runs each through the viewset's own get_queryset() and
+filter backends, so the queries examined are exactly the ones served.
+
+advise() reads each query's equality filters and ORDER BY and proposes a
+composite index of the filter columns followed by the sort columns, partial on
+the boolean filters (``WHERE is_active``) every public listing query carries.
+Candidates already served by an index declared in the model's Meta.indexes
+are reported as covered.
+
+explain() runs EXPLAIN on the page query and reports sequential scans of
+the endpoint's tables; see the check_query_plans command.
+"""
+import re
+from dataclasses import dataclass, field
+
+from django.db import connection, models, transaction
+from django.db.models.expressions import Col
+from django.db.models.lookups import Exact
+from django.db.models.sql.where import AND
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory
+
+from .models import Listing
+from .views import ListingViewSet, OrderViewSet
+
+HOT_VIEWSETS = [ListingViewSet, OrderViewSet]
+
+SAMPLE_VALUES = {
+    'category': Listing.CATEGORY_CHOICES[0][0],
+    'condition': Listing.CONDITION_CHOICES[0][0],
+    'is_active': 'true',
+}
+
+
+@dataclass
+class AccessPath:
+    viewset: type
+    params: dict
+
+    def __str__(self):
+        query = '&'.join(f'{name}={value}' for name, value in self.params.items())
+        return f'{self.viewset.__name__} ?{query}'
+
+
+@dataclass(frozen=True)
+class Candidate:
+    model: type
+    fields: tuple
+    condition: tuple = field(default=())
+
+    def as_index(self):
+        condition = dict(self.condition)
+        return models.Index(fields=list(self.fields), condition=models.Q(**condition) if condition else None,
+                            name=self.name())
+
+    def name(self):
+        columns = '_'.join(name.lstrip('-').replace('_', '')[:6] for name in self.fields)
+        suffix = '_act' if self.condition else ''
+        return f'{self.model._meta.model_name[:4]}_{columns}{suffix}'[:30]
+
+    def reversed(self, equalities):
+        # A B-tree scanned backwards serves the opposite sort direction
+        sorts = [name[1:] if name.startswith('-') else f'-{name}' for name in self.fields[equalities:]]
+        return Candidate(self.model, self.fields[:equalities] + tuple(sorts), self.condition)
+
+    def __str__(self):
+        condition = ', '.join(f'{name}={value!r}' for name, value in self.condition)
+        where = f', condition=models.Q({condition})' if condition else ''
+        return f"{self.model.__name__}: models.Index(fields={list(self.fields)!r}{where}, name={self.name()!r})"
+
+
+def access_paths(viewset):
+    paths = [AccessPath(viewset, {})]
+    shortcuts = {'popular', 'price_low', 'price_high', 'my_listings'} if viewset is ListingViewSet else set()
+    for shortcut in sorted(shortcuts):
+        paths.append(AccessPath(viewset, {'filter': shortcut}))
+    for name in getattr(viewset, 'filterset_fields', []):
+        if name in SAMPLE_VALUES or name == 'owner':
+            paths.append(AccessPath(viewset, {name: SAMPLE_VALUES.get(name, '<user>')}))
+    for name in getattr(viewset, 'ordering_fields', []):
+        paths.append(AccessPath(viewset, {'ordering': f'-{name}'}))
+    if viewset is ListingViewSet:
+        paths.append(AccessPath(viewset, {'near': '40.7128,-74.0060', 'radius': '10'}))
+    return paths
+
+
+def build_queryset(path, user):
+    params = {name: user.pk if value == '<user>' else value for name, value in path.params.items()}
+    request = APIRequestFactory().get('/', params)
+    view = path.viewset(action_map={'get': 'list'}, format_kwarg=None, args=(), kwargs={})
+    view.request = view.initialize_request(request)
+    view.request.user = user
+    return view.filter_queryset(view.get_queryset())
+
+
+def page_queryset(queryset):
+    return queryset[:api_settings.PAGE_SIZE or 10]
+
+
+def query_shape(queryset):
+    """
+    ``(equality columns, boolean conditions, order_by, other filters)`` of a
+    queryset; other filters counts the WHERE terms an index can't express.
+    """
+    equalities, conditions, other = [], {}, 0
+    where = queryset.query.where
+    children = where.children if where.connector == AND and not where.negated else [where]
+    for child in children:
+        if isinstance(child, Exact) and isinstance(child.lhs, Col) and child.lhs.alias == queryset.model._meta.db_table:
+            target = child.lhs.target
+            if isinstance(target, models.BooleanField):
+                conditions[target.name] = child.rhs
+            else:
+                equalities.append(target.name)
+        else:
+            other += 1
+    ordering = [name for name in queryset.query.order_by if isinstance(name, str) and '__' not in name]
+    ordering = [name for name in ordering if _is_field(queryset.model, name.lstrip('-'))]
+    return equalities, sorted(conditions.items()), ordering, other
+
+
+def _is_field(model, name):
+    try:
+        model._meta.get_field('id' if name == 'pk' else name)
+        return True
+    except Exception:
+        return False
+
+
+def covered(candidate, equalities):
+    """Whether an existing index starts with the candidate's columns, in either direction, without a narrower condition."""
+    for index in candidate.model._meta.indexes:
+        prefix = tuple(index.fields[:len(candidate.fields)])
+        if prefix not in (candidate.fields, candidate.reversed(equalities).fields):
+            continue
+        if index.condition is None or sorted(index.condition.children) == list(candidate.condition):
+            return True
+    return False
+
+
+def advise(user):
+    """Return ``(access path, candidate index, already covered)`` for each distinct candidate."""
+    advice = {}
+    for viewset in HOT_VIEWSETS:
+        for path in access_paths(viewset):
+            queryset = build_queryset(path, user)
+            equalities, conditions, ordering, other = query_shape(queryset)
+            # The pk tiebreak is implicit in every index
+            ordering = [name for name in ordering if name.lstrip('-') not in ('pk', 'id')]
+            if other or not (equalities or ordering):
+                continue
+            equalities = list(dict.fromkeys(equalities))
+            candidate = Candidate(queryset.model, tuple(equalities + ordering), tuple(conditions))
+            if candidate not in advice and candidate.reversed(len(equalities)) not in advice:
+                advice[candidate] = (path, covered(candidate, len(equalities)))
+    return [(path, candidate, is_covered) for candidate, (path, is_covered) in advice.items()]
+
+
+SQLITE_SCAN = re.compile(r'\bSCAN (\w+)(?! USING)(?:\s|$)')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def sequential_scans(plan, tables):
+    pattern = POSTGRES_SCAN if connection.vendor == 'postgresql' else SQLITE_SCAN
+    return sorted({table for table in pattern.findall(plan) if table in tables})
+
+
+def explain(path, user):
+    """Return ``(plan, sequentially scanned tables)`` for the page query of ``path``."""
+    queryset = page_queryset(build_queryset(path, user))
+    tables = {queryset.model._meta.db_table}
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # Small tables make a seq scan cheapest; ask whether an index path exists at all
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+    return plan, sequential_scans(plan, tables)
@@ -0,0 +1,26 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from listings.index_advisor import advise
+
+
+class Command(BaseCommand):
+    help = 'Propose composite/partial indexes for the filter and ordering paths of the hot list endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username the requests are made as; defaults to the first user')
+        parser.add_argument('--all', action='store_true', help='Also list candidates existing indexes already cover')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        user = users.filter(username=options['user']).first() if options['user'] else users.first()
+        if user is None:
+            raise CommandError('Needs a user to build authenticated requests')
+
+        missing = 0
+        for path, candidate, is_covered in advise(user):
+            if is_covered and not options['all']:
+                continue
+            missing += not is_covered
+            self.stdout.write(f"{'covered' if is_covered else 'missing'}  {path}\n    {candidate}")
+        self.stdout.write(f'{missing} missing indexes')
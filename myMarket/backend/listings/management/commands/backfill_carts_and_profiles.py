@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from listings.models import Cart, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Create the cart and profile of every user that lacks one (new users get both at signup)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        for model, lookup in ((Cart, 'cart__isnull'), (UserProfile, 'profile__isnull')):
+            user_ids = list(User.objects.filter(**{lookup: True}).values_list('id', flat=True))
+            # ignore_conflicts covers rows created by signups while this runs
+            model.objects.bulk_create(
+                [model(user_id=user_id) for user_id in user_ids],
+                batch_size=options['batch_size'], ignore_conflicts=True,
+            )
+            self.stdout.write(self.style.SUCCESS(f'Created {len(user_ids)} {model._meta.verbose_name_plural}'))
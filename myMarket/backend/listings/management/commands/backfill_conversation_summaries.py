@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from listings.models import Conversation, ConversationParticipant, Message
+
+
+class Command(BaseCommand):
+    help = 'Rebuild last-message pointers and per-participant unread counters (from read watermarks) for existing conversations'
+
+    def handle(self, *args, **options):
+        total = 0
+        conversations = Conversation.objects.prefetch_related('participants').iterator(chunk_size=500)
+        for conversation in conversations:
+            with transaction.atomic():
+                conversation.last_message = (
+                    Message.objects.filter(conversation=conversation).order_by('-created_at', '-id').first()
+                )
+                conversation.save(update_fields=['last_message'])
+
+                for user in conversation.participants.all():
+                    state, _ = ConversationParticipant.objects.get_or_create(conversation=conversation, user=user)
+                    state.unread_count = conversation.get_unread_count(user)
+                    state.save(update_fields=['unread_count'])
+            total += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {total} conversations'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from listings.models import Listing, PriceChange
+
+
+class Command(BaseCommand):
+    help = 'Log the current price of every listing without price history, as of its creation (new listings get one on save)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rows = list(Listing.objects.filter(price_changes__isnull=True).values_list('id', 'price', 'created_at'))
+        PriceChange.objects.bulk_create([
+            PriceChange(listing_id=listing_id, price=price, changed_at=created_at)
+            for listing_id, price, created_at in rows
+        ], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Logged {len(rows)} starting prices'))
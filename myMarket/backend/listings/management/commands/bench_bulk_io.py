@@ -0,0 +1,93 @@
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from listings.bulk_io import LISTING_COLUMNS, JSONLWriter, ListingImporter, export_rows, read_records
+from listings.models import Listing
+
+CATEGORIES = [value for value, _ in Listing.CATEGORY_CHOICES]
+CONDITIONS = [value for value, _ in Listing.CONDITION_CHOICES]
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a JSONL catalog, import it with import_listings batching and export it back, '
+        'reporting throughput and peak memory against per-row create() and an unstreamed export. '
+        'Imported rows are kept, so point DATABASE_URL at a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--naive-rows', type=int, default=10_000, help='Rows for the per-row baselines')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        owner, _ = User.objects.get_or_create(username='bench-bulk-io')
+        rng = random.Random(0)
+        path = tempfile.mktemp(suffix='.jsonl')
+        try:
+            start = time.perf_counter()
+            with open(path, 'w') as f:
+                for i in range(options['rows']):
+                    f.write(json.dumps({
+                        'title': f'Bench item {i}',
+                        'description': 'Lorem ipsum dolor sit amet ' * rng.randint(1, 8),
+                        'price': f'{rng.uniform(1, 500):.2f}',
+                        'category': rng.choice(CATEGORIES),
+                        'condition': rng.choice(CONDITIONS),
+                        'owner': owner.username,
+                    }) + '\n')
+            self.stdout.write(
+                f"Wrote {options['rows']} records ({os.path.getsize(path) / 2**20:.0f} MiB) "
+                f'in {time.perf_counter() - start:.1f}s'
+            )
+
+            with open(path) as f:
+                records = list(islice(read_records(f, 'jsonl'), options['naive_rows']))
+            start = time.perf_counter()
+            for record in records:
+                Listing.objects.create(
+                    title=record['title'], description=record['description'], price=record['price'],
+                    category=record['category'], condition=record['condition'], owner=owner,
+                )
+            self.report('import, create() per row', len(records), time.perf_counter() - start)
+
+            importer = ListingImporter(f'bench-bulk-io:{path}', options['batch_size'])
+            start = time.perf_counter()
+            with open(path) as f:
+                count = importer.run(read_records(f, 'jsonl'))
+            self.report('import, batched', count, time.perf_counter() - start)
+
+            queryset = Listing.objects.filter(owner=owner)
+            with open(os.devnull, 'w') as devnull:
+                writer = JSONLWriter(devnull, LISTING_COLUMNS)
+                start = time.perf_counter()
+                count = 0
+                for row in export_rows(queryset, LISTING_COLUMNS):
+                    writer.write(row)
+                    count += 1
+                self.report('export, streamed', count, time.perf_counter() - start)
+
+                # Caches every model instance first; run last since peak RSS only grows
+                start = time.perf_counter()
+                count = 0
+                for listing in queryset.select_related('owner').order_by('pk'):
+                    writer.write([listing.id, listing.title, listing.description, listing.price,
+                                  listing.category, listing.condition, listing.owner.username,
+                                  listing.is_active, listing.image.name, listing.view_count, listing.created_at])
+                    count += 1
+                self.report('export, unstreamed', count, time.perf_counter() - start)
+        finally:
+            os.remove(path)
+
+    def report(self, label, count, elapsed):
+        # ru_maxrss is KiB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(f'{label}: {count} rows in {elapsed:.1f}s, {count / elapsed:.0f} rows/s, peak RSS {peak:.0f} MiB')
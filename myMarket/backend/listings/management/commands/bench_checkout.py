@@ -0,0 +1,52 @@
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from listings.checkout import complete_checkout, record_session
+from listings.models import Cart, CartItem, Listing
+
+
+class Command(BaseCommand):
+    help = 'Time complete_checkout() for large carts, including a redelivered webhook per run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100)
+        parser.add_argument('--runs', type=int, default=10)
+
+    def handle(self, *args, **options):
+        buyer, _ = User.objects.get_or_create(username='bench-checkout-buyer')
+        seller, _ = User.objects.get_or_create(username='bench-checkout-seller')
+        cart, _ = Cart.objects.get_or_create(user=buyer)
+        try:
+            timings, queries = [], []
+            for _ in range(options['runs']):
+                listings = Listing.objects.bulk_create([
+                    Listing(title=f'Bench {i}', description='', price=i + 1, category='Other',
+                            condition='New', owner=seller)
+                    for i in range(options['items'])
+                ])
+                CartItem.objects.bulk_create([CartItem(cart=cart, listing=listing) for listing in listings])
+
+                session_id = f'bench_{uuid.uuid4().hex}'
+                record_session(session_id, cart.id, buyer.id,
+                               cart.items.values_list('listing_id', 'quantity', 'listing__price'))
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.perf_counter()
+                    complete_checkout(session_id)
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(len(ctx.captured_queries))
+
+                redelivered = complete_checkout(session_id)
+                assert redelivered.items.count() == options['items']
+
+            self.stdout.write(
+                f"{options['items']}-item checkout: avg {sum(timings) / len(timings):.1f}ms, "
+                f"max {max(timings):.1f}ms, {max(queries)} queries"
+            )
+        finally:
+            buyer.delete()
+            seller.delete()
@@ -0,0 +1,88 @@
+import math
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import reset_queries
+
+from listings import geo
+from listings.models import Listing
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed synthetic listings with pickup locations clustered around cities and compare '
+        '?near= searches pruned by geohash cells with a full scan computing every distance. '
+        'Seeded rows are kept for reuse, so point DATABASE_URL at a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1_000_000)
+        parser.add_argument('--cities', type=int, default=200)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--scan-queries', type=int, default=5, help='Full scans are slow; run fewer of them')
+        parser.add_argument('--radius', type=float, action='append', help='km, repeatable (default 2, 10, 50)')
+        parser.add_argument('--max-cells', type=int, action='append', help='Repeatable (default GEO_MAX_CELLS)')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        cities = [(rng.uniform(-50, 60), rng.uniform(-180, 180)) for _ in range(options['cities'])]
+
+        owner, _ = User.objects.get_or_create(username='bench-geo')
+        missing = options['listings'] - Listing.objects.filter(owner=owner).count()
+        if missing > 0:
+            start = time.perf_counter()
+            for offset in range(0, missing, options['batch_size']):
+                listings = []
+                for _ in range(min(options['batch_size'], missing - offset)):
+                    lat, lng = self.point_near(rng, *rng.choice(cities))
+                    listings.append(Listing(
+                        title='bench', description='', price=rng.randint(1, 500), category='Other',
+                        condition='Good', owner=owner, latitude=lat, longitude=lng, geohash=geo.encode(lat, lng),
+                    ))
+                Listing.objects.bulk_create(listings)
+                reset_queries()
+            self.stdout.write(f'Seeded {missing} listings in {time.perf_counter() - start:.1f}s')
+
+        centres = [self.point_near(rng, *rng.choice(cities)) for _ in range(options['queries'])]
+        for radius in options['radius'] or [2, 10, 50]:
+            self.stdout.write(f'radius {radius:g} km')
+            for max_cells in options['max_cells'] or [None]:
+                self.report(f'cells (max {max_cells or "default"})', centres, radius, max_cells)
+            self.report('full scan', centres[:options['scan_queries']], radius, None, prune=False)
+
+    @staticmethod
+    def point_near(rng, lat, lng):
+        # Most points within ~20km of the city centre, a tail further out
+        distance, bearing = abs(rng.gauss(0, 0.15)), rng.uniform(0, 2 * math.pi)
+        lat = max(-89.9, min(89.9, lat + distance * math.cos(bearing)))
+        lng = (lng + distance * math.sin(bearing) / math.cos(math.radians(lat)) + 540) % 360 - 180
+        return lat, lng
+
+    def report(self, label, centres, radius, max_cells, prune=True):
+        timings, candidates, matches = [], 0, 0
+        for lat, lng in centres:
+            queryset = Listing.objects.filter(is_active=True)
+            if prune:
+                queryset = queryset.filter(geo.cells_filter(lat, lng, radius, max_cells))
+            start = time.perf_counter()
+            nearest = list(queryset.annotate(distance_km=geo.distance_km(lat, lng)).filter(
+                distance_km__lte=radius
+            ).order_by('distance_km').values_list('id', flat=True)[:20])
+            timings.append((time.perf_counter() - start) * 1000)
+            if prune:
+                candidates += queryset.count()
+                matches += queryset.annotate(distance_km=geo.distance_km(lat, lng)).filter(
+                    distance_km__lte=radius
+                ).count()
+            reset_queries()
+        timings.sort()
+        p50 = timings[len(timings) // 2]
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        line = f'{label:>20}: p50 {p50:9.2f}ms  p95 {p95:9.2f}ms'
+        if prune:
+            line += f'  rows checked {candidates / len(centres):9.0f}  in radius {matches / len(centres):8.0f}'
+        self.stdout.write(line)
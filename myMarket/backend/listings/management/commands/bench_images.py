@@ -0,0 +1,94 @@
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw, ImageOps
+
+from listings.images import FORMATS, render_variants, variant_name
+
+
+class Command(BaseCommand):
+    help = 'Time rendering variants for a backlog of camera-sized images, naive vs the process_images pipeline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=40)
+        parser.add_argument('--width', type=int, default=4000)
+        parser.add_argument('--height', type=int, default=3000)
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        location = tempfile.mkdtemp(prefix='bench-images-')
+        storage = FileSystemStorage(location=location)
+        try:
+            sources = self.make_originals(storage, options['images'], options['width'], options['height'])
+            original_bytes = sum(storage.size(name) for name in sources)
+
+            elapsed = self.run(lambda name: self.naive(storage, name), sources, 1)
+            self.report('naive, serial', elapsed, len(sources))
+
+            elapsed = self.run(lambda name: render_variants(name, storage=storage), sources, 1)
+            self.report('pipeline, serial', elapsed, len(sources))
+
+            results = []
+            elapsed = self.run(lambda name: results.append(render_variants(name, storage=storage)),
+                               sources, options['workers'])
+            self.report(f"pipeline, {options['workers']} workers", elapsed, len(sources))
+
+            variant_bytes = {}
+            for _, _, variants in results:
+                for format_name, names in variants.items():
+                    if format_name != 'source':
+                        for width, name in names.items():
+                            key = f'{format_name} {width}w'
+                            variant_bytes[key] = variant_bytes.get(key, 0) + storage.size(name)
+            self.stdout.write(f'original: {original_bytes / len(sources) / 1024:.0f} KiB/image')
+            for key, size in sorted(variant_bytes.items()):
+                self.stdout.write(f'{key}: {size / len(sources) / 1024:.0f} KiB/image')
+        finally:
+            shutil.rmtree(location)
+
+    def make_originals(self, storage, count, width, height):
+        rng = random.Random(0)
+        sources = []
+        for i in range(count):
+            # Gradient plus shapes and noise so encoders have real work to do
+            image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+            draw = ImageDraw.Draw(image)
+            for _ in range(30):
+                x, y = rng.randrange(width), rng.randrange(height)
+                draw.ellipse((x, y, x + rng.randrange(50, 800), y + rng.randrange(50, 800)),
+                             fill=tuple(rng.randrange(256) for _ in range(3)))
+            image = Image.blend(image, Image.effect_noise((width, height), 40).convert('RGB'), 0.15)
+            buffer = BytesIO()
+            image.save(buffer, 'JPEG', quality=92)
+            sources.append(storage.save(f'listings/original_{i}.jpg', ContentFile(buffer.getvalue())))
+        return sources
+
+    def naive(self, storage, source):
+        # Full-size decode, and every width resized from the original
+        with storage.open(source, 'rb') as f:
+            image = ImageOps.exif_transpose(Image.open(f))
+        for target in settings.IMAGE_VARIANT_WIDTHS:
+            resized = image.resize((target, round(image.height * target / image.width)), Image.Resampling.LANCZOS)
+            for format_name in settings.IMAGE_VARIANT_FORMATS:
+                pillow_format, extension, _ = FORMATS[format_name]
+                buffer = BytesIO()
+                resized.save(buffer, pillow_format, quality=settings.IMAGE_VARIANT_QUALITY)
+                name = variant_name(source, target, f'naive.{extension}')
+                storage.save(name, ContentFile(buffer.getvalue()))
+
+    def run(self, render, sources, workers):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(render, sources))
+        return time.perf_counter() - start
+
+    def report(self, label, elapsed, count):
+        self.stdout.write(f'{label}: {elapsed:.2f}s, {count / elapsed:.1f} images/s')
@@ -0,0 +1,71 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from listings.models import Listing
+from listings.search import get_search_backend, tokenize
+
+SYLLABLES = 'ka lo mi ra tu ven sol dar pe ni gor bel ust ran fi ko'.split()
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed synthetic listings and compare full-text index search with icontains scans. '
+        'Seeded rows are kept for reuse, so point DATABASE_URL at a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if backend is None:
+            raise CommandError('No full-text search backend for this database')
+        rng = random.Random(options['seed'])
+        words = sorted({
+            ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(20_000)
+        })
+
+        owner, _ = User.objects.get_or_create(username='bench-search')
+        missing = options['listings'] - Listing.objects.filter(owner=owner).count()
+        if missing > 0:
+            start = time.perf_counter()
+            for offset in range(0, missing, options['batch_size']):
+                Listing.objects.bulk_create([
+                    Listing(
+                        title=' '.join(rng.choices(words, k=3)),
+                        description=' '.join(rng.choices(words, k=20)),
+                        price=rng.randint(1, 500), category='Other', condition='Good', owner=owner,
+                    )
+                    for _ in range(min(options['batch_size'], missing - offset))
+                ])
+            backend.rebuild()
+            self.stdout.write(f'Seeded {missing} listings in {time.perf_counter() - start:.1f}s')
+
+        queries = [
+            ' '.join(word[:rng.randint(3, len(word))] for word in rng.sample(words, rng.randint(1, 2)))
+            for _ in range(options['queries'])
+        ]
+        self.report('full-text index', queries, lambda q: backend.search(tokenize(q), 10))
+        self.report('icontains scan', queries, lambda q: list(
+            Listing.objects.filter(
+                Q(title__icontains=q) | Q(description__icontains=q), is_active=True
+            ).order_by('-created_at').values_list('id', flat=True)[:10]
+        ))
+
+    def report(self, label, queries, search):
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            search(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        p50 = timings[len(timings) // 2]
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(f'{label:>16}: p50 {p50:8.2f}ms  p95 {p95:8.2f}ms')
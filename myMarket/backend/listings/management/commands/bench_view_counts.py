@@ -0,0 +1,62 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from listings.models import Listing
+from listings.view_counts import ViewCountBuffer
+
+
+class Command(BaseCommand):
+    help = 'Compare per-hit saves with the buffered view counter under concurrent hits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=50)
+        parser.add_argument('--hits', type=int, default=5000)
+        parser.add_argument('--threads', type=int, default=8)
+
+    def handle(self, *args, **options):
+        owner, _ = User.objects.get_or_create(username='bench-view-counts')
+        listings = Listing.objects.bulk_create([
+            Listing(title=f'Bench {i}', description='', price=1, category='Other',
+                    condition='New', owner=owner)
+            for i in range(options['listings'])
+        ])
+        ids = [listing.pk for listing in listings]
+        targets = [ids[i % len(ids)] for i in range(options['hits'])]
+
+        try:
+            def save_hit(pk):
+                listing = Listing.objects.get(pk=pk)
+                listing.view_count += 1
+                listing.save(update_fields=['view_count'])
+
+            self.report('save() per hit', self.run(save_hit, targets, options['threads']), ids, len(targets))
+            Listing.objects.filter(pk__in=ids).update(view_count=0)
+
+            buffer = ViewCountBuffer(flush_interval=1, flush_threshold=len(ids))
+            elapsed = self.run(buffer.record, targets, options['threads'])
+            buffer.flush()
+            self.report('buffered', elapsed, ids, len(targets))
+        finally:
+            owner.delete()
+
+    def run(self, hit, targets, threads):
+        def worker(pk):
+            try:
+                hit(pk)
+            finally:
+                close_old_connections()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(worker, targets))
+        return time.perf_counter() - start
+
+    def report(self, label, elapsed, ids, hits):
+        counted = sum(Listing.objects.filter(pk__in=ids).values_list('view_count', flat=True))
+        self.stdout.write(
+            f'{label:>16}: {hits / elapsed:10.0f} hits/s, {counted}/{hits} counted'
+        )
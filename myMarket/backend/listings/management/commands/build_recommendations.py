@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from listings import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute similar-listing neighbours from orders, carts and recent views, '
+        'for /api/listings/{id}/similar/ and /api/listings/recommended/'
+    )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        listings, created = recommendations.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {created} neighbours for {listings} listings in {time.perf_counter() - start:.1f}s'
+        ))
@@ -0,0 +1,44 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from listings.index_advisor import HOT_VIEWSETS, access_paths, explain
+
+SORT = re.compile(r'USE TEMP B-TREE FOR ORDER BY|\bSort\b')
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN the page query of every filter and ordering path of the hot list endpoints and '
+        'fail if any of them scans its table sequentially. Meant for CI after schema or query changes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username the requests are made as; defaults to the first user')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan, not just failing ones')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        user = users.filter(username=options['user']).first() if options['user'] else users.first()
+        if user is None:
+            raise CommandError('Needs a user to build authenticated requests')
+
+        failures = []
+        for viewset in HOT_VIEWSETS:
+            for path in access_paths(viewset):
+                plan, scans = explain(path, user)
+                if scans:
+                    failures.append(path)
+                    self.stdout.write(self.style.ERROR(f"seq scan  {path}: {', '.join(scans)}"))
+                elif SORT.search(plan):
+                    self.stdout.write(self.style.WARNING(f'sort      {path}'))
+                else:
+                    self.stdout.write(f'ok        {path}')
+                if scans or options['verbose_plans']:
+                    self.stdout.write('    ' + plan.replace('\n', '\n    '))
+
+        if failures:
+            raise CommandError(f'{len(failures)} queries scan sequentially on {connection.vendor}')
+        self.stdout.write(self.style.SUCCESS('No sequential scans'))
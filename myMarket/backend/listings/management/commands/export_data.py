@@ -0,0 +1,41 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from listings.bulk_io import EXPORTS, FORMATS, WRITERS, export_rows, guess_format
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream listings, or order items with their orders, to CSV or JSONL in primary key order. '
+        'Pass the last exported id (item_id for orders) as --after-id to continue an interrupted export.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--output', default='-', help='File to write, or - for stdout')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension, else jsonl')
+        parser.add_argument('--after-id', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per round trip')
+        parser.add_argument('--progress-every', type=int, default=100_000)
+
+    def handle(self, *args, **options):
+        queryset, columns = EXPORTS[options['kind']]
+        output = options['output']
+        format = options['format'] or guess_format(output)
+        stream = sys.stdout if output == '-' else open(output, 'w', newline='', encoding='utf-8')
+        start = time.perf_counter()
+        count = 0
+        try:
+            writer = WRITERS[format](stream, columns)
+            for row in export_rows(queryset, columns, options['after_id'], options['chunk_size']):
+                writer.write(row)
+                count += 1
+                if count % options['progress_every'] == 0:
+                    self.stderr.write(f'{count} rows, {count / (time.perf_counter() - start):.0f} rows/s')
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        elapsed = time.perf_counter() - start
+        self.stderr.write(f'Exported {count} rows in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} rows/s)')
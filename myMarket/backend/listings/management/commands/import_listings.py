@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from listings.bulk_io import FORMATS, ListingImporter, guess_format, read_records
+from listings.models import ImportCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        'Import listings from a CSV or JSONL file in batches. Columns: title, description, price, '
+        'category, condition, owner (username), and optionally is_active and image. '
+        'Re-running the same job resumes after the last committed batch.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin")
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension, else jsonl')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--job', help='Checkpoint name; defaults to the absolute path of the file')
+        parser.add_argument('--restart', action='store_true', help="Discard the job's checkpoint and start over")
+        parser.add_argument('--create-owners', action='store_true', help='Create users for unknown owner usernames')
+        parser.add_argument('--max-errors', type=int, default=20, help='Rejected records to print')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path == '-' and not options['job']:
+            raise CommandError('--job is required when reading from stdin')
+        job = options['job'] or os.path.abspath(path)
+        if options['restart']:
+            ImportCheckpoint.objects.filter(name=job).delete()
+
+        importer = ListingImporter(job, options['batch_size'], options['create_owners'])
+        format = options['format'] or guess_format(path)
+        start = time.perf_counter()
+        imported = rejected = 0
+        first = ImportCheckpoint.objects.filter(name=job).values_list('position', flat=True).first() or 0
+        if first:
+            self.stderr.write(f'Resuming {job} after record {first}')
+
+        def on_batch(position, count):
+            nonlocal imported
+            imported += count
+            elapsed = time.perf_counter() - start
+            self.stderr.write(f'{position} records read, {imported} imported, {(position - first) / elapsed:.0f} records/s')
+
+        def on_error(position, message):
+            nonlocal rejected
+            rejected += 1
+            if rejected <= options['max_errors']:
+                self.stderr.write(f'record {position}: {message}')
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            position = importer.run(read_records(stream, format), on_batch, on_error)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'Imported {imported} listings, rejected {rejected}, {position - first} records '
+            f'in {elapsed:.1f}s ({(position - first) / elapsed if elapsed else 0:.0f} records/s)'
+        )
@@ -0,0 +1,348 @@
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+
+from listings.bulk_io import ListingImporter
+from listings.checkout import complete_checkout, record_session
+from listings.models import Cart, CartItem, Conversation, Listing, Message, WebhookEvent
+from listings.webhooks import process_batch
+
+CATEGORIES = [value for value, _ in Listing.CATEGORY_CHOICES]
+CONDITIONS = [value for value, _ in Listing.CONDITION_CHOICES]
+WORDS = ['vintage', 'lamp', 'bike', 'guitar', 'desk', 'camera', 'jacket', 'sofa', 'phone', 'book',
+         'table', 'boots', 'speaker', 'watch', 'mirror', 'kettle', 'drill', 'tent', 'chair', 'rug']
+BROWSE_FILTERS = [None, 'popular', 'price_low', 'price_high']
+
+# Relative frequency of each scenario; checkout is create-checkout-session followed by the webhook
+MIX = {
+    'browse': 40,
+    'search': 20,
+    'add_item': 20,
+    'send_message': 15,
+    'checkout': 5,
+}
+
+WEBHOOK_SECRET = 'whsec_loadtest'
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of ``values``, which must be sorted."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed synthetic users, listings, carts, conversations and orders, then drive the API routes '
+        '(browse, search, add_item, send_message, checkout and the Stripe webhook) from concurrent '
+        'clients and report p50/p95/p99 latency, throughput and queries per request for each, plus how '
+        'long stored webhooks waited for the in-process webhook worker. '
+        'Checkout sessions come from the fake payment provider and webhooks are signed with a local '
+        'secret. Seeded data is deleted afterwards unless --keep is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=50)
+        parser.add_argument('--sellers', type=int, default=20)
+        parser.add_argument('--listings', type=int, default=5000)
+        parser.add_argument('--conversations', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=100, help='Past orders seeded through complete_checkout()')
+        parser.add_argument('--requests', type=int, default=2000, help='Scenarios to run in total')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--payment-latency-ms', type=int, default=0,
+                            help='Simulated payment provider latency per checkout session')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the results as JSON to this file')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded data')
+
+    def handle(self, *args, **options):
+        if options['buyers'] < options['workers']:
+            raise CommandError('--buyers must be at least --workers; each client uses its own buyers')
+        self.rng = random.Random(options['seed'])
+        self.prefix = f'loadtest-api-{uuid.uuid4().hex[:8]}'
+        try:
+            start = time.perf_counter()
+            self.seed(options)
+            self.stdout.write(
+                f"Seeded {options['buyers']} buyers, {options['sellers']} sellers, {options['listings']} listings, "
+                f"{options['conversations']} conversations and {options['orders']} orders "
+                f'in {time.perf_counter() - start:.1f}s'
+            )
+            results, elapsed = self.run(options)
+            self.report(results, elapsed, options)
+        finally:
+            WebhookEvent.objects.filter(event_id__startswith=f'evt_{self.prefix}').delete()
+            if not options['keep']:
+                # Cascades through listings, carts, orders and conversations, with their signals
+                User.objects.filter(username__startswith=self.prefix).delete()
+
+    def seed(self, options):
+        rng = self.rng
+        sellers = [f'{self.prefix}-seller-{i}' for i in range(options['sellers'])]
+        records = (
+            {
+                'title': ' '.join(rng.sample(WORDS, 3)).title(),
+                'description': ' '.join(rng.choices(WORDS, k=rng.randint(5, 30))),
+                'price': f'{rng.uniform(1, 1500):.2f}',
+                'category': rng.choice(CATEGORIES),
+                'condition': rng.choice(CONDITIONS),
+                'owner': rng.choice(sellers),
+            }
+            for _ in range(options['listings'])
+        )
+        ListingImporter(self.prefix, create_owners=True).run(records)
+
+        User.objects.bulk_create([
+            User(username=f'{self.prefix}-buyer-{i}', email=f'buyer-{i}@loadtest.invalid', password='!')
+            for i in range(options['buyers'])
+        ])
+        self.buyers = list(User.objects.filter(username__startswith=f'{self.prefix}-buyer-').order_by('id'))
+        Cart.objects.bulk_create([Cart(user=buyer) for buyer in self.buyers])
+        self.carts = dict(Cart.objects.filter(user__in=self.buyers).values_list('user_id', 'id'))
+        listings = list(
+            Listing.objects.filter(owner__username__startswith=f'{self.prefix}-seller-')
+            .values_list('id', 'owner_id')
+        )
+        if len(listings) < options['orders'] * 2:
+            raise CommandError('Seed at least two listings per order')
+
+        # Past orders go through the real checkout so stats, facets and stock stay consistent
+        sold = set()
+        for i, (listing_id, _) in enumerate(rng.sample(listings, options['orders'] * 2)):
+            buyer = self.buyers[i // 2 % len(self.buyers)]
+            CartItem.objects.create(cart_id=self.carts[buyer.id], listing_id=listing_id)
+            sold.add(listing_id)
+            if i % 2:
+                cart_id, session_id = self.carts[buyer.id], f'{self.prefix}-seed-{i}'
+                record_session(session_id, cart_id, buyer.id, CartItem.objects.filter(cart_id=cart_id).values_list(
+                    'listing_id', 'quantity', 'listing__price'
+                ))
+                complete_checkout(session_id)
+        self.available = [listing_id for listing_id, _ in listings if listing_id not in sold]
+        self.available_lock = threading.Lock()
+
+        self.conversations = defaultdict(list)
+        for _ in range(options['conversations']):
+            buyer = rng.choice(self.buyers)
+            listing_id, owner_id = rng.choice(listings)
+            conversation = Conversation.objects.create(listing_id=listing_id)
+            conversation.participants.add(buyer.id, owner_id)
+            for sender_id in rng.choices([buyer.id, owner_id], k=rng.randint(1, 5)):
+                message = Message.objects.create(conversation=conversation, sender_id=sender_id,
+                                                 content=' '.join(rng.choices(WORDS, k=8)))
+                conversation.record_message(message)
+            self.conversations[buyer.id].append(conversation.id)
+
+    def run(self, options):
+        remaining = iter(range(options['requests']))
+        lock = threading.Lock()
+        results = defaultdict(list)
+
+        def take():
+            with lock:
+                return next(remaining, None)
+
+        def worker(index):
+            rng = random.Random(options['seed'] * 1000 + index)
+            buyers = self.buyers[index::options['workers']]
+            clients = {
+                buyer.id: Client(raise_request_exception=False,
+                                 HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(buyer)}')
+                for buyer in buyers
+            }
+            anonymous = Client(raise_request_exception=False)
+            in_cart = defaultdict(list)
+            local = defaultdict(list)
+
+            def call(route, method, path, client, **kwargs):
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.perf_counter()
+                    response = getattr(client, method)(path, **kwargs)
+                    latency = (time.perf_counter() - start) * 1000
+                local[route].append((latency, len(ctx.captured_queries), response.status_code < 400))
+                return response
+
+            def add_item(buyer):
+                with self.available_lock:
+                    if not self.available:
+                        return
+                    listing_id = self.available[rng.randrange(len(self.available))]
+                response = call('add_item', 'post', f'/api/carts/{self.carts[buyer.id]}/add_item/', clients[buyer.id],
+                                data={'listing_id': listing_id, 'quantity': 1}, content_type='application/json')
+                if response.status_code < 400:
+                    in_cart[buyer.id].append(listing_id)
+
+            try:
+                while take() is not None:
+                    buyer = rng.choice(buyers)
+                    scenario = rng.choices(list(MIX), weights=list(MIX.values()))[0]
+                    if scenario == 'browse':
+                        params = {'page': rng.randint(1, 5)}
+                        if rng.random() < 0.5:
+                            params['category'] = rng.choice(CATEGORIES)
+                        browse_filter = rng.choice(BROWSE_FILTERS)
+                        if browse_filter:
+                            params['filter'] = browse_filter
+                        call('browse', 'get', '/api/listings/', anonymous, data=params)
+                    elif scenario == 'search':
+                        call('search', 'get', '/api/listings/', clients[buyer.id],
+                             data={'search': ' '.join(rng.sample(WORDS, rng.randint(1, 2)))})
+                    elif scenario == 'add_item':
+                        add_item(buyer)
+                    elif scenario == 'send_message':
+                        if not self.conversations[buyer.id]:
+                            continue
+                        conversation_id = rng.choice(self.conversations[buyer.id])
+                        call('send_message', 'post', f'/api/conversations/{conversation_id}/send_message/',
+                             clients[buyer.id], data={'message': ' '.join(rng.choices(WORDS, k=8))},
+                             content_type='application/json')
+                    else:
+                        if not in_cart[buyer.id]:
+                            add_item(buyer)
+                        if not in_cart[buyer.id]:
+                            continue
+                        response = call('checkout', 'post', '/api/create-checkout-session/', clients[buyer.id],
+                                        data={'cart_id': self.carts[buyer.id]}, content_type='application/json')
+                        if response.status_code >= 400:
+                            continue
+                        payload = json.dumps({
+                            'id': f'evt_{self.prefix}_{uuid.uuid4().hex}',
+                            'created': int(time.time()),
+                            'object': 'event',
+                            'type': 'checkout.session.completed',
+                            'data': {'object': {
+                                'id': response.json()['sessionId'],
+                                'object': 'checkout.session',
+                                'metadata': {'cart_id': str(self.carts[buyer.id])},
+                            }},
+                        })
+                        call('webhook', 'post', '/api/webhook/stripe/', anonymous, data=payload,
+                             content_type='application/json',
+                             HTTP_STRIPE_SIGNATURE=stripe.WebhookSignature.generate_signature_header(
+                                 payload, WEBHOOK_SECRET))
+                        sold = set(in_cart.pop(buyer.id))
+                        with self.available_lock:
+                            self.available = [listing_id for listing_id in self.available if listing_id not in sold]
+            finally:
+                connection.close()
+                with lock:
+                    for route, samples in local.items():
+                        results[route].extend(samples)
+
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                               STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+                               PAYMENT_PROVIDER='listings.payments.FakeProvider',
+                               PAYMENT_FAKE_LATENCY_MS=options['payment_latency_ms']):
+            done = threading.Event()
+            webhook_worker = threading.Thread(target=self.process_webhooks, args=(done,))
+            webhook_worker.start()
+            start = time.perf_counter()
+            try:
+                with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                    for future in [executor.submit(worker, index) for index in range(options['workers'])]:
+                        future.result()
+                elapsed = time.perf_counter() - start
+            finally:
+                done.set()
+                webhook_worker.join()
+        return results, elapsed
+
+    def process_webhooks(self, done):
+        # Same as process_webhook_events --loop, draining what's left once the clients finish
+        try:
+            while True:
+                try:
+                    applied, failed = process_batch(settings.WEBHOOK_QUEUE_BATCH_SIZE,
+                                                    settings.WEBHOOK_QUEUE_MAX_ATTEMPTS)
+                except OperationalError:
+                    # SQLite's single writer; the batch rolled back and is retried
+                    applied = failed = 0
+                    time.sleep(0.05)
+                    continue
+                if not applied and not failed:
+                    if done.is_set():
+                        break
+                    time.sleep(0.05)
+        finally:
+            connection.close()
+
+    def report(self, results, elapsed, options):
+        summary = {}
+        for route in [*MIX, 'webhook']:
+            samples = results.get(route)
+            if not samples:
+                continue
+            latencies = sorted(latency for latency, _, _ in samples)
+            queries = [count for _, count, _ in samples]
+            summary[route] = {
+                'requests': len(samples),
+                'errors': sum(1 for _, _, ok in samples if not ok),
+                'rps': len(samples) / elapsed,
+                'p50_ms': percentile(latencies, 50),
+                'p95_ms': percentile(latencies, 95),
+                'p99_ms': percentile(latencies, 99),
+                'max_ms': latencies[-1],
+                'avg_queries': sum(queries) / len(queries),
+                'max_queries': max(queries),
+            }
+        total = sum(route['requests'] for route in summary.values())
+
+        self.stdout.write(
+            f"{'route':<14}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'p99 ms':>9}{'max ms':>9}{'queries':>9}{'max q':>7}"
+        )
+        for route, row in summary.items():
+            self.stdout.write(
+                f"{route:<14}{row['requests']:>9}{row['errors']:>8}{row['rps']:>9.1f}{row['p50_ms']:>9.1f}"
+                f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}{row['avg_queries']:>9.1f}"
+                f"{row['max_queries']:>7}"
+            )
+        self.stdout.write(
+            f"{total} requests from {options['workers']} clients in {elapsed:.1f}s, {total / elapsed:.1f} req/s"
+        )
+
+        events = WebhookEvent.objects.filter(event_id__startswith=f'evt_{self.prefix}')
+        lags = sorted(
+            (processed_at - received_at).total_seconds() * 1000
+            for received_at, processed_at in events.filter(processed_at__isnull=False)
+            .values_list('created_at', 'processed_at')
+        )
+        webhooks = {
+            'applied': len(lags),
+            'failed': events.exclude(status__in=['done', 'ignored']).count(),
+            'p50_lag_ms': percentile(lags, 50),
+            'p95_lag_ms': percentile(lags, 95),
+            'p99_lag_ms': percentile(lags, 99),
+        }
+        self.stdout.write(
+            f"Webhooks applied {webhooks['applied']}, not applied {webhooks['failed']}; wait from receipt to "
+            f"applied p50 {webhooks['p50_lag_ms']:.1f}ms, p95 {webhooks['p95_lag_ms']:.1f}ms, "
+            f"p99 {webhooks['p99_lag_ms']:.1f}ms"
+        )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'options': {name: options[name] for name in (
+                        'buyers', 'sellers', 'listings', 'conversations', 'orders', 'requests', 'workers', 'seed')},
+                    'elapsed_s': elapsed,
+                    'requests': total,
+                    'rps': total / elapsed,
+                    'routes': summary,
+                    'webhooks': webhooks,
+                }, f, indent=2)
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from listings.models import Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        'Open many concurrent /api/events/ streams against a running ASGI server, send messages '
+        'into a shared conversation and report delivery counts and latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--connections', type=int, default=500)
+        parser.add_argument('--messages', type=int, default=20)
+        parser.add_argument('--timeout', type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        count = options['connections']
+        users = User.objects.bulk_create([User(username=f'loadtest-events-{i}') for i in range(count + 1)])
+        users = list(User.objects.filter(username__startswith='loadtest-events-').order_by('id'))
+        sender, listeners = users[0], users[1:]
+        conversation = Conversation.objects.create()
+        conversation.participants.add(*users)
+        try:
+            result = asyncio.run(self.run(
+                options, conversation.id,
+                str(AccessToken.for_user(sender)),
+                [str(AccessToken.for_user(user)) for user in listeners],
+            ))
+        finally:
+            conversation.delete()
+            User.objects.filter(username__startswith='loadtest-events-').delete()
+
+        latencies = sorted(result['latencies'])
+        expected = count * options['messages']
+        self.stdout.write(f"Connected streams: {result['connected']}/{count} in {result['connect_time']:.2f}s")
+        self.stdout.write(f"Delivered events:  {len(latencies)}/{expected}")
+        if latencies:
+            def pct(p):
+                return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+            self.stdout.write(
+                f'Delivery latency:  p50 {pct(0.5):.1f}ms  p95 {pct(0.95):.1f}ms  p99 {pct(0.99):.1f}ms'
+            )
+
+    async def run(self, options, conversation_id, sender_token, tokens):
+        url = urlsplit(options['url'])
+        latencies = []
+        ready = []
+        streams = []
+
+        async def listen(token):
+            reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+            streams.append(writer)
+            writer.write(
+                f'GET /api/events/?token={token} HTTP/1.1\r\nHost: {url.netloc}\r\n'
+                f'Accept: text/event-stream\r\n\r\n'.encode()
+            )
+            await writer.drain()
+            status = await reader.readline()
+            if b' 200 ' not in status:
+                raise CommandError(f'Stream refused: {status.decode().strip()}')
+            ready.append(token)
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if line.startswith(b'data: ') and b'"message"' in line:
+                    event = json.loads(line.split(b'data: ', 1)[1].split(b'\r\n')[0])
+                    sent_at = float(event['message']['content'])
+                    latencies.append(time.time() - sent_at)
+
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(listen(token)) for token in tokens]
+        while len(ready) < len(tokens) and time.perf_counter() - start < options['timeout']:
+            if any(task.done() and task.exception() for task in tasks):
+                break
+            await asyncio.sleep(0.05)
+        connect_time = time.perf_counter() - start
+
+        def send(content):
+            request = urllib.request.Request(
+                f"{options['url']}/api/conversations/{conversation_id}/send_message/",
+                data=json.dumps({'message': content}).encode(),
+                headers={'Authorization': f'Bearer {sender_token}', 'Content-Type': 'application/json'},
+            )
+            urllib.request.urlopen(request).read()
+
+        loop = asyncio.get_running_loop()
+        for _ in range(options['messages']):
+            await loop.run_in_executor(None, send, repr(time.time()))
+
+        expected = len(ready) * options['messages']
+        deadline = time.perf_counter() + options['timeout']
+        while len(latencies) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+        for writer in streams:
+            writer.close()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return {'connected': len(ready), 'connect_time': connect_time, 'latencies': latencies}
@@ -0,0 +1,118 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from listings.images import IMAGE_FIELDS, delete_variants, needs_variants, render_variants
+from listings.models import ImageJob
+
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+
+
+class Command(BaseCommand):
+    help = 'Render resized variants for queued listing and profile images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.IMAGE_QUEUE_BATCH_SIZE)
+        parser.add_argument('--max-attempts', type=int, default=settings.IMAGE_QUEUE_MAX_ATTEMPTS)
+        parser.add_argument('--workers', type=int, default=4, help='Images rendered in parallel')
+        parser.add_argument('--backfill', action='store_true', help='First queue every existing image that has no variants')
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting when the queue is empty')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.stdout.write(f'Queued {self.backfill()} images')
+
+        # Pillow releases the GIL while decoding, resizing and encoding
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                done, failed = self.process_batch(pool, options['batch_size'], options['max_attempts'])
+                if done or failed:
+                    self.stdout.write(f'Processed {done}, failed {failed}')
+                if not options['loop'] and not done and not failed:
+                    break
+                if not done and not failed:
+                    time.sleep(options['interval'])
+
+    def backfill(self):
+        queued = 0
+        for label, field in IMAGE_FIELDS.items():
+            model = apps.get_model(label)
+            rows = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).only(
+                'pk', field, f'{field}_variants'
+            )
+            for instance in rows.iterator(chunk_size=500):
+                if needs_variants(instance, field):
+                    ImageJob.queue(instance, field)
+                    queued += 1
+        return queued
+
+    def process_batch(self, pool, batch_size, max_attempts):
+        done = failed = 0
+        with transaction.atomic():
+            pending = ImageJob.objects.filter(status='pending', next_attempt_at__lte=timezone.now())
+            if connection.features.has_select_for_update_skip_locked:
+                pending = pending.select_for_update(skip_locked=True)
+            jobs = list(pending[:batch_size])
+            if not jobs:
+                return 0, 0
+
+            instances = self.load_instances(jobs)
+            renders = {}
+            for job in jobs:
+                instance = instances.get((job.model, job.object_id))
+                # Rows deleted or given another image since the job was queued need nothing
+                if instance is not None and getattr(instance, job.field).name == job.source:
+                    renders[job.pk] = pool.submit(render_variants, job.source)
+
+            for job in jobs:
+                job.attempts += 1
+                job.updated_at = timezone.now()
+                if job.pk not in renders:
+                    job.status = 'done'
+                    continue
+                try:
+                    width, height, variants = renders[job.pk].result()
+                except Exception as e:
+                    job.last_error = str(e)
+                    if job.attempts >= max_attempts:
+                        job.status = 'failed'
+                    else:
+                        job.next_attempt_at = timezone.now() + min(
+                            BACKOFF_BASE * 2 ** (job.attempts - 1), BACKOFF_MAX
+                        )
+                    failed += 1
+                else:
+                    self.store(instances[(job.model, job.object_id)], job.field, width, height, variants)
+                    job.status = 'done'
+                    done += 1
+
+            ImageJob.objects.bulk_update(jobs, ['attempts', 'status', 'last_error', 'next_attempt_at', 'updated_at'])
+        return done, failed
+
+    def load_instances(self, jobs):
+        ids_by_model = {}
+        for job in jobs:
+            ids_by_model.setdefault(job.model, set()).add(job.object_id)
+        instances = {}
+        for label, ids in ids_by_model.items():
+            for instance in apps.get_model(label).objects.filter(pk__in=ids):
+                instances[(label, instance.pk)] = instance
+        return instances
+
+    def store(self, instance, field, width, height, variants):
+        previous = getattr(instance, f'{field}_variants')
+        setattr(instance, f'{field}_width', width)
+        setattr(instance, f'{field}_height', height)
+        setattr(instance, f'{field}_variants', variants)
+        # Saved through the model so listing caches are invalidated by the usual signals
+        instance.save(update_fields=[f'{field}_width', f'{field}_height', f'{field}_variants'])
+        if previous and previous.get('source') != variants['source']:
+            delete_variants(previous)
@@ -0,0 +1,26 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from listings.webhooks import process_batch
+
+
+class Command(BaseCommand):
+    help = 'Apply stored payment webhook events in order, in batches, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.WEBHOOK_QUEUE_BATCH_SIZE)
+        parser.add_argument('--max-attempts', type=int, default=settings.WEBHOOK_QUEUE_MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting when the log is drained')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            applied, failed = process_batch(options['batch_size'], options['max_attempts'])
+            if applied or failed:
+                self.stdout.write(f'Applied {applied}, failed {failed}')
+            if not options['loop'] and not applied and not failed:
+                break
+            if not applied and not failed:
+                time.sleep(options['interval'])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from listings import facets
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored listing facet counts, e.g. after changing LISTING_PRICE_BUCKETS'
+
+    def handle(self, *args, **options):
+        created = facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {created} facet count rows'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from listings.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the listing full-text index, e.g. after bulk imports that skip save signals'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if backend is None:
+            raise CommandError('No full-text search backend for this database')
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search index with {type(backend).__name__}'))
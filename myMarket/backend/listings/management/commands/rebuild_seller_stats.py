@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from listings import seller_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the seller dashboard rollups from the order tables'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        created = seller_stats.rebuild()
+        self.stdout.write(f'Wrote {created} rollup rows in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from listings.bulk_io import batches, read_records
+from listings.models import WebhookEvent
+from listings.webhooks import record_events
+
+STATUSES = [value for value, _ in WebhookEvent.STATUS_CHOICES]
+
+
+class Command(BaseCommand):
+    help = (
+        'Queue stored webhook events for process_webhook_events again, selected by id, type, '
+        'status and time, and/or load events missed by the endpoint from a JSONL file '
+        '(one provider event per line; ids already stored are skipped).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='JSONL file of events to add to the log')
+        parser.add_argument('--provider', default='stripe')
+        parser.add_argument('--event-id', action='append', default=[], help='Repeatable')
+        parser.add_argument('--type', help='Event type, e.g. checkout.session.completed')
+        parser.add_argument('--status', choices=STATUSES + ['any'], default='failed')
+        parser.add_argument('--since', help='Received at or after this ISO datetime')
+        parser.add_argument('--until', help='Received before this ISO datetime')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be queued')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            before = WebhookEvent.objects.count()
+            with open(options['file'], encoding='utf-8') as f:
+                for batch in batches(read_records(f, 'jsonl'), 1000):
+                    if not options['dry_run']:
+                        record_events(batch, options['provider'])
+            self.stdout.write(f'Added {WebhookEvent.objects.count() - before} new events from {options["file"]}')
+
+        if not (options['event_id'] or options['type'] or options['since'] or options['until']):
+            if not options['file']:
+                raise CommandError('Select events with --event-id, --type, --since or --until, or pass --file')
+            return
+
+        events = WebhookEvent.objects.filter(provider=options['provider'])
+        if options['event_id']:
+            events = events.filter(event_id__in=options['event_id'])
+        if options['type']:
+            events = events.filter(type=options['type'])
+        if options['status'] != 'any':
+            events = events.filter(status=options['status'])
+        for name, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lt')):
+            if options[name]:
+                moment = parse_datetime(options[name])
+                if moment is None:
+                    raise CommandError(f'--{name} must be an ISO datetime')
+                if timezone.is_naive(moment):
+                    moment = timezone.make_aware(moment)
+                events = events.filter(**{lookup: moment})
+
+        if options['dry_run']:
+            self.stdout.write(f'Would queue {events.count()} events')
+            return
+        queued = events.update(
+            status='pending', attempts=0, last_error='', next_attempt_at=timezone.now(),
+            processed_at=None, updated_at=timezone.now(),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Queued {queued} events; run process_webhook_events to apply them'))
@@ -0,0 +1,43 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from listings import prices
+
+
+class Command(BaseCommand):
+    help = (
+        'Roll finished days of raw listing price changes into the daily listing and category rollups, '
+        'then delete raw changes older than PRICE_HISTORY_RAW_DAYS. Run daily; rerunning a day replaces its rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Last day to roll up, YYYY-MM-DD (default yesterday)')
+        parser.add_argument('--days', type=int, default=1, help='Number of days ending at --date')
+        parser.add_argument('--no-prune', action='store_true', help='Keep old raw changes')
+
+    def handle(self, *args, **options):
+        last = parse_date(options['date']) if options['date'] else timezone.localdate() - timedelta(days=1)
+        if last is None:
+            raise CommandError('--date must be YYYY-MM-DD')
+        if last >= timezone.localdate():
+            raise CommandError('Only finished days can be rolled up')
+        first = last - timedelta(days=options['days'] - 1)
+        if first < timezone.localdate() - timedelta(days=settings.PRICE_HISTORY_RAW_DAYS):
+            # Their raw changes may already be pruned
+            raise CommandError(f'Days older than PRICE_HISTORY_RAW_DAYS ({settings.PRICE_HISTORY_RAW_DAYS}) cannot be rolled up')
+
+        start = time.perf_counter()
+        day = first
+        while day <= last:
+            listings = prices.rollup_listings(day)
+            categories = prices.rollup_categories(day)
+            self.stdout.write(f'{day}: {listings} listing rows, {categories} category rows')
+            day += timedelta(days=1)
+        if not options['no_prune']:
+            self.stdout.write(f'Deleted {prices.prune()} raw changes')
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - start:.1f}s'))
@@ -0,0 +1,83 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from listings.models import OutboundEmail
+
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued emails in batches over one mail connection, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_QUEUE_BATCH_SIZE)
+        parser.add_argument('--max-attempts', type=int, default=settings.EMAIL_QUEUE_MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting when the queue is empty')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = self.deliver_batch(options['batch_size'], options['max_attempts'])
+            if sent or failed:
+                self.stdout.write(f'Sent {sent}, failed {failed}')
+            if not options['loop']:
+                break
+            if not sent and not failed:
+                time.sleep(options['interval'])
+
+    def deliver_batch(self, batch_size, max_attempts):
+        sent = failed = 0
+        with transaction.atomic():
+            pending = OutboundEmail.objects.filter(status='pending', next_attempt_at__lte=timezone.now())
+            if connection.features.has_select_for_update_skip_locked:
+                # Lets several workers share the queue without sending twice
+                pending = pending.select_for_update(skip_locked=True)
+            emails = list(pending[:batch_size])
+            if not emails:
+                return 0, 0
+
+            # One connection for the whole batch; backends reconnect per message otherwise
+            mail_connection = get_connection()
+            try:
+                mail_connection.open()
+            except Exception:
+                pass  # each send below retries the connection and records the error
+            try:
+                for email in emails:
+                    email.attempts += 1
+                    email.updated_at = timezone.now()
+                    try:
+                        EmailMessage(
+                            email.subject,
+                            email.body,
+                            email.from_email or None,
+                            email.recipients,
+                            connection=mail_connection,
+                        ).send()
+                    except Exception as e:
+                        email.last_error = str(e)
+                        if email.attempts >= max_attempts:
+                            email.status = 'failed'
+                        else:
+                            email.next_attempt_at = timezone.now() + min(
+                                BACKOFF_BASE * 2 ** (email.attempts - 1), BACKOFF_MAX
+                            )
+                        failed += 1
+                    else:
+                        email.status = 'sent'
+                        email.sent_at = timezone.now()
+                        sent += 1
+            finally:
+                mail_connection.close()
+
+            OutboundEmail.objects.bulk_update(
+                emails, ['attempts', 'status', 'last_error', 'next_attempt_at', 'sent_at', 'updated_at']
+            )
+        return sent, failed
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+POSTGRES_CREATE = [
+    """
+    CREATE TABLE listings_listing_search (
+        listing_id bigint PRIMARY KEY REFERENCES listings_listing (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX listings_listing_search_document ON listings_listing_search USING GIN (document)",
+    """
+    INSERT INTO listings_listing_search (listing_id, document)
+    SELECT id,
+           setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+           setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    FROM listings_listing
+    """,
+]
+POSTGRES_DROP = ["DROP TABLE IF EXISTS listings_listing_search"]
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE listings_listing_fts USING fts5(title, description, tokenize='unicode61')",
+    """
+    INSERT INTO listings_listing_fts (rowid, title, description)
+    SELECT id, title, description FROM listings_listing
+    """,
+]
+SQLITE_DROP = ["DROP TABLE IF EXISTS listings_listing_fts"]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0006_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'postgresql': POSTGRES_CREATE, 'sqlite': SQLITE_CREATE}),
+            run_for_vendor({'postgresql': POSTGRES_DROP, 'sqlite': SQLITE_DROP}),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2 on 2026-10-18 14:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def watermarks_from_flags(apps, schema_editor):
+    # Each participant has read up to the newest message from someone else flagged is_read
+    Conversation = apps.get_model('listings', 'Conversation')
+    ConversationParticipant = apps.get_model('listings', 'ConversationParticipant')
+    Message = apps.get_model('listings', 'Message')
+
+    for conversation in Conversation.objects.prefetch_related('participants').iterator(chunk_size=500):
+        for user in conversation.participants.all():
+            others = Message.objects.filter(conversation=conversation).exclude(sender=user)
+            last_read = others.filter(is_read=True).order_by('-created_at', '-id').first()
+            unread = others.filter(created_at__gt=last_read.created_at) if last_read else others
+            ConversationParticipant.objects.update_or_create(
+                conversation=conversation,
+                user=user,
+                defaults={
+                    'last_read_message': last_read,
+                    'last_read_at': last_read.created_at if last_read else None,
+                    'unread_count': unread.count(),
+                },
+            )
+
+
+def flags_from_watermarks(apps, schema_editor):
+    ConversationParticipant = apps.get_model('listings', 'ConversationParticipant')
+    Message = apps.get_model('listings', 'Message')
+
+    for state in ConversationParticipant.objects.exclude(last_read_at=None).iterator(chunk_size=500):
+        Message.objects.filter(
+            conversation_id=state.conversation_id, created_at__lte=state.last_read_at
+        ).exclude(sender_id=state.user_id).update(is_read=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0009_outbound_email'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_read_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='listings.message'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at'], name='listings_me_convers_450e3b_idx'),
+        ),
+        migrations.RunPython(watermarks_from_flags, flags_from_watermarks),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='listings_me_is_read_bba840_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2 on 2026-10-18 14:29
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Value, When
+
+
+def count_active_listings(apps, schema_editor):
+    Listing = apps.get_model('listings', 'Listing')
+    ListingFacetCount = apps.get_model('listings', 'ListingFacetCount')
+    edges = settings.LISTING_PRICE_BUCKETS
+    bucket = Case(
+        *[When(price__gte=edges[index], then=Value(index)) for index in range(len(edges) - 1, 0, -1)],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    rows = (
+        Listing.objects.filter(is_active=True).order_by()
+        .annotate(price_bucket=bucket)
+        .values_list('category', 'condition', 'price_bucket')
+        .annotate(count=Count('pk'))
+    )
+    ListingFacetCount.objects.bulk_create([
+        ListingFacetCount(category=category, condition=condition, price_bucket=price_bucket, count=count)
+        for category, condition, price_bucket, count in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0013_seller_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=50)),
+                ('condition', models.CharField(max_length=20)),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('category', 'condition', 'price_bucket')},
+            },
+        ),
+        migrations.RunPython(count_active_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 14:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0014_listing_facet_counts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='listing',
+            name='listings_li_categor_4dd4fc_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='listing',
+            name='listings_li_is_acti_03d721_idx',
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['owner', '-created_at'], name='list_owner_create'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', '-created_at'], name='list_catego_create_act'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['condition', '-created_at'], name='list_condit_create_act'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-view_count'], name='list_viewco_act'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-price'], name='list_price_act'),
+        ),
+    ]
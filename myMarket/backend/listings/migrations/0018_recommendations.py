@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-18 15:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0017_listing_location'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='listings.listing')),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_of', to='listings.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['listing', '-score'], name='listings_li_listing_2ae899_idx')],
+                'unique_together': {('listing', 'neighbor')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ListingView',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('viewed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='views', to='listings.listing')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listing_views', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-viewed_at'], name='listings_li_user_id_cbac09_idx'), models.Index(fields=['viewed_at'], name='listings_li_viewed__7c5802_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-18 15:17
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0018_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryPriceDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=50)),
+                ('day', models.DateField()),
+                ('listings', models.PositiveIntegerField(default=0)),
+                ('median', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('low', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('high', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+            options={
+                'unique_together': {('category', 'day')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ListingPriceDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('open', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('close', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('low', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('high', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('changes', models.PositiveIntegerField(default=0)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_prices', to='listings.listing')),
+            ],
+            options={
+                'unique_together': {('listing', 'day')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('previous_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_changes', to='listings.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['listing', 'changed_at'], name='listings_pr_listing_03c92d_idx'), models.Index(fields=['changed_at'], name='listings_pr_changed_7c0d97_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 15:35
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def categories_from_listings(apps, schema_editor):
+    # The best guess for past orders is the listing's category now
+    Listing = apps.get_model('listings', 'Listing')
+    OrderItem = apps.get_model('listings', 'OrderItem')
+    OrderItem.objects.update(category=Subquery(
+        Listing.objects.filter(pk=OuterRef('listing_id')).values('category')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0020_checkout_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='category',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.RunPython(categories_from_listings, migrations.RunPython.noop),
+    ]
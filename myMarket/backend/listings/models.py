@@ -1,7 +1,22 @@
-from django.db import models
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, Exists, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.dispatch import Signal
 from django.utils import timezone
 
+from . import geo
+
+# Sent by Conversation.record_message() and mark_read() inside their
+# transaction; signals.py pushes them to the participants (see realtime.py)
+message_recorded = Signal()
+conversation_read = Signal()
+
 class BaseModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -15,6 +30,9 @@ class UserProfile(BaseModel):
     phone_number = models.CharField(max_length=20, blank=True)
     address = models.TextField(blank=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    profile_picture_width = models.PositiveIntegerField(null=True, blank=True)
+    profile_picture_height = models.PositiveIntegerField(null=True, blank=True)
+    profile_picture_variants = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
@@ -43,48 +61,120 @@ class Listing(BaseModel):
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES)
     condition = models.CharField(max_length=20, choices=CONDITION_CHOICES)
     image = models.ImageField(upload_to='listings/', blank=True, null=True)
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listings')
     is_active = models.BooleanField(default=True)
     view_count = models.PositiveIntegerField(default=0)
+    # Pickup location; geohash is derived from it on save (see geo.py)
+    latitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
 
     def __str__(self):
         return self.title
 
     class Meta:
         ordering = ['-created_at']
+        # Public browse queries all filter on is_active, so their indexes only
+        # cover active listings (see index_advisor.py)
         indexes = [
             models.Index(fields=['-created_at']),
-            models.Index(fields=['category']),
-            models.Index(fields=['is_active']),
+            models.Index(fields=['owner', '-created_at'], name='list_owner_create'),
+            models.Index(fields=['category', '-created_at'], condition=Q(is_active=True), name='list_catego_create_act'),
+            models.Index(fields=['condition', '-created_at'], condition=Q(is_active=True), name='list_condit_create_act'),
+            models.Index(fields=['-view_count'], condition=Q(is_active=True), name='list_viewco_act'),
+            models.Index(fields=['-price'], condition=Q(is_active=True), name='list_price_act'),
+            # Not partial: SQLite only runs the OR of geohash ranges in a ?near=
+            # search as one index search per range when the index has no condition
+            models.Index(fields=['geohash'], name='list_geohas'),
         ]
 
+    def save(self, *args, **kwargs):
+        self.geohash = geo.encode(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
+
     def increment_view_count(self):
-        self.view_count += 1
-        self.save(update_fields=['view_count'])
+        # Buffered and flushed in batches; view_count catches up on the next flush
+        from .view_counts import view_counts
+        view_counts.record(self.pk)
+
+def line_total(price='listing__price'):
+    return ExpressionWrapper(
+        F('quantity') * F(price),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate ``items_total``, the cart total computed in SQL."""
+        totals = CartItem.objects.filter(cart=OuterRef('pk')).values('cart').annotate(
+            total=Sum(line_total())
+        ).values('total')
+        return self.annotate(items_total=Coalesce(
+            Subquery(totals, output_field=DecimalField(max_digits=12, decimal_places=2)),
+            Value(Decimal('0.00')),
+        ))
+
+class CartItemQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate ``line_total``, quantity times the listing price, computed in SQL."""
+        return self.annotate(line_total=line_total())
 
 class Cart(BaseModel):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.user.username}'s Cart"
 
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        if hasattr(self, 'items_total'):
+            return self.items_total
+        return self.items.aggregate(total=Sum(line_total()))['total'] or Decimal('0.00')
 
     def clear(self):
         self.items.all().delete()
 
+    @staticmethod
+    def cache_key(user_id):
+        return f'cart-id:{user_id}'
+
+    @classmethod
+    def id_for_user(cls, user_id):
+        """
+        The id of the user's cart, from the cache after the first call. Carts
+        are created with the user (see signals.py) and never change owner; the
+        entry is dropped when the cart is deleted and expires after
+        CART_ID_CACHE_TIMEOUT anyway, for processes that missed the delete.
+        """
+        cart_id = cache.get(cls.cache_key(user_id))
+        if cart_id is None:
+            # Users bulk-created without signals, or from before backfill_carts_and_profiles
+            cart_id = cls.objects.get_or_create(user_id=user_id)[0].pk
+            cache.set(cls.cache_key(user_id), cart_id, settings.CART_ID_CACHE_TIMEOUT)
+        return cart_id
+
 class CartItem(BaseModel):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='cart_items')
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = CartItemQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.quantity} x {self.listing.title} in {self.cart}"
 
     @property
     def total_price(self):
+        if hasattr(self, 'line_total'):
+            return self.line_total
         return self.listing.price * self.quantity
 
     class Meta:
@@ -93,6 +183,7 @@ class CartItem(BaseModel):
 class Conversation(BaseModel):
     participants = models.ManyToManyField(User, related_name='conversations')
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='conversations', null=True, blank=True)
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
 
     def __str__(self):
         return f"Conversation {self.id}"
@@ -104,13 +195,117 @@ class Conversation(BaseModel):
         ]
 
     def get_unread_count(self, user):
-        return self.messages.filter(sender__in=self.participants.exclude(id=user.id), is_read=False).count()
+        """Count other participants' messages after ``user``'s read watermark."""
+        state = self.participant_states.filter(user=user).first()
+        messages = self.messages.exclude(sender=user)
+        if state and state.last_read_at:
+            messages = messages.filter(created_at__gt=state.last_read_at)
+        return messages.count()
+
+    def record_message(self, message):
+        """Point last_message at ``message`` and bump the other participants' unread counters."""
+        with transaction.atomic():
+            participant_ids = list(self.participants.values_list('id', flat=True))
+            ConversationParticipant.objects.bulk_create(
+                [ConversationParticipant(conversation=self, user_id=user_id) for user_id in participant_ids],
+                ignore_conflicts=True,
+            )
+            ConversationParticipant.objects.filter(conversation=self).exclude(
+                user_id=message.sender_id
+            ).update(unread_count=F('unread_count') + 1)
+            Conversation.objects.filter(pk=self.pk).update(
+                last_message=message, updated_at=timezone.now()
+            )
+            message_recorded.send(
+                sender=Conversation, conversation=self, message=message, participant_ids=participant_ids
+            )
+        self.last_message = message
+
+    def remove_message(self, message):
+        """
+        Delete ``message``, point last_message at the latest one left and
+        recount every participant's unread counter from their read watermark.
+        """
+        with transaction.atomic():
+            message.delete()
+            latest = self.messages.order_by('-created_at', '-id').first()
+            Conversation.objects.filter(pk=self.pk).update(last_message=latest)
+            others = Message.objects.filter(conversation=self).exclude(sender=OuterRef('user'))
+
+            def count(messages):
+                return Coalesce(Subquery(
+                    messages.order_by().values('conversation').annotate(count=Count('id')).values('count')
+                ), 0)
+
+            states = ConversationParticipant.objects.filter(conversation=self)
+            states.filter(last_read_at__isnull=True).update(unread_count=count(others))
+            states.filter(last_read_at__isnull=False).update(
+                unread_count=count(others.filter(created_at__gt=OuterRef('last_read_at')))
+            )
+        self.last_message = latest
+
+    def mark_read(self, user, up_to=None):
+        """
+        Move ``user``'s read watermark to ``up_to`` (default: the latest message)
+        and set their unread counter to the other participants' messages after
+        it, counted in the same statement. This is a single-row write however
+        many messages it covers.
+        """
+        if up_to is None:
+            up_to = self.messages.order_by('-created_at', '-id').only('id', 'created_at').first()
+            if up_to is None:
+                return
+        unread = Coalesce(Subquery(
+            self.messages.filter(created_at__gt=up_to.created_at).exclude(sender=user)
+            .order_by().values('conversation').annotate(count=Count('id')).values('count'),
+        ), 0)
+        with transaction.atomic():
+            updated = ConversationParticipant.objects.filter(
+                Q(last_read_at__isnull=True) | Q(last_read_at__lt=up_to.created_at),
+                conversation=self, user=user,
+            ).update(last_read_message=up_to, last_read_at=up_to.created_at, unread_count=unread)
+            if not updated:
+                state, created = ConversationParticipant.objects.get_or_create(
+                    conversation=self, user=user,
+                    defaults={'last_read_message': up_to, 'last_read_at': up_to.created_at},
+                )
+                if created:
+                    ConversationParticipant.objects.filter(pk=state.pk).update(unread_count=unread)
+            participant_ids = list(self.participants.values_list('id', flat=True))
+            conversation_read.send(
+                sender=Conversation, conversation=self, user=user, participant_ids=participant_ids
+            )
+
+class ConversationParticipant(models.Model):
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='participant_states')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_states')
+    # Denormalized from the watermark below so the inbox needs no counting
+    unread_count = models.PositiveIntegerField(default=0)
+    # Read watermark: everything up to and including last_read_at has been read
+    last_read_message = models.ForeignKey('Message', on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user.username} in {self.conversation}"
+
+    class Meta:
+        unique_together = ['conversation', 'user']
+
+class MessageQuerySet(models.QuerySet):
+    def with_read_state(self):
+        """Annotate ``read_by_others``: another participant's watermark has passed the message."""
+        return self.annotate(read_by_others=Exists(
+            ConversationParticipant.objects.filter(
+                conversation=OuterRef('conversation'), last_read_at__gte=OuterRef('created_at')
+            ).exclude(user=OuterRef('sender'))
+        ))
 
 class Message(BaseModel):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
-    is_read = models.BooleanField(default=False)
+
+    objects = MessageQuerySet.as_manager()
 
     def __str__(self):
         return f"Message from {self.sender.username} in {self.conversation}"
@@ -119,13 +314,18 @@ class Message(BaseModel):
         ordering = ['created_at']
         indexes = [
             models.Index(fields=['created_at']),
-            models.Index(fields=['is_read']),
+            models.Index(fields=['conversation', 'created_at']),
         ]
 
-    def mark_as_read(self):
-        if not self.is_read:
-            self.is_read = True
-            self.save(update_fields=['is_read'])
+    def is_read_by_others(self):
+        if hasattr(self, 'read_by_others'):
+            return self.read_by_others
+        return ConversationParticipant.objects.filter(
+            conversation_id=self.conversation_id, last_read_at__gte=self.created_at
+        ).exclude(user_id=self.sender_id).exists()
+
+    def mark_as_read(self, user):
+        self.conversation.mark_read(user, up_to=self)
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -139,18 +339,35 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
-    stripe_session_id = models.CharField(max_length=255, null=True, blank=True)
+    stripe_session_id = models.CharField(max_length=255, null=True, blank=True, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Order {self.id} - {self.user.username}"
 
+class CheckoutSession(BaseModel):
+    """
+    The cart lines a payment session was created for: ``[listing_id,
+    quantity, unit price]`` each. The paid order is built from these, not
+    from the cart as it is when the webhook is applied; see checkout.py.
+    """
+    session_id = models.CharField(max_length=255, unique=True)
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='checkout_sessions')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='checkout_sessions')
+    items = models.JSONField(default=list)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"Checkout {self.session_id} for cart {self.cart_id}"
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     price_at_time = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)  
+    # The listing's category when ordered, which seller stats are kept under
+    category = models.CharField(max_length=50, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -159,3 +376,239 @@ class OrderItem(models.Model):
 
     class Meta:
         unique_together = ['order', 'listing']
+
+class OutboundEmail(BaseModel):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.recipients)} ({self.status})"
+
+    class Meta:
+        ordering = ['next_attempt_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    @classmethod
+    def queue(cls, subject, body, from_email, recipient_list):
+        """Store an email for the send_queued_email worker; same arguments as send_mail()."""
+        return cls.objects.create(
+            subject=subject,
+            body=body,
+            from_email=from_email or '',
+            recipients=list(recipient_list),
+        )
+
+class ImageJob(BaseModel):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    model = models.CharField(max_length=100)
+    object_id = models.PositiveBigIntegerField()
+    field = models.CharField(max_length=100)
+    source = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.source} for {self.model} {self.object_id} ({self.status})"
+
+    class Meta:
+        ordering = ['next_attempt_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    @classmethod
+    def queue(cls, instance, field):
+        """Queue variant rendering for ``instance``'s image ``field`` unless it is already pending."""
+        return cls.objects.get_or_create(
+            model=instance._meta.label_lower,
+            object_id=instance.pk,
+            field=field,
+            source=getattr(instance, field).name,
+            status='pending',
+        )[0]
+
+class ImportCheckpoint(BaseModel):
+    """How many records of a named import have been committed, for resuming it."""
+    name = models.CharField(max_length=255, unique=True)
+    position = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} at {self.position}"
+
+class SellerStats(models.Model):
+    """
+    Per-seller order rollup for one day, week or month, kept up to date by
+    seller_stats.py. Rows with a blank category are the seller's totals over
+    all categories; an order counts once in each row it has items in.
+    """
+    PERIOD_CHOICES = [
+        ('day', 'Day'),
+        ('week', 'Week'),
+        ('month', 'Month'),
+    ]
+
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='seller_stats')
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    category = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.seller_id} {self.period} {self.period_start} {self.category or '*'} {self.status}"
+
+    class Meta:
+        unique_together = ['seller', 'period', 'period_start', 'category', 'status']
+
+class ListingFacetCount(models.Model):
+    """Active listings per category, condition and price bucket; see facets.py."""
+    category = models.CharField(max_length=50)
+    condition = models.CharField(max_length=20)
+    price_bucket = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.category}/{self.condition}/{self.price_bucket}: {self.count}"
+
+    class Meta:
+        unique_together = ['category', 'condition', 'price_bucket']
+
+class WebhookEvent(BaseModel):
+    """
+    A payment provider webhook as delivered, stored before it is acknowledged
+    and applied later by process_webhook_events; see webhooks.py.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('ignored', 'Ignored'),
+        ('failed', 'Failed'),
+    ]
+
+    provider = models.CharField(max_length=20, default='stripe')
+    event_id = models.CharField(max_length=255)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    occurred_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.provider} {self.type} {self.event_id} ({self.status})"
+
+    class Meta:
+        unique_together = ['provider', 'event_id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+class ListingView(models.Model):
+    """A signed-in user's view of a listing, written by the view count buffer; see recommendations.py."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listing_views')
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='views')
+    viewed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user_id} viewed {self.listing_id} at {self.viewed_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-viewed_at']),
+            models.Index(fields=['viewed_at']),
+        ]
+
+class ListingNeighbor(models.Model):
+    """
+    One of the listings most often viewed, carted or bought by the same users
+    as ``listing``, written by build_recommendations; see recommendations.py.
+    """
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='neighbor_of')
+    score = models.FloatField()
+
+    def __str__(self):
+        return f"{self.listing_id} -> {self.neighbor_id} ({self.score:.3f})"
+
+    class Meta:
+        unique_together = ['listing', 'neighbor']
+        indexes = [
+            models.Index(fields=['listing', '-score']),
+        ]
+
+class PriceChange(models.Model):
+    """
+    Append-only log of listing prices: a row when a listing is created and one
+    per price change. Rolled up into ListingPriceDaily and CategoryPriceDaily
+    and pruned after PRICE_HISTORY_RAW_DAYS; see prices.py.
+    """
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='price_changes')
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    previous_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.listing_id}: {self.previous_price} -> {self.price} at {self.changed_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['listing', 'changed_at']),
+            models.Index(fields=['changed_at']),
+        ]
+
+class ListingPriceDaily(models.Model):
+    """A listing's prices on a day it changed price (or was created), from PriceChange."""
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='daily_prices')
+    day = models.DateField()
+    open = models.DecimalField(max_digits=10, decimal_places=2)
+    close = models.DecimalField(max_digits=10, decimal_places=2)
+    low = models.DecimalField(max_digits=10, decimal_places=2)
+    high = models.DecimalField(max_digits=10, decimal_places=2)
+    changes = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.listing_id} {self.day}: {self.open} -> {self.close}"
+
+    class Meta:
+        unique_together = ['listing', 'day']
+
+class CategoryPriceDaily(models.Model):
+    """Prices of a category's active listings at the end of a day; see prices.py."""
+    category = models.CharField(max_length=50)
+    day = models.DateField()
+    listings = models.PositiveIntegerField(default=0)
+    median = models.DecimalField(max_digits=10, decimal_places=2)
+    low = models.DecimalField(max_digits=10, decimal_places=2)
+    high = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.category} {self.day}: median {self.median} over {self.listings}"
+
+    class Meta:
+        unique_together = ['category', 'day']
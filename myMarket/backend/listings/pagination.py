@@ -0,0 +1,136 @@
+"""
+Keyset pagination for the long, append-heavy lists (listings, messages, orders).
+
+Page-number pagination runs a COUNT(*) and an OFFSET that both grow with the
+page number. KeysetPagination instead remembers the sort values of the last
+row it returned and asks for rows strictly after them, so every page costs the
+same index range scan. Any ordering the view applies is supported; the primary
+key is appended as a tiebreak so cursors stay stable on non-unique columns
+such as price or view_count.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['reverse']
+
+        ordering = [self.flip(field) for field in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(ordering, cursor['values']))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.next_values = self.previous_values = None
+        if rows and (has_more or reverse):
+            self.next_values = self.values_of(rows[-1])
+        if rows and (cursor is not None and (has_more or not reverse)):
+            self.previous_values = self.values_of(rows[0])
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_link(self.next_values, reverse=False)),
+            ('previous', self.get_link(self.previous_values, reverse=True)),
+            ('results', data),
+        ]))
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        for field in ordering:
+            if not isinstance(field, str) or '__' in field:
+                raise NotFound('Cursor pagination does not support this ordering')
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-pk' if descending else 'pk')
+        return ordering
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def after(ordering, values):
+        """Rows strictly after ``values`` in ``ordering``: (a > x) OR (a = x AND b > y) ..."""
+        condition = Q()
+        for position, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[position]})
+            for previous, value in zip(ordering[:position], values):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def values_of(self, row):
+        return [getattr(row, field.lstrip('-')) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            if len(cursor['values']) != len(self.ordering):
+                raise ValueError
+            return {'reverse': bool(cursor.get('reverse')), 'values': cursor['values']}
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def encode_value(value):
+        # Full-precision isoformat; DjangoJSONEncoder would drop microseconds
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+    def get_link(self, values, reverse):
+        if values is None:
+            return None
+        cursor = json.dumps({'values': values, 'reverse': reverse}, default=self.encode_value)
+        encoded = urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+class SelectablePagination(BasePagination):
+    """
+    Page-number pagination by default; keyset pagination when the request asks
+    for ``?pagination=cursor`` or already carries a cursor.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.delegate = self.choose(request)
+        return self.delegate.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.delegate.get_paginated_response(data)
+
+    @staticmethod
+    def choose(request):
+        params = request.query_params
+        if params.get('pagination') == 'cursor' or KeysetPagination.cursor_query_param in params:
+            return KeysetPagination()
+        return PageNumberPagination()
@@ -0,0 +1,156 @@
+"""
+Payment providers for checkout.
+
+create_checkout_session (views.py) awaits
+get_payment_provider().create_checkout_session(), which returns the
+provider's session id. PAYMENT_PROVIDER names the class:
+
+StripeProvider keeps one StripeClient per process. With httpx installed it
+uses Stripe's async HTTPX client; otherwise it runs the call in a worker
+thread over a requests Session holding up to PAYMENT_POOL_SIZE connections.
+Either way connections stay open between checkouts.
+
+FakeProvider makes up session ids after PAYMENT_FAKE_LATENCY_MS, for
+benchmarks and offline development; loadtest_api uses it.
+
+Every call is bounded by PAYMENT_TIMEOUT_SECONDS and passes through a
+CircuitBreaker: after PAYMENT_BREAKER_FAILURES failures in a row, calls fail
+at once with PaymentUnavailable for PAYMENT_BREAKER_RESET_SECONDS, then one
+trial call is let through.
+"""
+import asyncio
+import threading
+import time
+import uuid
+
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class PaymentError(Exception):
+    """The provider refused the request; retrying it unchanged won't help."""
+
+
+class PaymentUnavailable(PaymentError):
+    """The provider couldn't be reached, timed out, or the circuit is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failures, reset_seconds):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            # Half open: let this call through and hold the others back until it finishes
+            self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failures:
+                self.opened_at = time.monotonic()
+
+
+class PaymentProvider:
+    def __init__(self):
+        self.breaker = CircuitBreaker(settings.PAYMENT_BREAKER_FAILURES, settings.PAYMENT_BREAKER_RESET_SECONDS)
+
+    async def create_checkout_session(self, line_items, customer_email, metadata, success_url, cancel_url):
+        if not self.breaker.allow():
+            raise PaymentUnavailable('Payment provider unavailable, try again shortly')
+        try:
+            session_id = await asyncio.wait_for(
+                self.create_session(line_items, customer_email, metadata, success_url, cancel_url),
+                settings.PAYMENT_TIMEOUT_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            raise PaymentUnavailable('Payment provider timed out')
+        except PaymentUnavailable:
+            self.breaker.record_failure()
+            raise
+        except PaymentError:
+            # The provider answered; it's up
+            self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return session_id
+
+    async def create_session(self, line_items, customer_email, metadata, success_url, cancel_url):
+        raise NotImplementedError
+
+
+class StripeProvider(PaymentProvider):
+    def __init__(self):
+        super().__init__()
+        try:
+            http_client = stripe.HTTPXClient(timeout=settings.PAYMENT_TIMEOUT_SECONDS)
+            self.is_async = True
+        except ImportError:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=settings.PAYMENT_POOL_SIZE)
+            session.mount('https://', adapter)
+            http_client = stripe.RequestsClient(timeout=settings.PAYMENT_TIMEOUT_SECONDS, session=session)
+            self.is_async = False
+        self.client = stripe.StripeClient(
+            settings.STRIPE_SECRET_KEY or '',
+            http_client=http_client,
+            max_network_retries=settings.PAYMENT_MAX_RETRIES,
+        )
+
+    async def create_session(self, line_items, customer_email, metadata, success_url, cancel_url):
+        params = {
+            'payment_method_types': ['card'],
+            'line_items': line_items,
+            'mode': 'payment',
+            'success_url': success_url,
+            'cancel_url': cancel_url,
+            'customer_email': customer_email,
+            'metadata': metadata,
+        }
+        try:
+            if self.is_async:
+                session = await self.client.checkout.sessions.create_async(params=params)
+            else:
+                session = await sync_to_async(self.client.checkout.sessions.create, thread_sensitive=False)(
+                    params=params
+                )
+        except (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError) as e:
+            raise PaymentUnavailable(str(e)) from e
+        except stripe.StripeError as e:
+            raise PaymentError(str(e)) from e
+        return session.id
+
+
+class FakeProvider(PaymentProvider):
+    async def create_session(self, line_items, customer_email, metadata, success_url, cancel_url):
+        if settings.PAYMENT_FAKE_LATENCY_MS:
+            await asyncio.sleep(settings.PAYMENT_FAKE_LATENCY_MS / 1000)
+        return f'cs_fake_{uuid.uuid4().hex}'
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+def get_payment_provider():
+    with _providers_lock:
+        if settings.PAYMENT_PROVIDER not in _providers:
+            _providers[settings.PAYMENT_PROVIDER] = import_string(settings.PAYMENT_PROVIDER)()
+        return _providers[settings.PAYMENT_PROVIDER]
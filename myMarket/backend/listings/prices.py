@@ -0,0 +1,143 @@
+"""
+Listing price history.
+
+PriceChange is the raw, append-only log: Listing signals add a row when a
+listing is created and whenever its price changes (see signals.py), and
+ListingImporter adds the rows for imported listings; QuerySet.update() of
+prices bypasses both and leaves no history. rollup_prices runs once a day
+(from cron) and turns a finished day into:
+
+- ListingPriceDaily: open, close, low and high of each listing that changed
+  price that day. Days without changes have no row; the last close carries.
+- CategoryPriceDaily: median, low and high of every active listing's price
+  at the end of the day, per category. Prices changed since then are wound
+  back with the first later PriceChange, so the day can be rolled up late.
+
+Raw rows older than PRICE_HISTORY_RAW_DAYS are then deleted; the rollups are
+kept. The price drop feed reads the raw rows of the last few days, and the
+category and listing series read only the rollups.
+"""
+import statistics
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import CategoryPriceDaily, Listing, ListingPriceDaily, PriceChange
+
+CENT = Decimal('0.01')
+
+
+def record_change(listing, previous_price):
+    PriceChange.objects.create(listing=listing, price=listing.price, previous_price=previous_price)
+
+
+def record_created(listings):
+    """Log the starting price of new ``listings`` saved without signals (bulk_create)."""
+    PriceChange.objects.bulk_create([
+        PriceChange(listing_id=listing.pk, price=listing.price) for listing in listings
+    ], batch_size=1000)
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def rollup_listings(day):
+    """Replace ``day``'s ListingPriceDaily rows; returns how many were written."""
+    start, end = day_bounds(day)
+    rows = {}
+    changes = PriceChange.objects.filter(changed_at__gte=start, changed_at__lt=end).order_by(
+        'listing_id', 'changed_at', 'id'
+    ).values_list('listing_id', 'price', 'previous_price')
+    for listing_id, price, previous_price in changes.iterator(chunk_size=5000):
+        row = rows.get(listing_id)
+        if row is None:
+            opening = price if previous_price is None else previous_price
+            row = rows[listing_id] = ListingPriceDaily(
+                listing_id=listing_id, day=day, open=opening, close=opening, low=opening, high=opening,
+            )
+        row.close = price
+        row.low = min(row.low, price)
+        row.high = max(row.high, price)
+        if previous_price is not None:
+            row.changes += 1
+    with transaction.atomic():
+        ListingPriceDaily.objects.filter(day=day).delete()
+        ListingPriceDaily.objects.bulk_create(rows.values(), batch_size=1000)
+    return len(rows)
+
+
+def rollup_categories(day):
+    """Replace ``day``'s CategoryPriceDaily rows; returns how many were written."""
+    start, end = day_bounds(day)
+    # Each listing's price at the end of the day, for those changed since
+    prices_then = {}
+    later = PriceChange.objects.filter(changed_at__gte=end).order_by(
+        'listing_id', 'changed_at', 'id'
+    ).values_list('listing_id', 'previous_price')
+    for listing_id, previous_price in later.iterator(chunk_size=5000):
+        prices_then.setdefault(listing_id, previous_price)
+
+    prices = defaultdict(list)
+    listings = Listing.objects.filter(is_active=True, created_at__lt=end).values_list('id', 'category', 'price')
+    for listing_id, category, price in listings.iterator(chunk_size=5000):
+        if listing_id in prices_then:
+            price = prices_then[listing_id]
+            if price is None:
+                continue
+        prices[category].append(price)
+    with transaction.atomic():
+        CategoryPriceDaily.objects.filter(day=day).delete()
+        CategoryPriceDaily.objects.bulk_create([
+            CategoryPriceDaily(
+                category=category, day=day, listings=len(values),
+                median=Decimal(statistics.median(values)).quantize(CENT), low=min(values), high=max(values),
+            )
+            for category, values in prices.items()
+        ])
+    return len(prices)
+
+
+def prune():
+    """Delete raw rows older than PRICE_HISTORY_RAW_DAYS; returns how many."""
+    cutoff = timezone.now() - timedelta(days=settings.PRICE_HISTORY_RAW_DAYS)
+    return PriceChange.objects.filter(changed_at__lt=cutoff).delete()[0]
+
+
+def price_drops(queryset, since):
+    """
+    Listings in ``queryset`` now cheaper than the highest price they had since
+    ``since``, annotated with that price (``was_price``) and the time of their
+    latest change (``price_changed_at``).
+    """
+    recent = PriceChange.objects.filter(changed_at__gte=since)
+    # Starts from the changes in the window, not from every listing
+    window = recent.filter(listing=OuterRef('pk')).values('listing')
+    return queryset.filter(pk__in=recent.values('listing_id')).annotate(
+        was_price=Subquery(window.annotate(value=Max('previous_price')).values('value')),
+        price_changed_at=Subquery(window.annotate(value=Max('changed_at')).values('value')),
+    ).filter(price__lt=F('was_price'))
+
+
+def category_series(start, end, category=None):
+    """``{category: [{day, listings, median, low, high}, ...]}`` from the rollups, oldest first."""
+    rows = CategoryPriceDaily.objects.filter(day__gte=start, day__lte=end)
+    if category:
+        rows = rows.filter(category=category)
+    series = defaultdict(list)
+    for row in rows.order_by('category', 'day').values('category', 'day', 'listings', 'median', 'low', 'high'):
+        series[row.pop('category')].append(row)
+    return series
+
+
+def listing_series(listing_id, start, end):
+    return list(
+        ListingPriceDaily.objects.filter(listing_id=listing_id, day__gte=start, day__lte=end)
+        .order_by('day').values('day', 'open', 'close', 'low', 'high', 'changes')
+    )
@@ -0,0 +1,222 @@
+"""
+Push channel for conversation events.
+
+Clients hold open ``GET /api/events/`` (Server-Sent Events) and receive new
+messages and read receipts for every conversation they take part in,
+instead of polling the conversation and message endpoints. The stream only
+works when the app is served by marketplace.asgi; under WSGI the endpoint
+answers 501 rather than tying up a worker thread forever.
+
+Events are published to one channel per user (``user:<id>``) through the
+broker named by REALTIME_BROKER, from the message_recorded and
+conversation_read signals (see signals.py). InProcessBroker only reaches
+subscribers connected to the same process, so it is for development and
+single-process servers. RedisBroker, the default once REDIS_URL is set,
+relays every event through Redis pub/sub so each server process delivers it
+to the clients connected there.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from .authentication import CachedJWTAuthentication
+
+logger = logging.getLogger(__name__)
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class Subscription:
+    def __init__(self, broker, channels, queue, loop):
+        self.broker = broker
+        self.channels = channels
+        self.queue = queue
+        self.loop = loop
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    def publish(self, channel, event):
+        raise NotImplementedError
+
+    def subscribe(self, channels):
+        """Return a Subscription; must be called from the event loop that will read it."""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class InProcessBroker(Broker):
+    """Fans events out to the subscribers in this process only."""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels):
+        subscription = Subscription(
+            self, list(channels), asyncio.Queue(self.queue_size), asyncio.get_running_loop()
+        )
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({s for subscribers in self._subscribers.values() for s in subscribers})
+
+    def publish(self, channel, event):
+        # Called from request threads; hand the event to each subscriber's loop
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(self._deliver, subscription, event)
+
+    @staticmethod
+    def _deliver(subscription, event):
+        try:
+            subscription.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("Dropping event for slow subscriber on %s", subscription.channels)
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Publishes to Redis; one pattern subscription per process receives every
+    user channel and hands each event to the subscribers connected here.
+    """
+    prefix = 'realtime:'
+
+    def __init__(self, url=None, queue_size=100):
+        super().__init__(queue_size)
+        self.redis = redis.Redis.from_url(url or settings.REALTIME_REDIS_URL)
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.psubscribe(**{f'{self.prefix}*': self._relay})
+        self._listener = self._pubsub.run_in_thread(
+            sleep_time=1, daemon=True, exception_handler=self._listener_failed
+        )
+
+    def publish(self, channel, event):
+        self.redis.publish(self.prefix + channel, json.dumps(event))
+
+    def _relay(self, message):
+        channel = message['channel'].decode()[len(self.prefix):]
+        super().publish(channel, json.loads(message['data']))
+
+    @staticmethod
+    def _listener_failed(error, pubsub, thread):
+        # The pubsub reconnects and resubscribes on its next read
+        logger.warning("Realtime Redis listener failed: %s", error)
+        time.sleep(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.REALTIME_BROKER)()
+        return _broker
+
+
+def publish_to_users(user_ids, event):
+    """Publish ``event`` to each user's channel once the current transaction commits."""
+    def publish():
+        broker = get_broker()
+        for user_id in user_ids:
+            broker.publish(user_channel(user_id), event)
+    transaction.on_commit(publish)
+
+
+def message_event(message):
+    return {
+        'type': 'message',
+        'conversation': message.conversation_id,
+        'message': {
+            'id': message.id,
+            'conversation': message.conversation_id,
+            'sender': {'id': message.sender_id, 'username': message.sender.username},
+            'content': message.content,
+            'created_at': message.created_at.isoformat(),
+        },
+    }
+
+
+def read_event(conversation_id, user_id):
+    return {'type': 'read', 'conversation': conversation_id, 'user': user_id}
+
+
+def _authenticate(request):
+    # EventSource can't send headers, so the access token may come as ?token=
+    authentication = CachedJWTAuthentication()
+    try:
+        raw_token = request.GET.get('token')
+        if raw_token:
+            return authentication.get_user(authentication.get_validated_token(raw_token), trust_claims=True)
+        result = authentication.authenticate(request)
+        return result[0] if result else None
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+
+
+async def conversation_events(request):
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('Event streams need the ASGI server (marketplace.asgi).', status=501)
+
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return HttpResponse(status=401)
+
+    subscription = get_broker().subscribe([user_channel(user.id)])
+
+    async def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), settings.REALTIME_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
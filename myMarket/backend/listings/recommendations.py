@@ -0,0 +1,108 @@
+"""
+Item-to-item recommendations (ListingNeighbor).
+
+build_recommendations (run it from cron, e.g. nightly) gives each user a
+sparse row of weights over the listings they interacted with: WEIGHTS per
+source, the strongest source winning. Sources are orders that were not
+cancelled, current cart items, and ListingView rows from the last
+RECOMMENDATION_VIEW_DAYS days. Multiplying that user x listing matrix by its
+transpose gives listing x listing co-occurrence. rebuild() accumulates it one
+user row at a time in dicts, which is all the sparse algebra this needs. A
+user's row is capped at MAX_ITEMS_PER_USER listings, so one very busy
+account can't dominate the pairs or the run time.
+
+Scores are cosine similarities, co-occurrence over the product of the two
+listings' norms, so popular listings don't neighbour everything. The best
+RECOMMENDATION_NEIGHBORS active listings per listing are stored. The
+/similar/ and /recommended/ endpoints read only that table.
+"""
+import math
+from collections import defaultdict
+from datetime import timedelta
+from heapq import nlargest
+
+from django.conf import settings
+from django.db import reset_queries, transaction
+from django.utils import timezone
+
+from .cache import LISTINGS_TAG, listing_cache
+from .models import CartItem, Listing, ListingNeighbor, ListingView, OrderItem
+
+WEIGHTS = {
+    'order': 3.0,
+    'cart': 2.0,
+    'view': 1.0,
+}
+MAX_ITEMS_PER_USER = 200
+
+
+def interactions():
+    """``(source, user_id, listing_id)`` for every interaction the model learns from."""
+    since = timezone.now() - timedelta(days=settings.RECOMMENDATION_VIEW_DAYS)
+    sources = {
+        'order': OrderItem.objects.exclude(order__status='cancelled').values_list('order__user_id', 'listing_id'),
+        'cart': CartItem.objects.values_list('cart__user_id', 'listing_id'),
+        'view': ListingView.objects.filter(viewed_at__gte=since).values_list('user_id', 'listing_id'),
+    }
+    for source, rows in sources.items():
+        for user_id, listing_id in rows.order_by().distinct().iterator(chunk_size=5000):
+            yield source, user_id, listing_id
+
+
+def user_rows():
+    """``{user_id: {listing_id: weight}}``, the sparse user x listing matrix."""
+    rows = defaultdict(dict)
+    for source, user_id, listing_id in interactions():
+        row = rows[user_id]
+        row[listing_id] = max(row.get(listing_id, 0.0), WEIGHTS[source])
+    for user_id, row in rows.items():
+        if len(row) > MAX_ITEMS_PER_USER:
+            rows[user_id] = dict(nlargest(MAX_ITEMS_PER_USER, row.items(), key=lambda item: item[1]))
+    return rows
+
+
+def neighbors(rows, active_ids, limit):
+    """``{listing_id: [(neighbor_id, score), ...]}``, best first, from the user rows."""
+    cooccurrence = defaultdict(lambda: defaultdict(float))
+    norms = defaultdict(float)
+    for row in rows.values():
+        items = list(row.items())
+        for listing_id, weight in items:
+            norms[listing_id] += weight * weight
+        for position, (listing_id, weight) in enumerate(items):
+            for other_id, other_weight in items[position + 1:]:
+                product = weight * other_weight
+                cooccurrence[listing_id][other_id] += product
+                cooccurrence[other_id][listing_id] += product
+
+    result = {}
+    for listing_id, counts in cooccurrence.items():
+        scored = (
+            (other_id, total / math.sqrt(norms[listing_id] * norms[other_id]))
+            for other_id, total in counts.items() if other_id in active_ids
+        )
+        result[listing_id] = nlargest(limit, scored, key=lambda item: item[1])
+    return result
+
+
+def rebuild():
+    """Recompute every listing's neighbours; returns ``(listings, rows written)``."""
+    rows = user_rows()
+    active_ids = set(Listing.objects.filter(is_active=True).values_list('id', flat=True))
+    best = neighbors(rows, active_ids, settings.RECOMMENDATION_NEIGHBORS)
+    # Views older than the window no longer count
+    ListingView.objects.filter(
+        viewed_at__lt=timezone.now() - timedelta(days=settings.RECOMMENDATION_VIEW_DAYS)
+    ).delete()
+    with transaction.atomic():
+        # Skips listings deleted while this ran
+        existing = set(Listing.objects.values_list('id', flat=True))
+        ListingNeighbor.objects.all().delete()
+        created = len(ListingNeighbor.objects.bulk_create([
+            ListingNeighbor(listing_id=listing_id, neighbor_id=neighbor_id, score=score)
+            for listing_id, scored in best.items() if listing_id in existing
+            for neighbor_id, score in scored if neighbor_id in existing
+        ], batch_size=1000))
+        transaction.on_commit(lambda: listing_cache.invalidate(LISTINGS_TAG))
+    reset_queries()
+    return sum(1 for listing_id in best if listing_id in existing), created
@@ -0,0 +1,183 @@
+"""
+Full-text search over listing titles and descriptions.
+
+Postgres keeps a tsvector per listing in ``listings_listing_search`` behind a
+GIN index; SQLite keeps an FTS5 table ``listings_listing_fts``. Both are
+updated from Listing's post_save/post_delete signals (see signals.py) and
+return listing ids ranked by relevance, with every term prefix-matched.
+Searches are restricted to the listings the rest of the request's filters
+(active, category, condition, owner, near) leave, checked per match in the
+index query itself, so the SEARCH_MAX_RESULTS cap applies after filtering.
+Other databases fall back to DRF's icontains SearchFilter.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, FloatField, Value, When
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return TERM_RE.findall(query.lower())
+
+
+class SearchBackend:
+    def index(self, listing):
+        raise NotImplementedError
+
+    def index_many(self, listings):
+        for listing in listings:
+            self.index(listing)
+
+    def remove(self, listing_id):
+        raise NotImplementedError
+
+    def rebuild(self):
+        raise NotImplementedError
+
+    def search(self, terms, limit, within=None):
+        """Return ``(listing_id, rank)`` pairs, best match first, of listings in ``within`` if given."""
+        raise NotImplementedError
+
+    @staticmethod
+    def within_sql(queryset, column):
+        """SQL condition and params keeping index rows whose ``column`` is a listing in ``queryset``."""
+        if queryset is None:
+            return '', []
+        # A correlated EXISTS, so the index match still drives the query
+        inner = queryset.order_by().filter(pk=RawSQL(column, ())).values('pk')
+        sql, params = inner.query.sql_with_params()
+        return f' AND EXISTS ({sql})', list(params)
+
+
+class PostgresSearchBackend(SearchBackend):
+    table = 'listings_listing_search'
+    document = (
+        "setweight(to_tsvector('english', coalesce(%s, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(%s, '')), 'B')"
+    )
+
+    def index(self, listing):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.table} (listing_id, document) VALUES (%s, {self.document}) "
+                f"ON CONFLICT (listing_id) DO UPDATE SET document = EXCLUDED.document",
+                [listing.pk, listing.title, listing.description],
+            )
+
+    def index_many(self, listings):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (listing_id, document) VALUES (%s, {self.document}) "
+                f"ON CONFLICT (listing_id) DO UPDATE SET document = EXCLUDED.document",
+                [[listing.pk, listing.title, listing.description] for listing in listings],
+            )
+
+    def remove(self, listing_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE listing_id = %s", [listing_id])
+
+    def rebuild(self):
+        document = self.document % ('title', 'description')
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {self.table}")
+            cursor.execute(
+                f"INSERT INTO {self.table} (listing_id, document) "
+                f"SELECT id, {document} FROM listings_listing"
+            )
+
+    def search(self, terms, limit, within=None):
+        query = ' & '.join(f'{term}:*' for term in terms)
+        condition, params = self.within_sql(within, f'{self.table}.listing_id')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT listing_id, ts_rank(document, q) AS rank "
+                f"FROM {self.table}, to_tsquery('english', %s) q "
+                f"WHERE document @@ q{condition} ORDER BY rank DESC LIMIT %s",
+                [query, *params, limit],
+            )
+            return cursor.fetchall()
+
+
+class SQLiteSearchBackend(SearchBackend):
+    table = 'listings_listing_fts'
+
+    def index(self, listing):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [listing.pk])
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, title, description) VALUES (%s, %s, %s)",
+                [listing.pk, listing.title, listing.description],
+            )
+
+    def index_many(self, listings):
+        listings = list(listings)
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [[listing.pk] for listing in listings])
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, title, description) VALUES (%s, %s, %s)",
+                [[listing.pk, listing.title, listing.description] for listing in listings],
+            )
+
+    def remove(self, listing_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [listing_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, title, description) "
+                f"SELECT id, title, description FROM listings_listing"
+            )
+
+    def search(self, terms, limit, within=None):
+        query = ' '.join(f'"{term}"*' for term in terms)
+        condition, params = self.within_sql(within, f'{self.table}.rowid')
+        with connection.cursor() as cursor:
+            # bm25() is lower for better matches; title hits weigh double
+            cursor.execute(
+                f"SELECT rowid, -bm25({self.table}, 2.0, 1.0) AS rank FROM {self.table} "
+                f"WHERE {self.table} MATCH %s{condition} ORDER BY bm25({self.table}, 2.0, 1.0) LIMIT %s",
+                [query, *params, limit],
+            )
+            return cursor.fetchall()
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_search_backend():
+    backend_class = SEARCH_BACKENDS.get(connection.vendor)
+    return backend_class() if backend_class else None
+
+
+class ListingSearchFilter(filters.SearchFilter):
+    """SearchFilter that ranks results from the full-text index instead of scanning with icontains."""
+
+    def filter_queryset(self, request, queryset, view):
+        backend = get_search_backend()
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        terms = tokenize(' '.join(self.get_search_terms(request)))
+        if not terms:
+            return queryset
+
+        ranked = backend.search(terms, settings.SEARCH_MAX_RESULTS, within=queryset)
+        if not ranked:
+            return queryset.none()
+        rank = Case(
+            *[When(pk=listing_id, then=Value(score)) for listing_id, score in ranked],
+            output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=[listing_id for listing_id, _ in ranked]).annotate(
+            search_rank=rank
+        ).order_by('-search_rank', *queryset.query.order_by)
@@ -0,0 +1,228 @@
+"""
+Seller dashboard rollups (SellerStats).
+
+Every order adds, for each seller with items in it, the units, revenue and a
+count of one order to that seller's row for the order's day, week and month,
+once under the category the listing had when it was ordered (kept on the
+OrderItem, so later edits to the listing don't move it) and once under the
+blank "all categories" total (just once for items with no category), all
+under the order's current status. A status change moves those amounts from
+the old status rows to the new ones, and deleting an order takes them away
+again, so the dashboard never has to scan order history.
+
+checkout.complete_checkout records new orders; status changes and deletes
+come through Order signals, and deleting a listing takes its order items out
+through a Listing signal (see signals.py). Changes made with
+QuerySet.update() or raw SQL bypass these: run rebuild_seller_stats after them.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DateField, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Order, OrderItem, SellerStats, line_total
+
+TRUNCATE = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def period_starts(moment):
+    return period_starts_of_date(timezone.localdate(moment))
+
+
+def period_starts_of_date(day):
+    return {
+        'day': day,
+        'week': day - timedelta(days=day.weekday()),
+        'month': day.replace(day=1),
+    }
+
+
+def contributions(order, exclude_listing=None):
+    """``(seller_id, category, units, revenue)`` for each seller and category in ``order``."""
+    items = OrderItem.objects.filter(order=order)
+    if exclude_listing is not None:
+        items = items.exclude(listing=exclude_listing)
+    return list(
+        items
+        .values_list('listing__owner_id', 'category')
+        .annotate(units=Sum('quantity'), revenue=Sum(line_total('price_at_time')))
+        .order_by()
+    )
+
+
+def apply(order, rows, status, sign):
+    """Add (``sign`` 1) or subtract (-1) ``rows`` of ``order`` under ``status`` in every period."""
+    deltas = {}
+    starts = period_starts(order.created_at)
+    for seller_id, category, units, revenue in rows:
+        for period, start in starts.items():
+            for key_category in (category, '') if category else ('',):
+                key = (seller_id, period, start, key_category)
+                _, total_units, total_revenue = deltas.get(key, (0, 0, Decimal('0')))
+                # An order counts once per row, however many of its items land there
+                deltas[key] = (sign, total_units + sign * units, total_revenue + sign * (revenue or 0))
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        SellerStats.objects.bulk_create([
+            SellerStats(seller_id=seller_id, period=period, period_start=start, category=category, status=status)
+            for seller_id, period, start, category in deltas
+        ], ignore_conflicts=True)
+        keys = Q()
+        for seller_id, period, start, category in deltas:
+            keys |= Q(seller_id=seller_id, period=period, period_start=start, category=category)
+        ids = {
+            (seller_id, period, start, category): pk
+            for pk, seller_id, period, start, category in SellerStats.objects.filter(keys, status=status)
+            .values_list('pk', 'seller_id', 'period', 'period_start', 'category')
+        }
+
+        def increment(position, output_field):
+            return Case(
+                *[When(pk=ids[key], then=Value(delta[position])) for key, delta in deltas.items()],
+                default=Value(0),
+                output_field=output_field,
+            )
+
+        SellerStats.objects.filter(pk__in=ids.values()).update(
+            orders=F('orders') + increment(0, IntegerField()),
+            units=F('units') + increment(1, IntegerField()),
+            revenue=F('revenue') + increment(2, DecimalField(max_digits=14, decimal_places=2)),
+        )
+
+
+def record_order(order):
+    apply(order, contributions(order), order.status, 1)
+
+
+def remove_order(order, status=None):
+    apply(order, contributions(order), status or order.status, -1)
+
+
+def move_order(order, old_status, new_status):
+    rows = contributions(order)
+    with transaction.atomic():
+        apply(order, rows, old_status, -1)
+        apply(order, rows, new_status, 1)
+
+
+def remove_listing(listing, skip_buyer=None):
+    """
+    Take ``listing``'s order items out of the rollups; call before deleting it,
+    as the delete cascades to them. Orders of ``skip_buyer`` are left alone,
+    for when they are deleted in the same cascade.
+    """
+    orders = Order.objects.filter(items__listing=listing).distinct()
+    if skip_buyer is not None:
+        orders = orders.exclude(user=skip_buyer)
+    with transaction.atomic():
+        for order in orders:
+            apply(order, contributions(order), order.status, -1)
+            apply(order, contributions(order, exclude_listing=listing), order.status, 1)
+
+
+def rebuild():
+    """Recompute every rollup from the order tables; returns the number of rows written."""
+    with transaction.atomic():
+        SellerStats.objects.all().delete()
+        created = 0
+        for period, truncate in TRUNCATE.items():
+            for by_category in (True, False):
+                fields = ['listing__owner_id', 'period_start', 'order__status']
+                items = OrderItem.objects.all()
+                if by_category:
+                    fields.append('category')
+                    # Items without a category only count in the totals
+                    items = items.exclude(category='')
+                rows = (
+                    items
+                    .annotate(period_start=truncate('order__created_at', output_field=DateField()))
+                    .values(*fields)
+                    .annotate(
+                        orders=Count('order', distinct=True),
+                        units=Sum('quantity'),
+                        revenue=Sum(line_total('price_at_time')),
+                    )
+                    .order_by()
+                )
+                created += len(SellerStats.objects.bulk_create([
+                    SellerStats(
+                        seller_id=row['listing__owner_id'],
+                        period=period,
+                        period_start=row['period_start'],
+                        category=row['category'] if by_category else '',
+                        status=row['order__status'],
+                        orders=row['orders'],
+                        units=row['units'],
+                        revenue=row['revenue'] or 0,
+                    )
+                    for row in rows.iterator()
+                ], batch_size=1000))
+        return created
+
+
+# Statuses whose orders count towards revenue, units and order totals
+COUNTED_STATUSES = ('pending', 'processing', 'shipped', 'delivered')
+
+DEFAULT_RANGE = {
+    'day': timedelta(days=30),
+    'week': timedelta(weeks=12),
+    'month': timedelta(days=365),
+}
+
+
+def dashboard(seller, period, start=None, end=None):
+    """Totals, a per-period series and a per-category breakdown for ``seller``, in one query."""
+    end = end or timezone.localdate()
+    start = start or end - DEFAULT_RANGE[period]
+    start = period_starts_of_date(start)[period]
+
+    def bucket():
+        return {'revenue': Decimal('0'), 'units': 0, 'orders': 0}
+
+    totals = {**bucket(), 'orders_by_status': {}}
+    series = {}
+    categories = {}
+    rows = SellerStats.objects.filter(
+        seller=seller, period=period, period_start__gte=start, period_start__lte=end
+    ).values_list('period_start', 'category', 'status', 'orders', 'units', 'revenue')
+    for period_start, category, status, orders, units, revenue in rows:
+        if not orders:
+            continue
+        if not category:
+            point = series.setdefault(period_start, {**bucket(), 'orders_by_status': {}})
+            point['orders_by_status'][status] = point['orders_by_status'].get(status, 0) + orders
+            totals['orders_by_status'][status] = totals['orders_by_status'].get(status, 0) + orders
+            targets = [point, totals]
+        else:
+            breakdown = categories.setdefault(category, {**bucket(), 'series': {}})
+            targets = [breakdown, breakdown['series'].setdefault(period_start, bucket())]
+        if status in COUNTED_STATUSES:
+            for target in targets:
+                target['revenue'] += revenue
+                target['units'] += units
+                target['orders'] += orders
+
+    return {
+        'period': period,
+        'start': start,
+        'end': end,
+        'totals': totals,
+        'series': [{'period_start': day, **values} for day, values in sorted(series.items())],
+        'categories': [
+            {
+                'category': category,
+                **{key: value for key, value in values.items() if key != 'series'},
+                'series': [{'period_start': day, **point} for day, point in sorted(values['series'].items())],
+            }
+            for category, values in sorted(categories.items())
+        ],
+    }
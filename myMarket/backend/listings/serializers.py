@@ -1,24 +1,82 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from .models import Listing, Cart, CartItem, UserProfile, Conversation, Message, Order, OrderItem
 from django.contrib.auth.models import User
-from decimal import Decimal
+from marketplace.metrics import TimedSerializerMixin
 
-class UserSerializer(serializers.ModelSerializer):
+
+class ModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    pass
+
+
+class ImageVariantsField(serializers.Field):
+    """URLs of the resized copies of an image field, by format and then width."""
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, obj):
+        image = getattr(obj, self.image_field)
+        variants = getattr(obj, f'{self.image_field}_variants')
+        # Variants of a replaced image that hasn't been reprocessed yet are stale
+        if not image or variants.get('source') != image.name:
+            return {}
+        request = self.context.get('request')
+        urls = {}
+        for format_name, names in variants.items():
+            if format_name == 'source':
+                continue
+            urls[format_name] = {
+                width: request.build_absolute_uri(default_storage.url(name)) if request else default_storage.url(name)
+                for width, name in names.items()
+            }
+        return urls
+
+
+class UserSerializer(ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email']
 
-class ListingSerializer(serializers.ModelSerializer):
+class TokenObtainPairWithClaimsSerializer(TokenObtainPairSerializer):
+    """Token pair whose tokens also carry the username and email (see listings.authentication)."""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['email'] = user.email
+        return token
+
+class ListingSerializer(ModelSerializer):
     owner = UserSerializer(read_only=True)
     seller_name = serializers.SerializerMethodField()
     seller_email = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField('image', source='*')
+    # Only on ?near= searches
+    distance_km = serializers.FloatField(read_only=True)
+    # Only on the price drop feed
+    was_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    price_changed_at = serializers.DateTimeField(read_only=True)
     
     class Meta:
         model = Listing
         fields = ['id', 'title', 'description', 'price', 'category', 
-                 'condition', 'image', 'owner', 'created_at', 
-                 'updated_at', 'is_active', 'seller_name', 'seller_email']
-        read_only_fields = ['owner', 'created_at', 'updated_at']
+                 'condition', 'image', 'image_width', 'image_height', 'image_variants',
+                 'owner', 'created_at', 
+                 'updated_at', 'is_active', 'seller_name', 'seller_email',
+                 'latitude', 'longitude', 'distance_km', 'was_price', 'price_changed_at']
+        read_only_fields = ['owner', 'created_at', 'updated_at', 'image_width', 'image_height']
+
+    def validate(self, attrs):
+        latitude = attrs.get('latitude', getattr(self.instance, 'latitude', None))
+        longitude = attrs.get('longitude', getattr(self.instance, 'longitude', None))
+        if (latitude is None) != (longitude is None):
+            raise serializers.ValidationError('Set latitude and longitude together')
+        return attrs
 
     def get_seller_name(self, obj):
         if obj.owner:
@@ -30,7 +88,7 @@ class ListingSerializer(serializers.ModelSerializer):
             return obj.owner.email
         return None
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(ModelSerializer):
     listing = ListingSerializer(read_only=True)
     listing_id = serializers.IntegerField(write_only=True, required=True)
     total_price = serializers.SerializerMethodField()
@@ -48,11 +106,16 @@ class CartItemSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Listing not found or not active")
 
     def get_total_price(self, obj):
-        if obj.listing and obj.listing.price:
-            return Decimal(str(obj.quantity)) * Decimal(str(obj.listing.price))
-        return Decimal('0.00')
+        return obj.total_price
+
+class CartItemDeltaSerializer(serializers.Serializer):
+    """One cart line as a cart item action left it; quantity 0 means removed."""
+    cart_id = serializers.IntegerField()
+    listing_id = serializers.IntegerField()
+    quantity = serializers.IntegerField()
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2)
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
     
@@ -62,39 +125,43 @@ class CartSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'created_at', 'updated_at']
 
     def get_total_price(self, obj):
-        total = Decimal('0.00')
-        for item in obj.items.all():
-            if item.listing and item.listing.price:
-                total += Decimal(str(item.quantity)) * Decimal(str(item.listing.price))
-        return total
+        return obj.total_price
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         representation['items'] = CartItemSerializer(instance.items.all(), many=True).data
         return representation
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     email = serializers.EmailField(source='user.email', read_only=True)
+    profile_picture_variants = ImageVariantsField('profile_picture', source='*')
     
     class Meta:
         model = UserProfile
-        fields = ['id', 'username', 'email', 'bio', 'phone_number', 'profile_picture', 'created_at', 'updated_at']
-        read_only_fields = ['created_at', 'updated_at']
+        fields = ['id', 'username', 'email', 'bio', 'phone_number', 'profile_picture',
+                  'profile_picture_width', 'profile_picture_height', 'profile_picture_variants',
+                  'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at', 'profile_picture_width', 'profile_picture_height']
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(ModelSerializer):
     sender = UserSerializer(read_only=True)
     sender_id = serializers.IntegerField(write_only=True)
+    is_read = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = ['id', 'conversation', 'sender', 'sender_id', 'content', 'created_at', 'is_read']
         read_only_fields = ['created_at']
 
-class ConversationSerializer(serializers.ModelSerializer):
+    def get_is_read(self, obj):
+        return obj.is_read_by_others()
+
+class ConversationSerializer(ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
     last_message = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
+    location = serializers.SerializerMethodField()
     
     class Meta:
         model = Conversation
@@ -102,28 +169,50 @@ class ConversationSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
     
     def get_last_message(self, obj):
-        messages = obj.messages.all()
-        if messages:
-            return MessageSerializer(messages.last()).data
-        return None
+        message = obj.last_message
+        if message is None:
+            return None
+        # Read state from the prefetched watermarks instead of a query per conversation
+        message.read_by_others = any(
+            state.user_id != message.sender_id and state.last_read_at and state.last_read_at >= message.created_at
+            for state in obj.participant_states.all()
+        )
+        return MessageSerializer(message).data
     
     def get_unread_count(self, obj):
+        # ConversationViewSet annotates the requesting user's counter
+        if hasattr(obj, 'user_unread_count'):
+            return obj.user_unread_count or 0
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
+            return obj.get_unread_count(request.user)
         return 0
 
-class OrderItemSerializer(serializers.ModelSerializer):
+    def get_location(self, obj):
+        """Pickup location of the listing being discussed, if it has one."""
+        # ConversationViewSet annotates the listing's coordinates
+        if hasattr(obj, 'listing_latitude'):
+            latitude, longitude = obj.listing_latitude, obj.listing_longitude
+        elif obj.listing_id is not None:
+            latitude, longitude = obj.listing.latitude, obj.listing.longitude
+        else:
+            return None
+        if latitude is None or longitude is None:
+            return None
+        return {'latitude': latitude, 'longitude': longitude}
+
+class OrderItemSerializer(ModelSerializer):
     listing_title = serializers.CharField(source='listing.title', read_only=True)
     listing_image = serializers.ImageField(source='listing.image', read_only=True)
+    listing_image_variants = ImageVariantsField('image', source='listing')
     seller_username = serializers.CharField(source='listing.owner.username', read_only=True)
     seller_email = serializers.EmailField(source='listing.owner.email', read_only=True)
 
     class Meta:
         model = OrderItem
-        fields = ['id', 'listing', 'listing_title', 'listing_image', 'quantity', 'price_at_time', 'created_at', 'seller_username', 'seller_email']
+        fields = ['id', 'listing', 'listing_title', 'listing_image', 'listing_image_variants', 'quantity', 'price_at_time', 'created_at', 'seller_username', 'seller_email']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     user_email = serializers.EmailField(source='user.email', read_only=True)
     user_username = serializers.CharField(source='user.username', read_only=True)
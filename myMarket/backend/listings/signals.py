@@ -0,0 +1,172 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .authentication import CLAIMS, forget_user
+from .cache import LISTINGS_TAG, listing_cache, listing_tag
+from .images import needs_variants
+from . import facets, prices, realtime, seller_stats
+from .models import Cart, ImageJob, Listing, Order, UserProfile, conversation_read, message_recorded
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Listing)
+def index_listing(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not {'title', 'description'} & set(update_fields):
+        return
+    backend = get_search_backend()
+    if backend is not None:
+        backend.index(instance)
+
+
+@receiver(post_delete, sender=Listing)
+def unindex_listing(sender, instance, **kwargs):
+    backend = get_search_backend()
+    if backend is not None:
+        backend.remove(instance.pk)
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_listing_cache(sender, instance, **kwargs):
+    listing_cache.invalidate(LISTINGS_TAG, listing_tag(instance.pk))
+
+
+FACET_FIELDS = {'category', 'condition', 'price', 'is_active'}
+
+
+@receiver(pre_save, sender=Listing)
+def remember_previous_values(sender, instance, update_fields=None, **kwargs):
+    instance._previous_facet_key = None
+    instance._previous_price = None
+    if instance.pk is None or (update_fields and not FACET_FIELDS & set(update_fields)):
+        return
+    row = Listing.objects.filter(pk=instance.pk).values_list('category', 'condition', 'price', 'is_active').first()
+    if row is not None:
+        instance._previous_facet_key = facets.facet_key(*row)
+        instance._previous_price = row[2]
+
+
+@receiver(post_save, sender=Listing)
+def update_facet_counts(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields and not FACET_FIELDS & set(update_fields):
+        return
+    previous = getattr(instance, '_previous_facet_key', None)
+    current = facets.listing_key(instance)
+    if previous != current:
+        # adjust() ignores the None key of an inactive listing
+        facets.adjust({previous: -1, current: 1})
+
+
+@receiver(post_delete, sender=Listing)
+def remove_facet_counts(sender, instance, **kwargs):
+    facets.adjust({facets.listing_key(instance): -1})
+
+
+@receiver(post_save, sender=Listing)
+def record_price_change(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields and 'price' not in update_fields):
+        return
+    previous = getattr(instance, '_previous_price', None)
+    if created:
+        prices.record_change(instance, None)
+    elif previous is not None and previous != Decimal(str(instance.price)):
+        prices.record_change(instance, previous)
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_save, sender=UserProfile)
+def queue_image_variants(sender, instance, update_fields=None, **kwargs):
+    field = 'image' if sender is Listing else 'profile_picture'
+    if update_fields and field not in update_fields:
+        return
+    if needs_variants(instance, field):
+        ImageJob.queue(instance, field)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_owner_listing_cache(sender, instance, update_fields=None, **kwargs):
+    # Listing responses embed the owner's username and email; logins only touch last_login
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    listing_ids = Listing.objects.filter(owner_id=instance.pk).values_list('id', flat=True)
+    listing_cache.invalidate(LISTINGS_TAG, *[listing_tag(listing_id) for listing_id in listing_ids])
+
+
+@receiver(post_save, sender=User)
+def create_cart_and_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Cart.objects.create(user=instance)
+        UserProfile.objects.create(user=instance)
+
+
+@receiver(post_delete, sender=Cart)
+def forget_cart_id(sender, instance, **kwargs):
+    key = Cart.cache_key(instance.user_id)
+    # Now and after commit: a request may cache the id again before the delete is visible
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver(message_recorded)
+def publish_message(sender, message, participant_ids, **kwargs):
+    realtime.publish_to_users(participant_ids, realtime.message_event(message))
+
+
+@receiver(conversation_read)
+def publish_read_receipt(sender, conversation, user, participant_ids, **kwargs):
+    realtime.publish_to_users(participant_ids, realtime.read_event(conversation.pk, user.pk))
+
+
+@receiver(pre_save, sender=User)
+def remember_user_claims(sender, instance, update_fields=None, **kwargs):
+    instance._previous_claims = None
+    if instance.pk is None or (update_fields and not set(CLAIMS) & set(update_fields)):
+        return
+    instance._previous_claims = User.objects.filter(pk=instance.pk).values_list(*CLAIMS).first()
+
+
+@receiver(post_save, sender=User)
+def forget_cached_user(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    previous = getattr(instance, '_previous_claims', None)
+    claims_changed = previous is not None and previous != tuple(getattr(instance, claim) for claim in CLAIMS)
+    transaction.on_commit(lambda: forget_user(instance, claims_changed=claims_changed))
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user(sender, instance, **kwargs):
+    transaction.on_commit(lambda: forget_user(instance, deleted=True))
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or (update_fields and 'status' not in update_fields):
+        instance._previous_status = None
+        return
+    instance._previous_status = Order.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Order)
+def move_order_stats(sender, instance, created, **kwargs):
+    # New orders are recorded by complete_checkout once their items exist
+    previous = getattr(instance, '_previous_status', None)
+    if not created and previous and previous != instance.status:
+        seller_stats.move_order(instance, previous, instance.status)
+
+
+@receiver(pre_delete, sender=Order)
+def remove_order_stats(sender, instance, **kwargs):
+    seller_stats.remove_order(instance)
+
+
+@receiver(pre_delete, sender=Listing)
+def remove_listing_order_stats(sender, instance, origin=None, **kwargs):
+    # Deleting a user also deletes their orders, which remove_order_stats handles
+    seller_stats.remove_listing(instance, skip_buyer=origin if isinstance(origin, User) else None)
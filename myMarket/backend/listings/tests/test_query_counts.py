@@ -0,0 +1,77 @@
+"""
+Query budgets of the list endpoints: serializing a page costs the same number
+of queries however many rows it holds (see QUERY_PLANS in views.py).
+"""
+from contextlib import contextmanager
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APITestCase
+
+from listings.models import Cart, CartItem, Conversation, Listing, Message
+from listings.pagination import KeysetPagination
+
+PAGE_SIZES = [5, 25]
+
+
+@contextmanager
+def page_size(size):
+    with mock.patch.object(PageNumberPagination, 'page_size', size), \
+            mock.patch.object(KeysetPagination, 'page_size', size):
+        yield
+
+
+class QueryBudgetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        cls.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        cls.listings = [
+            Listing.objects.create(
+                title=f'Desk lamp {i}', description='Brass desk lamp', price=10 + i,
+                category='Home', condition='Good', owner=cls.seller,
+            )
+            for i in range(30)
+        ]
+        for i in range(30):
+            conversation = Conversation.objects.create(listing=cls.listings[i])
+            conversation.participants.add(cls.buyer, cls.seller)
+            for sender in (cls.buyer, cls.seller):
+                message = Message.objects.create(conversation=conversation, sender=sender, content='Still available?')
+                conversation.record_message(message)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.buyer)
+
+    def assertPageQueries(self, path, params, budget):
+        for size in PAGE_SIZES:
+            with self.subTest(path=path, params=params, page_size=size), page_size(size):
+                with self.assertNumQueries(budget):
+                    response = self.client.get(path, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), size)
+
+    def test_listing_list(self):
+        self.assertPageQueries('/api/listings/', {}, 2)
+        self.assertPageQueries('/api/listings/', {'category': 'Home'}, 2)
+        self.assertPageQueries('/api/listings/', {'filter': 'price_low'}, 2)
+        self.assertPageQueries('/api/listings/', {'search': 'lamp'}, 3)
+        self.assertPageQueries('/api/listings/', {'pagination': 'cursor'}, 1)
+
+    def test_conversation_list(self):
+        self.assertPageQueries('/api/conversations/', {}, 4)
+
+    def test_cart(self):
+        cart_id = Cart.id_for_user(self.buyer.pk)
+        added = 0
+        for items in (2, 20):
+            CartItem.objects.bulk_create([
+                CartItem(cart_id=cart_id, listing=listing) for listing in self.listings[added:items]
+            ])
+            added = items
+            with self.subTest(items=items), self.assertNumQueries(2):
+                response = self.client.get('/api/carts/')
+            self.assertEqual(len(response.data['items']), items)
@@ -0,0 +1,62 @@
+"""
+Index use of the hot list queries, the paths check_query_plans walks: each
+must keep using the index declared for it in Listing.Meta.indexes.
+"""
+import re
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from listings.index_advisor import HOT_VIEWSETS, access_paths, explain
+from listings.management.commands.check_query_plans import SORT
+from listings.models import Listing
+from listings.views import ListingViewSet
+
+CREATED_AT_INDEX = next(index.name for index in Listing._meta.indexes if index.fields == ['-created_at'])
+
+# Keyed by the access path's query string
+EXPECTED_INDEXES = {
+    '': CREATED_AT_INDEX,
+    'is_active=true': CREATED_AT_INDEX,
+    'ordering=-created_at': CREATED_AT_INDEX,
+    'filter=my_listings': 'list_owner_create',
+    'owner=<user>': 'list_owner_create',
+    f"category={Listing.CATEGORY_CHOICES[0][0]}": 'list_catego_create_act',
+    f"condition={Listing.CONDITION_CHOICES[0][0]}": 'list_condit_create_act',
+    'filter=popular': 'list_viewco_act',
+    'ordering=-view_count': 'list_viewco_act',
+    'filter=price_high': 'list_price_act',
+    'filter=price_low': 'list_price_act',
+    'ordering=-price': 'list_price_act',
+    'near=40.7128,-74.0060&radius=10': 'list_geohas',
+}
+
+# The geohash ranges come back unordered and are sorted by distance afterwards
+SORTED_AFTER_SCAN = {'near=40.7128,-74.0060&radius=10'}
+
+
+def query_string(path):
+    return '&'.join(f'{name}={value}' for name, value in path.params.items())
+
+
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+
+    def test_no_sequential_scans(self):
+        for viewset in HOT_VIEWSETS:
+            for path in access_paths(viewset):
+                with self.subTest(path=str(path)):
+                    plan, scans = explain(path, self.user)
+                    self.assertEqual(scans, [], plan)
+
+    def test_listing_paths_use_their_index(self):
+        paths = {query_string(path): path for path in access_paths(ListingViewSet)}
+        self.assertEqual(set(paths), set(EXPECTED_INDEXES))
+        for query, index in EXPECTED_INDEXES.items():
+            with self.subTest(path=str(paths[query]), index=index):
+                plan, _ = explain(paths[query], self.user)
+                self.assertRegex(plan, rf'\b{re.escape(index)}\b')
+                if query not in SORTED_AFTER_SCAN:
+                    self.assertIsNone(SORT.search(plan), plan)
@@ -3,6 +3,7 @@ from rest_framework.routers import DefaultRouter
 from . import views
 from .views import user_profile
 from listings.views import user_profile  # Corrected import path
+from .realtime import conversation_events
 
 
 router = DefaultRouter()
@@ -11,6 +12,7 @@ router.register(r'carts', views.CartViewSet, basename='cart')
 router.register(r'profiles', views.UserProfileViewSet, basename='profile')
 router.register(r'conversations', views.ConversationViewSet, basename='conversation')
 router.register(r'messages', views.MessageViewSet, basename='message')
+router.register(r'orders', views.OrderViewSet, basename='order')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -22,4 +24,5 @@ urlpatterns = [
     path('user-profile/', views.user_profile, name='user-profile'),
     path('create-checkout-session/', views.create_checkout_session, name='create-checkout-session'),
     path('webhook/stripe/', views.stripe_webhook, name='stripe-webhook'),
+    path('events/', conversation_events, name='conversation-events'),
 ]
\ No newline at end of file
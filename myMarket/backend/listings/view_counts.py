@@ -0,0 +1,108 @@
+"""
+Write-behind buffer for Listing.view_count.
+
+Views are counted in a per-process map and written out with a single
+``UPDATE ... SET view_count = view_count + CASE ...`` statement once the buffer
+is old or large enough, and once more when the process exits. The update is
+relative, so any number of gunicorn workers can flush without losing hits.
+
+Views by signed-in users are also kept as (user, listing) pairs and written
+to ListingView in the same flush, one row per pair per flush, for
+build_recommendations.
+
+A flush is one transaction. If it fails, nothing was written, so the hits
+and viewers go back into the buffer for the next flush; the error is logged
+rather than raised into the request that happened to trigger it.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 500
+
+
+class ViewCountBuffer:
+    def __init__(self, flush_interval, flush_threshold):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._counts = Counter()
+        self._viewers = set()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def record(self, listing_id, hits=1, user_id=None):
+        with self._lock:
+            self._counts[listing_id] += hits
+            if user_id is not None:
+                self._viewers.add((user_id, listing_id))
+            due = (
+                len(self._counts) >= self.flush_threshold
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def flush(self):
+        """Write buffered hits to the database and return how many listings were updated (0 on failure)."""
+        from .models import Listing, ListingView
+
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            viewers, self._viewers = self._viewers, set()
+            self._last_flush = time.monotonic()
+
+        items = list(counts.items())
+        try:
+            with transaction.atomic():
+                for start in range(0, len(items), FLUSH_BATCH_SIZE):
+                    batch = items[start:start + FLUSH_BATCH_SIZE]
+                    increment = Case(
+                        *[When(pk=pk, then=Value(hits)) for pk, hits in batch],
+                        default=Value(0),
+                        output_field=models.PositiveIntegerField(),
+                    )
+                    Listing.objects.filter(pk__in=[pk for pk, _ in batch]).update(
+                        view_count=F('view_count') + increment
+                    )
+                if viewers:
+                    # Users or listings deleted since the view would fail the foreign keys
+                    users = set(User.objects.filter(
+                        pk__in={user_id for user_id, _ in viewers}
+                    ).values_list('pk', flat=True))
+                    listings = set(Listing.objects.filter(
+                        pk__in={listing_id for _, listing_id in viewers}
+                    ).values_list('pk', flat=True))
+                    ListingView.objects.bulk_create([
+                        ListingView(user_id=user_id, listing_id=listing_id)
+                        for user_id, listing_id in viewers if user_id in users and listing_id in listings
+                    ], batch_size=FLUSH_BATCH_SIZE)
+        except Exception:
+            # Rolled back as a whole, so the next flush retries every hit exactly once
+            logger.exception("View count flush failed; keeping %d listings for the next one", len(items))
+            with self._lock:
+                self._counts.update(counts)
+                self._viewers.update(viewers)
+            return 0
+        return len(items)
+
+
+view_counts = ViewCountBuffer(
+    flush_interval=settings.VIEW_COUNT_FLUSH_INTERVAL,
+    flush_threshold=settings.VIEW_COUNT_FLUSH_THRESHOLD,
+)
+
+
+atexit.register(view_counts.flush)
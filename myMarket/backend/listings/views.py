@@ -4,30 +4,52 @@ from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Listing, Cart, CartItem, UserProfile, Conversation, Message, Order, OrderItem
+from .models import (
+    Listing, Cart, CartItem, UserProfile, Conversation, ConversationParticipant,
+    Message, Order, OrderItem, OutboundEmail, ListingView
+)
+from .cache import LISTINGS_TAG, listing_cache, listing_tag
+from . import facets, prices, seller_stats
+from .authentication import authenticate
+from .checkout import record_session
+from .webhooks import record_events
+from .payments import PaymentError, PaymentUnavailable, get_payment_provider
+from .pagination import SelectablePagination
+from .geo import ListingNearFilter
+from .search import ListingSearchFilter
+from .view_counts import view_counts
 from .serializers import (
-    ListingSerializer, UserSerializer, CartSerializer, CartItemSerializer,
+    ListingSerializer, UserSerializer, CartSerializer, CartItemDeltaSerializer,
     UserProfileSerializer, ConversationSerializer, MessageSerializer, OrderSerializer
 )
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Count
-from rest_framework.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Prefetch, Q, Subquery, Sum
+from rest_framework.exceptions import NotFound, ValidationError
+from django.utils.dateparse import parse_date
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
-from django.core.mail import send_mail
 from django.shortcuts import redirect
+import logging
 import stripe
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_POST
+from django.core.files.storage import default_storage
+from asgiref.sync import sync_to_async
+import json
+from urllib.parse import urljoin
 from rest_framework.routers import DefaultRouter
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+logger = logging.getLogger(__name__)
+
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
@@ -55,9 +77,7 @@ def register_user(request):
                 is_active=False  # User is active immediately
             )
             
-            # Create user profile
-            UserProfile.objects.create(user=user)
-            
+            # The cart and profile are created with the user (see signals.py)
             send_verification_email(user, request)
             
             return Response({
@@ -80,19 +100,17 @@ def request_password_reset(request):
         from django.contrib.auth.tokens import default_token_generator
         from django.utils.http import urlsafe_base64_encode
         from django.utils.encoding import force_bytes
-        from django.core.mail import send_mail
         from django.conf import settings
         
         token = default_token_generator.make_token(user)
         uid = urlsafe_base64_encode(force_bytes(user.pk))
         
         reset_url = f"{settings.FRONTEND_URL}/reset-password/{uid}/{token}/"
-        send_mail(
+        OutboundEmail.queue(
             'Password Reset',
             f'Please click the following link to reset your password: {reset_url}',
             settings.DEFAULT_FROM_EMAIL,
             [user.email],
-            fail_silently=False,
         )
         
         return Response({'message': 'Password reset email sent'}, status=status.HTTP_200_OK)
@@ -123,7 +141,75 @@ def reset_password(request, uidb64, token):
     except (TypeError, ValueError, OverflowError, User.DoesNotExist):
         return Response({'error': 'Invalid reset link'}, status=status.HTTP_400_BAD_REQUEST)
 
-class BaseModelViewSet(viewsets.ModelViewSet):
+class QueryPlan:
+    """The select_related/prefetch_related/only() needs of a serializer."""
+
+    def __init__(self, select_related=(), prefetch_related=(), only=()):
+        self.select_related = tuple(select_related)
+        self.prefetch_related = tuple(prefetch_related)
+        self.only = tuple(only)
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if self.only:
+            queryset = queryset.only(*self.only)
+        return queryset
+
+
+# Fields read by ListingSerializer, including the nested owner. view_count is
+# left out on purpose so serialized pages don't pull it.
+LISTING_ONLY = (
+    'id', 'title', 'description', 'price', 'category', 'condition',
+    'image', 'image_width', 'image_height', 'image_variants',
+    'owner', 'created_at', 'updated_at', 'is_active', 'latitude', 'longitude',
+    'owner__id', 'owner__username', 'owner__email',
+)
+
+def _nested_listing_only(prefix):
+    return tuple(f'{prefix}__{field}' for field in LISTING_ONLY)
+
+# Serializing a page of any of these costs a fixed number of queries, no matter
+# how many rows are on the page.
+QUERY_PLANS = {
+    ListingSerializer: QueryPlan(
+        select_related=['owner'],
+        only=LISTING_ONLY,
+    ),
+    CartSerializer: QueryPlan(
+        prefetch_related=[
+            Prefetch('items', queryset=CartItem.objects.with_totals().select_related('listing__owner').only(
+                'id', 'cart', 'listing', 'quantity', 'created_at',
+                *_nested_listing_only('listing'),
+            )),
+        ],
+    ),
+    UserProfileSerializer: QueryPlan(select_related=['user']),
+    ConversationSerializer: QueryPlan(
+        select_related=['last_message__sender'],
+        prefetch_related=['participants', 'participant_states'],
+    ),
+    MessageSerializer: QueryPlan(select_related=['sender']),
+    OrderSerializer: QueryPlan(
+        select_related=['user'],
+        prefetch_related=[
+            Prefetch('items', queryset=OrderItem.objects.select_related('listing__owner')),
+        ],
+    ),
+}
+
+class QueryPlanMixin:
+    """Shapes querysets with the QueryPlan of the viewset's serializer."""
+
+    def with_query_plan(self, queryset):
+        plan = QUERY_PLANS.get(self.get_serializer_class())
+        if plan is None:
+            return queryset
+        return plan.apply(queryset)
+
+class BaseModelViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
@@ -138,22 +224,37 @@ class UserProfileViewSet(BaseModelViewSet):
     serializer_class = UserProfileSerializer
 
     def get_queryset(self):
-        return UserProfile.objects.filter(user=self.request.user)
+        return self.with_query_plan(UserProfile.objects.filter(user=self.request.user))
 
     def get_or_create_object(self):
         try:
-            return UserProfile.objects.get_or_create(user=self.request.user)[0]
+            return self.get_queryset().get_or_create(user=self.request.user)[0]
         except Exception as e:
             raise ValidationError(detail=str(e))
 
-class ListingViewSet(viewsets.ModelViewSet):
+class ListingViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Listing.objects.all()
     serializer_class = ListingSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = SelectablePagination
+    # Search runs after the other filters, so it only ranks the listings they leave
+    filter_backends = [DjangoFilterBackend, ListingNearFilter, ListingSearchFilter, filters.OrderingFilter]
     filterset_fields = ['category', 'condition', 'is_active', 'owner']
     search_fields = ['title', 'description']
     ordering_fields = ['price', 'created_at', 'view_count']
+    # Query parameters that change list output; the response cache ignores the rest
+    cache_params = [
+        'filter', 'category', 'condition', 'is_active', 'owner', 'search', 'near', 'radius', 'ordering',
+        'page', 'pagination', 'cursor',
+    ]
+    # ?filter= shortcuts that pick the ordering. 'popular' sorts on flushed
+    # counts; buffered views land within VIEW_COUNT_FLUSH_INTERVAL seconds
+    filter_orderings = {
+        'popular': '-view_count',
+        'recent': '-created_at',
+        'price_low': 'price',
+        'price_high': '-price'
+    }
 
     def get_queryset(self):
         try:
@@ -165,23 +266,151 @@ class ListingViewSet(viewsets.ModelViewSet):
             else:
                 queryset = queryset.filter(is_active=True)
 
-            ordering = {
-                'popular': '-view_count',
-                'recent': '-created_at',
-                'price_low': 'price',
-                'price_high': '-price'
-            }.get(filter_by, '-created_at')
+            ordering = self.filter_orderings.get(filter_by, '-created_at')
 
-            return queryset.order_by(ordering)
+            return self.with_query_plan(queryset.order_by(ordering))
         except Exception as e:
             raise ValidationError(detail=str(e))
 
+    def list(self, request, *args, **kwargs):
+        def build():
+            return super(ListingViewSet, self).list(request, *args, **kwargs)
+
+        if request.query_params.get('filter') == 'my_listings':
+            return build()
+        return listing_cache.respond(request, 'list', self.cache_params, [LISTINGS_TAG], build)
+
+    def retrieve(self, request, *args, **kwargs):
+        def build():
+            return Response(self.get_serializer(self.get_object()).data)
+
+        if request.query_params.get('filter') == 'my_listings':
+            response = build()
+        else:
+            pk = kwargs['pk']
+            response = listing_cache.respond(request, f'retrieve:{pk}', [], [listing_tag(pk)], build)
+        if response.status_code == 200:
+            # Same as Listing.increment_view_count(), without loading the row on cache hits
+            view_counts.record(response.data['id'], user_id=request.user.pk)
+        return response
+
     def perform_create(self, serializer):
         try:
             serializer.save(owner=self.request.user, is_active=True)
         except Exception as e:
             raise ValidationError(detail=str(e))
 
+    @action(detail=False)
+    def facets(self, request):
+        """Counts by category, condition and price bucket for the listings the same filters would list."""
+        def build():
+            params = request.query_params
+            if params.get('filter') != 'my_listings' and not any(
+                params.get(name) for name in [*self.filterset_fields, 'search', 'near']
+            ):
+                return Response(facets.summarize(facets.stored_counts()))
+            return Response(facets.summarize(facets.grouped_counts(self.filter_queryset(self.get_queryset()))))
+
+        if request.query_params.get('filter') == 'my_listings':
+            return build()
+        return listing_cache.respond(request, 'facets', self.cache_params, [LISTINGS_TAG], build)
+
+    @action(detail=True)
+    def similar(self, request, pk=None):
+        """Listings most often viewed, carted or bought together with this one (see recommendations.py)."""
+        try:
+            listing_id = int(pk)
+        except ValueError:
+            raise NotFound()
+
+        def build():
+            queryset = Listing.objects.filter(
+                neighbor_of__listing_id=listing_id, is_active=True
+            ).order_by('-neighbor_of__score')
+            listings = self.with_query_plan(queryset)[:settings.RECOMMENDATION_NEIGHBORS]
+            return Response(self.get_serializer(listings, many=True).data)
+
+        return listing_cache.respond(request, f'similar:{listing_id}', [], [LISTINGS_TAG], build)
+
+    @action(detail=False, permission_classes=[permissions.IsAuthenticated])
+    def recommended(self, request):
+        """
+        Neighbours of what the user bought, has in their cart or viewed lately,
+        best summed score first, leaving out what they bought or have in their
+        cart; the most viewed listings when there are none.
+        """
+        user = request.user
+        ordered = OrderItem.objects.filter(order__user=user).exclude(order__status='cancelled').values('listing_id')
+        in_cart = CartItem.objects.filter(cart__user=user).values('listing_id')
+        viewed = ListingView.objects.filter(
+            user=user, viewed_at__gte=timezone.now() - timedelta(days=settings.RECOMMENDATION_VIEW_DAYS)
+        ).values('listing_id')
+        candidates = Listing.objects.filter(is_active=True).exclude(owner=user)
+        queryset = candidates.filter(
+            Q(neighbor_of__listing__in=ordered) | Q(neighbor_of__listing__in=in_cart)
+            | Q(neighbor_of__listing__in=viewed)
+        ).exclude(id__in=ordered).exclude(id__in=in_cart).annotate(
+            recommendation_score=Sum('neighbor_of__score')
+        ).order_by('-recommendation_score', '-id')
+        listings = list(self.with_query_plan(queryset)[:settings.RECOMMENDATION_NEIGHBORS])
+        if not listings:
+            listings = self.with_query_plan(candidates.order_by('-view_count'))[:settings.RECOMMENDATION_NEIGHBORS]
+        return Response(self.get_serializer(listings, many=True).data)
+
+    @action(detail=False)
+    def price_drops(self, request):
+        """
+        Listings now cheaper than at any point in the last ?days= (PRICE_DROP_DAYS
+        by default), most recently changed first; takes the list filters too.
+        """
+        days = request.query_params.get('days') or settings.PRICE_DROP_DAYS
+        try:
+            days = int(days)
+        except ValueError:
+            days = 0
+        if not 0 < days <= settings.PRICE_HISTORY_RAW_DAYS:
+            raise ValidationError({'days': f'Must be a whole number from 1 to {settings.PRICE_HISTORY_RAW_DAYS}'})
+
+        def build():
+            queryset = prices.price_drops(
+                self.filter_queryset(self.get_queryset()), timezone.now() - timedelta(days=days)
+            ).order_by('-price_changed_at', '-id')
+            page = self.paginate_queryset(queryset)
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+        if request.query_params.get('filter') == 'my_listings':
+            return build()
+        return listing_cache.respond(request, 'price_drops', [*self.cache_params, 'days'], [LISTINGS_TAG], build)
+
+    @action(detail=False)
+    def category_prices(self, request):
+        """Median, low and high price per category and day from the CategoryPriceDaily rollups: ?category=&start=&end="""
+        category = request.query_params.get('category')
+        if category and category not in dict(Listing.CATEGORY_CHOICES):
+            raise ValidationError({'category': 'Unknown category'})
+        end = date_param(request, 'end') or timezone.localdate()
+        start = date_param(request, 'start') or end - timedelta(days=90)
+        series = prices.category_series(start, end, category)
+        return Response({
+            'start': start,
+            'end': end,
+            'categories': [{'category': name, 'series': rows} for name, rows in sorted(series.items())],
+        })
+
+    @action(detail=True)
+    def price_history(self, request, pk=None):
+        """The listing's daily open/close/low/high on days its price changed: ?start=&end="""
+        listing = self.get_object()
+        end = date_param(request, 'end') or timezone.localdate()
+        start = date_param(request, 'start') or end - timedelta(days=365)
+        return Response({
+            'listing': listing.pk,
+            'price': listing.price,
+            'start': start,
+            'end': end,
+            'days': prices.listing_series(listing.pk, start, end),
+        })
+
     @action(detail=True, methods=['post'])
     def contact(self, request, pk=None):
         try:
@@ -199,111 +428,140 @@ class ListingViewSet(viewsets.ModelViewSet):
             if not conversation.participants.filter(id=request.user.id).exists():
                 conversation.participants.add(request.user, listing.owner)
                 
-            message = Message.objects.create(
-                conversation=conversation,
-                sender=request.user,
-                content=content
-            )
+            with transaction.atomic():
+                message = Message.objects.create(
+                    conversation=conversation,
+                    sender=request.user,
+                    content=content
+                )
+                conversation.record_message(message)
             
             return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+def date_param(request, name):
+    """The ``name`` query parameter as a date, None when absent, or ValidationError."""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({name: 'Must be a date, YYYY-MM-DD'})
+    return day
+
+def parse_quantity(value):
+    """``value`` as a positive integer, or None."""
+    try:
+        quantity = int(str(value))
+    except ValueError:
+        return None
+    return quantity if quantity > 0 else None
+
 class CartViewSet(BaseModelViewSet):
     serializer_class = CartSerializer
     
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        return self.with_query_plan(Cart.objects.with_totals().filter(user=self.request.user))
     
     def get_or_create_object(self):
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
-        return cart
+        return self.get_queryset().get(pk=Cart.id_for_user(self.request.user.id))
     
     def list(self, request, *args, **kwargs):
-        print(f"List cart request from user: {request.user.id}")
         cart = self.get_or_create_object()
         serializer = self.get_serializer(cart)
         return Response(serializer.data)
     
     def create(self, request, *args, **kwargs):
-        print(f"Create cart request from user: {request.user.id}")
         cart = self.get_or_create_object()
         serializer = self.get_serializer(cart)
         return Response(serializer.data, status=status.HTTP_200_OK)
-    
+
+    # The item actions always act on the requesting user's cart and answer
+    # with just the changed line (CartItemDeltaSerializer), not the whole cart
+
+    def line(self, cart_id, listing_id):
+        item = CartItem.objects.with_totals().filter(
+            cart_id=cart_id, listing_id=listing_id
+        ).values('quantity', 'line_total').first()
+        return CartItemDeltaSerializer({
+            'cart_id': cart_id,
+            'listing_id': listing_id,
+            'quantity': item['quantity'] if item else 0,
+            'total_price': item['line_total'] if item else 0,
+        }).data
+
     @action(detail=True, methods=['post'])
     def add_item(self, request, pk=None):
         try:
-            print(f"Add item request from user: {request.user.id}")
-            print(f"Request data: {request.data}")
-            
-            cart = self.get_object()
             listing_id = request.data.get('listing_id')
-            quantity = request.data.get('quantity', 1)
+            quantity = parse_quantity(request.data.get('quantity', 1))
             
             if not listing_id:
-                print("No listing_id provided")
                 return Response({'error': 'Listing ID is required'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            try:
-                listing = Listing.objects.get(id=listing_id, is_active=True)
-                print(f"Found listing: {listing.id} - {listing.title}")
-            except Listing.DoesNotExist:
-                print(f"Listing not found or not active: {listing_id}")
+            if quantity is None:
+                return Response({'error': 'Quantity must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+            cart_id = Cart.id_for_user(request.user.id)
+            lines = CartItem.objects.filter(cart_id=cart_id, listing_id=listing_id)
+            increment = {'quantity': F('quantity') + quantity, 'updated_at': timezone.now()}
+            if lines.filter(listing__is_active=True).update(**increment):
+                return Response(self.line(cart_id, listing_id))
+
+            price = Listing.objects.filter(id=listing_id, is_active=True).values_list('price', flat=True).first()
+            if price is None:
+                logger.info("add_item: listing %s not found or not active", listing_id)
                 return Response({'error': 'Listing not found or not active'}, status=status.HTTP_404_NOT_FOUND)
-            
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                listing=listing,
-                defaults={'quantity': quantity}
-            )
-            
-            if not created:
-                print(f"Updating existing cart item quantity: {cart_item.quantity} -> {cart_item.quantity + quantity}")
-                cart_item.quantity += quantity
-                cart_item.save()
-            else:
-                print(f"Created new cart item with quantity: {quantity}")
-            
-            cart.refresh_from_db()
-            serializer = self.get_serializer(cart)
-            print(f"Cart after update: {serializer.data}")
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            try:
+                with transaction.atomic():
+                    CartItem.objects.create(cart_id=cart_id, listing_id=listing_id, quantity=quantity)
+            except IntegrityError:
+                # A concurrent request added the line first
+                lines.update(**increment)
+                return Response(self.line(cart_id, listing_id))
+            return Response(CartItemDeltaSerializer({
+                'cart_id': cart_id, 'listing_id': int(listing_id), 'quantity': quantity, 'total_price': price * quantity,
+            }).data)
         except Exception as e:
-            print(f"Error in add_item: {str(e)}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            print(traceback.format_exc())
+            logger.exception("add_item failed for user %s", request.user.id)
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['post'])
     def remove_item(self, request, pk=None):
-        cart = self.get_object()
         listing_id = request.data.get('listing_id')
         
         if not listing_id:
             return Response({'error': 'Listing ID is required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        CartItem.objects.filter(cart=cart, listing_id=listing_id).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        cart_id = Cart.id_for_user(request.user.id)
+        CartItem.objects.filter(cart_id=cart_id, listing_id=listing_id).delete()
+        return Response(CartItemDeltaSerializer({
+            'cart_id': cart_id, 'listing_id': listing_id, 'quantity': 0, 'total_price': 0,
+        }).data)
     
     @action(detail=True, methods=['post'])
     def update_quantity(self, request, pk=None):
-        cart = self.get_object()
         listing_id = request.data.get('listing_id')
-        quantity = request.data.get('quantity')
+        quantity = parse_quantity(request.data.get('quantity'))
         
         if not listing_id or quantity is None:
-            return Response({'error': 'Listing ID and quantity are required'}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'error': 'Listing ID and a positive integer quantity are required'},
+                            status=status.HTTP_400_BAD_REQUEST)
         
-        cart_item = get_object_or_404(CartItem, cart=cart, listing_id=listing_id)
-        cart_item.quantity = quantity
-        cart_item.save()
-        return Response(CartItemSerializer(cart_item).data)
+        cart_id = Cart.id_for_user(request.user.id)
+        updated = CartItem.objects.filter(cart_id=cart_id, listing_id=listing_id).update(
+            quantity=quantity, updated_at=timezone.now()
+        )
+        if not updated:
+            return Response({'error': 'Item not in cart'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.line(cart_id, listing_id))
     
     @action(detail=True, methods=['post'])
     def clear(self, request, pk=None):
-        self.get_object().items.all().delete()
+        CartItem.objects.filter(cart_id=Cart.id_for_user(request.user.id)).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 @api_view(['GET', 'PUT'])
@@ -324,7 +582,17 @@ class ConversationViewSet(BaseModelViewSet):
     serializer_class = ConversationSerializer
 
     def get_queryset(self):
-        return Conversation.objects.filter(participants=self.request.user)
+        unread_count = ConversationParticipant.objects.filter(
+            conversation=OuterRef('pk'), user=self.request.user
+        ).values('unread_count')[:1]
+        conversations = Conversation.objects.filter(
+            participants=self.request.user
+        ).annotate(
+            user_unread_count=Subquery(unread_count),
+            listing_latitude=F('listing__latitude'),
+            listing_longitude=F('listing__longitude'),
+        )
+        return self.with_query_plan(conversations)
 
     def perform_create(self, serializer):
         conversation = serializer.save()
@@ -342,11 +610,13 @@ class ConversationViewSet(BaseModelViewSet):
             return Response({'error': 'You are not a participant in this conversation'}, 
                           status=status.HTTP_403_FORBIDDEN)
             
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=request.user,
-            content=content
-        )
+        with transaction.atomic():
+            message = Message.objects.create(
+                conversation=conversation,
+                sender=request.user,
+                content=content
+            )
+            conversation.record_message(message)
         
         return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
 
@@ -358,25 +628,30 @@ class ConversationViewSet(BaseModelViewSet):
             return Response({'error': 'You are not a participant in this conversation'}, 
                           status=status.HTTP_403_FORBIDDEN)
             
-        Message.objects.filter(
-            conversation=conversation,
-            sender__in=conversation.participants.exclude(id=request.user.id)
-        ).update(is_read=True)
+        conversation.mark_read(request.user)
         
         return Response(status=status.HTTP_200_OK)
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SelectablePagination
 
     def get_queryset(self):
-        return Message.objects.filter(conversation__participants=self.request.user)
+        return self.with_query_plan(
+            Message.objects.with_read_state().filter(conversation__participants=self.request.user)
+        )
 
     def perform_create(self, serializer):
         conversation = get_object_or_404(Conversation, id=self.request.data.get('conversation'))
         if self.request.user not in conversation.participants.all():
             raise permissions.PermissionDenied("You are not a participant in this conversation")
-        serializer.save(sender=self.request.user)
+        with transaction.atomic():
+            message = serializer.save(sender=self.request.user)
+            conversation.record_message(message)
+
+    def perform_destroy(self, instance):
+        instance.conversation.remove_message(instance)
 
 @api_view(['GET'])
 def api_root(request, format=None):
@@ -399,7 +674,7 @@ def send_verification_email(user, request):
     )
     subject = 'Verify your email address'
     message = f'Hi {user.username},\n\nPlease verify your email by clicking the link below:\n{verify_url}\n\nThank you!'
-    send_mail(subject, message, 'noreply@yourdomain.com', [user.email])
+    OutboundEmail.queue(subject, message, 'noreply@yourdomain.com', [user.email])
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
@@ -417,147 +692,120 @@ def verify_email(request, uidb64, token):
     else:
         return render(request, 'email_verification_failed.html')
 
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
-def create_checkout_session(request):
+@csrf_exempt
+@require_POST
+async def create_checkout_session(request):
+    """
+    Create a payment session for the user's cart and return its id.
+
+    An async view: the cart's line items come from one query and the provider
+    call (listings/payments.py) is awaited rather than holding a worker. The
+    lines are then recorded under the session id, and the order is built from
+    that record once the payment completes (see checkout.py).
+    """
+    user = await sync_to_async(authenticate)(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                            status=status.HTTP_401_UNAUTHORIZED)
     try:
-        print("Creating checkout session...")
-        print("Request data:", request.data)
-        print("User:", request.user)
-        
-        cart_id = request.data.get('cart_id')
-        if not cart_id:
-            print("No cart_id provided in request")
-            return Response({'error': 'Cart ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+        cart_id = int(json.loads(request.body or b'{}').get('cart_id') or 0)
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Invalid request body'}, status=status.HTTP_400_BAD_REQUEST)
+    if not cart_id:
+        return JsonResponse({'error': 'Cart ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    items = [
+        item async for item in CartItem.objects.filter(cart_id=cart_id, cart__user_id=user.id)
+        .values_list('listing_id', 'listing__title', 'listing__price', 'listing__image', 'quantity').order_by('pk')
+    ]
+    if not items:
+        if not await Cart.objects.filter(id=cart_id, user_id=user.id).aexists():
+            logger.info("Checkout: cart %s not found for user %s", cart_id, user.id)
+            return JsonResponse({'error': 'Cart not found'}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+    logger.info(
+        "Checkout for cart %s: %d items, total %s", cart_id, len(items),
+        sum(price * quantity for _, _, price, _, quantity in items)
+    )
 
-        print(f"Getting cart with ID: {cart_id}")
-        try:
-            cart = Cart.objects.get(id=cart_id, user=request.user)
-            print(f"Found cart: {cart.id} with {cart.items.count()} items")
-        except Cart.DoesNotExist:
-            print(f"Cart not found with ID: {cart_id} for user: {request.user.id}")
-            return Response({'error': 'Cart not found'}, status=status.HTTP_404_NOT_FOUND)
-        
-        if not cart.items.exists():
-            print("Cart is empty")
-            return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        line_items = []
-        for item in cart.items.all():
-            print(f"Processing item: {item.listing.title}")
-            image_url = None
-            if item.listing.image:
-                try:
-                    image_url = request.build_absolute_uri(item.listing.image.url)
-                    print(f"Image URL: {image_url}")
-                except Exception as e:
-                    print(f"Error getting image URL: {str(e)}")
-                    pass
-
-            price = int(float(item.listing.price) * 100)  
-            print(f"Item price in cents: {price}")
-            
-            line_items.append({
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data': {
-                        'name': item.listing.title,
-                        'images': [image_url] if image_url else [],
-                    },
-                    'unit_amount': price,
-                },
-                'quantity': item.quantity,
-            })
-
-        print("Creating Stripe checkout session with line items:", line_items)
-        try:
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=line_items,
-                mode='payment',
-                success_url='http://localhost:3000/success?session_id={CHECKOUT_SESSION_ID}',
-                cancel_url='http://localhost:3000/cart',
-                customer_email=request.user.email,
-                metadata={
-                    'cart_id': cart.id  
-                }
-            )
-            print(f"Session created successfully with ID: {session.id}")
-            return Response({'sessionId': session.id})
-        except stripe.error.StripeError as e:
-            print(f"Stripe error: {str(e)}")
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-            
-    except Exception as e:
-        print(f"Error creating checkout session: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
-        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    base_url = request.build_absolute_uri('/')
+    line_items = []
+    for _, title, price, image, quantity in items:
+        images = [urljoin(base_url, default_storage.url(image))] if image else []
+        line_items.append({
+            'price_data': {
+                'currency': 'usd',
+                'product_data': {'name': title, 'images': images},
+                'unit_amount': int(price * 100),
+            },
+            'quantity': quantity,
+        })
+
+    try:
+        session_id = await get_payment_provider().create_checkout_session(
+            line_items=line_items,
+            customer_email=user.email,
+            metadata={'cart_id': cart_id},
+            success_url=f'{settings.FRONTEND_URL}/success?session_id={{CHECKOUT_SESSION_ID}}',
+            cancel_url=f'{settings.FRONTEND_URL}/cart',
+        )
+    except PaymentUnavailable as e:
+        logger.warning("Checkout: payment provider unavailable for cart %s: %s", cart_id, e)
+        return JsonResponse({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except PaymentError as e:
+        logger.warning("Checkout: payment error for cart %s: %s", cart_id, e)
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    await sync_to_async(record_session)(
+        session_id, cart_id, user.id,
+        [(listing_id, quantity, price) for listing_id, _, price, _, quantity in items],
+    )
+    logger.info("Checkout: created payment session %s for cart %s", session_id, cart_id)
+    return JsonResponse({'sessionId': session_id})
 
 @csrf_exempt
 def stripe_webhook(request):
+    """Verify and record the event, then acknowledge it; process_webhook_events applies it."""
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
     endpoint_secret = settings.STRIPE_WEBHOOK_SECRET
 
     try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, endpoint_secret
+        stripe.WebhookSignature.verify_header(
+            payload, sig_header, endpoint_secret, tolerance=stripe.Webhook.DEFAULT_TOLERANCE
         )
-    except ValueError as e:
+        event = json.loads(payload)
+        # A signed body that isn't a JSON object would otherwise fail as a 500 and be redelivered
+        if not isinstance(event, dict):
+            return HttpResponse(status=400)
+        record_events([event])
+    except (ValueError, KeyError, TypeError, OverflowError) as e:
         return HttpResponse(status=400)
     except stripe.error.SignatureVerificationError as e:
         return HttpResponse(status=400)
 
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        cart_id = session.get('metadata', {}).get('cart_id')
-        
-        if cart_id:
-            try:
-                cart = Cart.objects.get(id=cart_id)
-                
-                order = Order.objects.create(
-                    user=cart.user,
-                    total_price=cart.total_price,
-                    stripe_session_id=session.id,
-                    status='pending'
-                )
-                
-                for item in cart.items.all():
-                    OrderItem.objects.create(
-                        order=order,
-                        listing=item.listing,
-                        quantity=item.quantity,
-                        price_at_time=item.listing.price
-                    )
-                    
-                    item.listing.is_active = False
-                    item.listing.save()
-                
-                cart.items.clear()
-                
-            except Cart.DoesNotExist:
-                pass
-
     return HttpResponse(status=200)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(QueryPlanMixin, viewsets.ReadOnlyModelViewSet):
+    # Read-only: orders are created by complete_checkout() from a paid session
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = SelectablePagination
     
     def get_queryset(self):
-        buyer_orders = Order.objects.filter(user=self.request.user)
-        
-        seller_orders = Order.objects.filter(
-            items__listing__owner=self.request.user
-        ).distinct()
-        
-        # Combine both querysets
-        return (buyer_orders | seller_orders).order_by('-created_at')
-    
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        # Orders the user bought, plus orders containing the user's listings.
+        # An IN subquery rather than a join, so no DISTINCT is needed.
+        sold = OrderItem.objects.filter(listing__owner=self.request.user).values('order_id')
+        orders = Order.objects.filter(Q(user=self.request.user) | Q(pk__in=sold))
+        return self.with_query_plan(orders.order_by('-created_at'))
+
+    @action(detail=False)
+    def seller_stats(self, request):
+        """Sales of the user's listings from the SellerStats rollups: ?period=day|week|month&start=&end="""
+        period = request.query_params.get('period', 'day')
+        if period not in seller_stats.DEFAULT_RANGE:
+            raise ValidationError({'period': 'Must be day, week or month'})
+        bounds = {name: date_param(request, name) for name in ('start', 'end')}
+        return Response(seller_stats.dashboard(request.user, period, **bounds))
 
 router = DefaultRouter()
 router.register(r'listings', ListingViewSet, basename='listing')
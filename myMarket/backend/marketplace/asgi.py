@@ -2,6 +2,9 @@
 ASGI config for marketplace project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with uvicorn (``gunicorn -k uvicorn.workers.UvicornWorker
+marketplace.asgi:application``) to get the /api/events/ push channel; under
+WSGI that endpoint can't stream.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -0,0 +1,248 @@
+"""
+Per-endpoint request instrumentation.
+
+RequestMetricsMiddleware times every request and records, per route: wall
+time, number of DB queries and time spent in them, time spent serializing and
+response size. Each response gets a Server-Timing header, totals are exposed
+in Prometheus text format by metrics_view, and every request is logged as one
+JSON line on the ``marketplace.requests`` logger (sampled, see SamplingFilter).
+
+Numbers are kept per process; with several gunicorn workers, scrape each
+worker or aggregate downstream.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger('marketplace.requests')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.phases = defaultdict(float)
+        self.active = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook: counts and times every query
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to ``phase`` for the current request. Nested blocks count once."""
+    metrics = _current.get()
+    if metrics is None or phase in metrics.active:
+        yield
+        return
+    metrics.active.add(phase)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.phases[phase] += time.perf_counter() - start
+        metrics.active.discard(phase)
+
+
+class TimedSerializerMixin:
+    """Count a serializer's to_representation() towards the request's 'serialize' time."""
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.response_bytes = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = defaultdict(RouteStats)
+        self._collectors = []
+
+    def observe(self, method, route, status, duration, metrics, size):
+        with self._lock:
+            stats = self._routes[(method, route, str(status))]
+            stats.count += 1
+            stats.duration += duration
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    stats.buckets[index] += 1
+            stats.queries += metrics.queries
+            stats.db_time += metrics.db_time
+            stats.serialize_time += metrics.phases['serialize']
+            stats.response_bytes += size
+
+    def register_collector(self, collector):
+        """Add a callable returning ``(name, help, type, value)`` tuples to the exposition."""
+        self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            routes = sorted(self._routes.items())
+        lines = []
+
+        def family(name, help_text, metric_type):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+        family('http_request_duration_seconds', 'Request wall time by route.', 'histogram')
+        for (method, route, status), stats in routes:
+            labels = f'method="{method}",route="{route}",status="{status}"'
+            for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {stats.duration:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {stats.count}')
+
+        for name, help_text, attribute in (
+            ('http_db_queries_total', 'Database queries issued by route.', 'queries'),
+            ('http_db_duration_seconds_total', 'Time spent in database queries by route.', 'db_time'),
+            ('http_serialize_duration_seconds_total', 'Time spent in serializers by route.', 'serialize_time'),
+            ('http_response_bytes_total', 'Response body bytes by route.', 'response_bytes'),
+        ):
+            family(name, help_text, 'counter')
+            for (method, route, status), stats in routes:
+                labels = f'method="{method}",route="{route}",status="{status}"'
+                lines.append(f'{name}{{{labels}}} {getattr(stats, attribute)}')
+
+        for collector in self._collectors:
+            for name, help_text, metric_type, value in collector():
+                family(name, help_text, metric_type)
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class SamplingFilter(logging.Filter):
+    """Pass only a fraction of records below WARNING; warnings and errors always pass."""
+
+    def __init__(self, rate=None):
+        super().__init__()
+        self.rate = settings.LOG_SAMPLE_RATE if rate is None else rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or getattr(record, 'always_log', False):
+            return True
+        return random.random() < self.rate
+
+
+class RequestMetricsMiddleware:
+    # Async-capable so async views and streams under ASGI don't get a thread hop here
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with _wrap_connections(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with _wrap_connections(metrics):
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, metrics, time.perf_counter() - start)
+
+    def record(self, request, response, metrics, duration):
+        match = getattr(request, 'resolver_match', None)
+        route = (match.view_name or match.route) if match else 'unmatched'
+        size = 0 if response.streaming else len(response.content)
+        registry.observe(request.method, route, response.status_code, duration, metrics, size)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+            f'serialize;dur={metrics.phases["serialize"] * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+
+        slow = duration * 1000 >= settings.SLOW_REQUEST_MS
+        logger.log(
+            logging.WARNING if response.status_code >= 500 else logging.INFO,
+            json.dumps({
+                'method': request.method,
+                'route': route,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'queries': metrics.queries,
+                'db_ms': round(metrics.db_time * 1000, 2),
+                'serialize_ms': round(metrics.phases['serialize'] * 1000, 2),
+                'bytes': size,
+                'user_id': getattr(getattr(request, 'user', None), 'id', None),
+            }),
+            extra={'always_log': slow},
+        )
+        return response
+
+
+@contextmanager
+def _wrap_connections(metrics):
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics))
+        yield
+
+
+def metrics_view(request):
+    """
+    Prometheus text exposition; requires ``Authorization: Bearer $METRICS_TOKEN``.
+    Without METRICS_TOKEN it is only served when DEBUG is on.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'
+        if not constant_time_compare(request.headers.get('Authorization', ''), expected):
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
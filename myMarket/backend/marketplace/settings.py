@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from datetime import timedelta
 import dj_database_url
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'marketplace.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -82,6 +84,26 @@ DATABASES = {
     )
 }
 
+# Cache. Without REDIS_URL each process has its own locmem cache, and the
+# listing response cache (which needs one shared by every process) is off.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Public listing responses are cached here and invalidated by Listing/User signals
+LISTING_CACHE_ALIAS = os.environ.get('LISTING_CACHE_ALIAS', 'default')
+LISTING_CACHE_TIMEOUT = int(os.environ.get('LISTING_CACHE_TIMEOUT', 300))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -119,7 +141,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'listings.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -128,12 +150,60 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
+# Listing views are buffered per process and flushed after this many seconds
+# or once this many distinct listings are pending, whichever comes first
+VIEW_COUNT_FLUSH_INTERVAL = int(os.environ.get('VIEW_COUNT_FLUSH_INTERVAL', 10))
+VIEW_COUNT_FLUSH_THRESHOLD = int(os.environ.get('VIEW_COUNT_FLUSH_THRESHOLD', 200))
+
+# Upper bound on ranked ids pulled from the full-text index per search
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 1000))
+
+# Listing ?near=lat,lng&radius=km searches (see listings/geo.py). A search
+# scans at most GEO_MAX_CELLS geohash cells, using the finest cell size that
+# covers the circle within that many.
+GEO_DEFAULT_RADIUS_KM = float(os.environ.get('GEO_DEFAULT_RADIUS_KM', 25))
+GEO_MAX_RADIUS_KM = float(os.environ.get('GEO_MAX_RADIUS_KM', 500))
+GEO_MAX_CELLS = int(os.environ.get('GEO_MAX_CELLS', 16))
+
+# build_recommendations keeps this many neighbours per listing and learns from
+# views of the last RECOMMENDATION_VIEW_DAYS days (older ones are deleted)
+RECOMMENDATION_NEIGHBORS = int(os.environ.get('RECOMMENDATION_NEIGHBORS', 20))
+RECOMMENDATION_VIEW_DAYS = int(os.environ.get('RECOMMENDATION_VIEW_DAYS', 30))
+
+# rollup_prices deletes raw price changes older than PRICE_HISTORY_RAW_DAYS
+# (the daily rollups are kept). The price drop feed looks back PRICE_DROP_DAYS
+# unless ?days= asks for more, up to PRICE_HISTORY_RAW_DAYS.
+PRICE_HISTORY_RAW_DAYS = int(os.environ.get('PRICE_HISTORY_RAW_DAYS', 90))
+PRICE_DROP_DAYS = int(os.environ.get('PRICE_DROP_DAYS', 7))
+
+# Lower edges of the price buckets in listing facet counts; the last bucket is
+# open-ended. Run rebuild_listing_facets after changing them.
+LISTING_PRICE_BUCKETS = [int(edge) for edge in os.environ.get('LISTING_PRICE_BUCKETS', '0,25,50,100,250,500,1000').split(',')]
+
+# Conversation events pushed over /api/events/ (needs an ASGI server). The
+# in-process broker only reaches clients of the same process, so events go
+# through Redis pub/sub whenever Redis is configured.
+REALTIME_REDIS_URL = os.environ.get('REALTIME_REDIS_URL', os.environ.get('REDIS_URL'))
+REALTIME_BROKER = os.environ.get(
+    'REALTIME_BROKER',
+    'listings.realtime.RedisBroker' if REALTIME_REDIS_URL else 'listings.realtime.InProcessBroker',
+)
+REALTIME_KEEPALIVE_SECONDS = int(os.environ.get('REALTIME_KEEPALIVE_SECONDS', 15))
+
 # JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    'TOKEN_OBTAIN_SERIALIZER': 'listings.serializers.TokenObtainPairWithClaimsSerializer',
 }
 
+# Authenticated users are cached this many seconds, so most requests skip the users table
+AUTH_USER_CACHE_ALIAS = os.environ.get('AUTH_USER_CACHE_ALIAS', 'default')
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', 60))
+
+# Seconds a user's cart id stays cached (see Cart.id_for_user)
+CART_ID_CACHE_TIMEOUT = int(os.environ.get('CART_ID_CACHE_TIMEOUT', 3600))
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = os.environ.get('CORS_ALLOWED_ORIGINS', 'http://localhost:3000,https://checkout.stripe.com').split(',')
 CORS_ALLOW_CREDENTIALS = True
@@ -143,13 +213,30 @@ FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
 
 # Email settings
 DEBUG = True
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Emails are queued in OutboundEmail and delivered by `manage.py send_queued_email`.
+# Set EMAIL_BACKEND to django.core.mail.backends.console.EmailBackend or
+# django.core.mail.backends.filebased.EmailBackend (with EMAIL_FILE_PATH) to work offline.
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_FILE_PATH = os.environ.get('EMAIL_FILE_PATH', os.path.join(BASE_DIR, 'sent_emails'))
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL')
+EMAIL_QUEUE_BATCH_SIZE = int(os.environ.get('EMAIL_QUEUE_BATCH_SIZE', 100))
+EMAIL_QUEUE_MAX_ATTEMPTS = int(os.environ.get('EMAIL_QUEUE_MAX_ATTEMPTS', 5))
+
+# Resized copies rendered by process_images for listing and profile images
+IMAGE_VARIANT_WIDTHS = [int(width) for width in os.environ.get('IMAGE_VARIANT_WIDTHS', '320,640,1280').split(',')]
+IMAGE_VARIANT_FORMATS = os.environ.get('IMAGE_VARIANT_FORMATS', 'webp,jpeg').split(',')
+IMAGE_VARIANT_QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', 80))
+IMAGE_QUEUE_BATCH_SIZE = int(os.environ.get('IMAGE_QUEUE_BATCH_SIZE', 20))
+IMAGE_QUEUE_MAX_ATTEMPTS = int(os.environ.get('IMAGE_QUEUE_MAX_ATTEMPTS', 3))
+
+# Stored payment webhooks are applied by process_webhook_events
+WEBHOOK_QUEUE_BATCH_SIZE = int(os.environ.get('WEBHOOK_QUEUE_BATCH_SIZE', 100))
+WEBHOOK_QUEUE_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_QUEUE_MAX_ATTEMPTS', 8))
 
 # Allow all origins in development
 if DEBUG:
@@ -210,9 +297,58 @@ else:
     # Disable security middleware in development
     MIDDLEWARE = [m for m in MIDDLEWARE if m != 'django.middleware.security.SecurityMiddleware']
 
+# Request metrics and logging
+# Per-request log lines below WARNING are kept at this rate; requests slower
+# than SLOW_REQUEST_MS are always logged. /metrics needs METRICS_TOKEN as a
+# bearer token, and without one is only served with DEBUG on.
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Per-request lines are left out of `manage.py test` output unless asked for
+TESTING = sys.argv[1:2] == ['test']
+REQUEST_LOG_LEVEL = os.environ.get('REQUEST_LOG_LEVEL', 'WARNING' if TESTING else 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampled': {
+            '()': 'marketplace.metrics.SamplingFilter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'filters': ['sampled'],
+        },
+    },
+    'loggers': {
+        'marketplace.requests': {
+            'handlers': ['console'],
+            'level': REQUEST_LOG_LEVEL,
+            'propagate': False,
+        },
+        'listings': {
+            'handlers': ['console'],
+            'level': os.environ.get('APP_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Stripe settings
 STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY')
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
 
+# Checkout sessions are created through this provider (see listings/payments.py);
+# listings.payments.FakeProvider needs no network, for benchmarks and development
+PAYMENT_PROVIDER = os.environ.get('PAYMENT_PROVIDER', 'listings.payments.StripeProvider')
+PAYMENT_TIMEOUT_SECONDS = float(os.environ.get('PAYMENT_TIMEOUT_SECONDS', 10))
+PAYMENT_MAX_RETRIES = int(os.environ.get('PAYMENT_MAX_RETRIES', 1))
+PAYMENT_POOL_SIZE = int(os.environ.get('PAYMENT_POOL_SIZE', 10))
+PAYMENT_BREAKER_FAILURES = int(os.environ.get('PAYMENT_BREAKER_FAILURES', 5))
+PAYMENT_BREAKER_RESET_SECONDS = int(os.environ.get('PAYMENT_BREAKER_RESET_SECONDS', 30))
+PAYMENT_FAKE_LATENCY_MS = int(os.environ.get('PAYMENT_FAKE_LATENCY_MS', 0))
+
 
@@ -10,6 +10,7 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 from django.views.generic import RedirectView
+from marketplace.metrics import metrics_view
 from listings.views import user_profile, register_user, verify_email, request_password_reset, reset_password  # Using the original listings app
 
 schema_view = get_schema_view(
@@ -29,6 +30,7 @@ urlpatterns = [
     path('', RedirectView.as_view(url='/api/', permanent=False)),
     
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/', include('listings.urls')),  # Using the original listings app
     path('api/user/profile/', user_profile, name='user-profile'),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
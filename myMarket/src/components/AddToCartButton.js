@@ -42,7 +42,7 @@ function AddToCartButton({ listingId }) {
       });
       console.log('Add item response:', addResponse.data);
 
-      if (!addResponse.data || !addResponse.data.items) {
+      if (!addResponse.data || addResponse.data.quantity === undefined) {
         console.error('Invalid add item response:', addResponse);
         throw new Error('Invalid response from server');
       }